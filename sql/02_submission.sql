@@ -86,32 +86,117 @@ CREATE TABLE  submission_score (
 COMMENT ON TABLE submission_score IS 'Summary of scores for a system.';
 CREATE INDEX submission_score_submission_idx ON submission_score(submission_id);
 
-DROP MATERIALIZED VIEW IF EXISTS submission_mention_link CASCADE;
-CREATE MATERIALIZED VIEW submission_mention_link AS (
- SELECT 
-    m.submission_id,
-    m.doc_id,
-    m.span,
-    m.mention_type,
-    m.gloss,
-    n.span AS canonical_span,
-    CASE
-        WHEN n.mention_type = 'TITLE' THEN 'gloss:' || n.gloss
-        WHEN n.mention_type = 'DATE' THEN 'date:' || n.gloss
-        ELSE 'gloss:' || n.gloss
-    END AS canonical_gloss,
-    CASE
-        WHEN n.mention_type = 'TITLE' THEN 'gloss:' || n.gloss
-        WHEN n.mention_type = 'DATE' THEN COALESCE(l.link_name, 'date:' || n.gloss)
-        ELSE COALESCE(l.link_name, 'gloss:' || n.gloss)
-    END AS entity
-   FROM submission_mention m
-   JOIN submission_mention n ON (m.submission_id = n.submission_id AND m.doc_id = n.doc_id AND m.canonical_span = n.span)
-   LEFT JOIN submission_link l ON (m.submission_id = l.submission_id AND m.doc_id = l.doc_id AND m.canonical_span = l.span)
+-- The tables below are derived from submission_mention,
+-- submission_link and submission_relation. They are maintained per
+-- submission by update_submission_tables (called when a submission
+-- is uploaded) rather than as materialized views, so that uploads do
+-- not recompute every other submission.
+
+-- submission_mention_link
+CREATE TABLE  submission_mention_link (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  doc_id TEXT NOT NULL,
+  span INT4RANGE NOT NULL,
+  mention_type TEXT NOT NULL,
+  gloss TEXT,
+  canonical_span INT4RANGE NOT NULL,
+  canonical_gloss TEXT,
+  entity TEXT,
+
+  PRIMARY KEY (submission_id, doc_id, span)
 );
+COMMENT ON TABLE submission_mention_link IS 'Mentions of a submission with their canonical mentions and entity links';
 
-DROP MATERIALIZED VIEW IF EXISTS submission_entity_relation CASCADE;
-CREATE MATERIALIZED VIEW submission_entity_relation AS (
+-- submission_entity_relation
+CREATE TABLE  submission_entity_relation (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  doc_id TEXT NOT NULL,
+  subject INT4RANGE NOT NULL,
+  object INT4RANGE NOT NULL,
+  subject_gloss TEXT,
+  object_gloss TEXT,
+  subject_canonical INT4RANGE,
+  object_canonical INT4RANGE,
+  subject_canonical_gloss TEXT,
+  object_canonical_gloss TEXT,
+  subject_type TEXT,
+  object_type TEXT,
+  subject_entity TEXT,
+  object_entity TEXT,
+  relation TEXT NOT NULL,
+  provenances INT4RANGE[] NOT NULL,
+  confidence REAL,
+
+  PRIMARY KEY (submission_id, doc_id, subject, object)
+);
+COMMENT ON TABLE submission_entity_relation IS 'Relations of a submission with their entities';
+CREATE INDEX submission_entity_relation_doc_idx ON submission_entity_relation(doc_id, subject, object);
+
+-- submission_statistics
+CREATE TABLE  submission_statistics (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  subject_entity TEXT,
+  relation TEXT NOT NULL,
+  object_entity TEXT,
+  count BIGINT NOT NULL
+);
+CREATE INDEX submission_statistics_submission_idx ON submission_statistics(submission_id);
+
+CREATE TABLE  submission_relation_counts (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  relation TEXT NOT NULL,
+  count NUMERIC NOT NULL
+);
+CREATE INDEX submission_relation_counts_submission_idx ON submission_relation_counts(submission_id, relation);
+
+CREATE TABLE  submission_entity_counts (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  subject_entity TEXT,
+  count NUMERIC NOT NULL
+);
+CREATE INDEX submission_entity_counts_submission_idx ON submission_entity_counts(submission_id, subject_entity);
+
+CREATE TABLE  submission_entity_relation_counts (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  subject_entity TEXT,
+  count BIGINT NOT NULL
+);
+CREATE INDEX submission_entity_relation_counts_submission_idx ON submission_entity_relation_counts(submission_id, subject_entity);
+
+-- Recomputes the derived tables above for a single submission.
+CREATE OR REPLACE FUNCTION update_submission_tables(sid INTEGER) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM submission_entity_relation_counts WHERE submission_id = sid;
+    DELETE FROM submission_entity_counts WHERE submission_id = sid;
+    DELETE FROM submission_relation_counts WHERE submission_id = sid;
+    DELETE FROM submission_statistics WHERE submission_id = sid;
+    DELETE FROM submission_entity_relation WHERE submission_id = sid;
+    DELETE FROM submission_mention_link WHERE submission_id = sid;
+
+    INSERT INTO submission_mention_link (submission_id, doc_id, span, mention_type, gloss, canonical_span, canonical_gloss, entity)
+    SELECT 
+        m.submission_id,
+        m.doc_id,
+        m.span,
+        m.mention_type,
+        m.gloss,
+        n.span AS canonical_span,
+        CASE
+            WHEN n.mention_type = 'TITLE' THEN 'gloss:' || n.gloss
+            WHEN n.mention_type = 'DATE' THEN 'date:' || n.gloss
+            ELSE 'gloss:' || n.gloss
+        END AS canonical_gloss,
+        CASE
+            WHEN n.mention_type = 'TITLE' THEN 'gloss:' || n.gloss
+            WHEN n.mention_type = 'DATE' THEN COALESCE(l.link_name, 'date:' || n.gloss)
+            ELSE COALESCE(l.link_name, 'gloss:' || n.gloss)
+        END AS entity
+    FROM submission_mention m
+    JOIN submission_mention n ON (m.submission_id = n.submission_id AND m.doc_id = n.doc_id AND m.canonical_span = n.span)
+    LEFT JOIN submission_link l ON (m.submission_id = l.submission_id AND m.doc_id = l.doc_id AND m.canonical_span = l.span)
+    WHERE m.submission_id = sid;
+
+    INSERT INTO submission_entity_relation
     SELECT s.submission_id,
            s.doc_id,
            s.subject,
@@ -129,39 +214,37 @@ CREATE MATERIALIZED VIEW submission_entity_relation AS (
            s.relation,
            s.provenances,
            s.confidence
-        FROM submission_relation s
-        JOIN submission_mention_link m ON (s.submission_id = m.submission_id AND s.doc_id = m.doc_id AND s.subject = m.span)
-        JOIN submission_mention_link n ON (s.submission_id = n.submission_id AND s.doc_id = n.doc_id AND s.object = n.span)
-);
+    FROM submission_relation s
+    JOIN submission_mention_link m ON (s.submission_id = m.submission_id AND s.doc_id = m.doc_id AND s.subject = m.span)
+    JOIN submission_mention_link n ON (s.submission_id = n.submission_id AND s.doc_id = n.doc_id AND s.object = n.span)
+    WHERE s.submission_id = sid;
 
-DROP MATERIALIZED VIEW IF EXISTS submission_statistics CASCADE;
-CREATE MATERIALIZED VIEW submission_statistics AS (
+    INSERT INTO submission_statistics
     SELECT s.submission_id, subject_entity, relation, 
         CASE WHEN is_entity_type(FIRST(object_type)) THEN object_entity
         ELSE 'STRING' END AS object_entity, COUNT(*) 
     FROM submission_entity_relation s
-    GROUP BY s.submission_id, subject_entity, relation, object_entity
-);
+    WHERE s.submission_id = sid
+    GROUP BY s.submission_id, subject_entity, relation, object_entity;
 
-DROP MATERIALIZED VIEW IF EXISTS submission_relation_counts;
-CREATE MATERIALIZED VIEW submission_relation_counts AS (
+    INSERT INTO submission_relation_counts
     SELECT submission_id, relation, SUM(count) AS count
     FROM submission_statistics
-    GROUP BY submission_id, relation
-);
+    WHERE submission_id = sid
+    GROUP BY submission_id, relation;
 
-DROP MATERIALIZED VIEW IF EXISTS submission_entity_counts;
-CREATE MATERIALIZED VIEW submission_entity_counts AS (
+    INSERT INTO submission_entity_counts
     SELECT submission_id, subject_entity, SUM(count) AS count
     FROM submission_statistics
-    GROUP BY submission_id, subject_entity
-);
+    WHERE submission_id = sid
+    GROUP BY submission_id, subject_entity;
 
-DROP MATERIALIZED VIEW IF EXISTS submission_entity_relation_counts;
-CREATE MATERIALIZED VIEW submission_entity_relation_counts AS (
+    INSERT INTO submission_entity_relation_counts
     SELECT submission_id, subject_entity, COUNT(DISTINCT object_entity)
     FROM submission_statistics
-    GROUP BY submission_id, subject_entity
-);
+    WHERE submission_id = sid
+    GROUP BY submission_id, subject_entity;
+END;
+$$ LANGUAGE plpgsql;
 
 COMMIT;
@@ -30,6 +30,7 @@ CREATE TABLE submission_sample (
   subject INT4RANGE NOT NULL,
   object INT4RANGE NOT NULL,
   created TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+  weight REAL NOT NULL DEFAULT 1.0, -- importance weight p(x)/r(x) when the sample was drawn from some r other than the submission's distribution p
 
   PRIMARY KEY (submission_id, doc_id, subject, object, batch_id),
   CONSTRAINT relation_exists FOREIGN KEY (submission_id, doc_id, subject, object) REFERENCES submission_relation
@@ -29,6 +29,12 @@ CREATE TABLE evaluation_question (
   PRIMARY KEY (batch_id, id)
 ); -- DISTRIBUTED BY (batch_id);
 COMMENT ON TABLE evaluation_question IS 'Keeps track of an individual question part of an evaluation batch';
+-- Matches the keys of evaluation_relation_question (see kbpo.questions).
+CREATE INDEX evaluation_question_relation_idx ON evaluation_question (
+    (params->>'doc_id'),
+    int4range((params#>>'{subject,span,0}')::integer, (params#>>'{subject,span,1}')::integer),
+    int4range((params#>>'{object,span,0}')::integer, (params#>>'{object,span,1}')::integer))
+    WHERE state <> 'done';
 
 -- Views that keep track of inflight requests.
 DROP VIEW IF EXISTS evaluation_doc_question;
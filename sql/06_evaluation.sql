@@ -139,6 +139,7 @@ CREATE MATERIALIZED VIEW evaluation_mention_link AS (
         WHEN m.mention_type = 'DATE' THEN COALESCE(l.link_name, 'date:' || m.gloss)
         ELSE COALESCE(l.link_name, 'gloss:' || m.gloss)
     END AS entity,
+    l.link_name,
     m.weight AS mention_weight,
     l.weight AS link_weight,
     l.correct AS link_correct
@@ -146,6 +147,8 @@ CREATE MATERIALIZED VIEW evaluation_mention_link AS (
    LEFT JOIN evaluation_link l ON m.doc_id = l.doc_id AND (m.span = l.span)
    WHERE NOT (m.mention_type = 'TITLE' AND substring(l.link_name, 0, 6) = 'wiki:') -- ignore wiki links with titles.
 );
+-- Unique indexes allow the views to be refreshed CONCURRENTLY (see kbpo.refresh).
+CREATE UNIQUE INDEX evaluation_mention_link_key ON evaluation_mention_link(doc_id, span, link_name);
 
 DROP MATERIALIZED VIEW IF EXISTS evaluation_entity_relation;
 CREATE MATERIALIZED VIEW evaluation_entity_relation AS (
@@ -159,6 +162,8 @@ CREATE MATERIALIZED VIEW evaluation_entity_relation AS (
     n.gloss AS  object_gloss,
     m.entity AS subject_entity,
     n.entity AS object_entity,
+    m.link_name AS subject_link_name,
+    n.link_name AS object_link_name,
     m.link_correct AS subject_entity_correct, -- could be null
     n.link_correct AS object_entity_correct,  -- could be null
     r.relation,
@@ -167,6 +172,7 @@ CREATE MATERIALIZED VIEW evaluation_entity_relation AS (
      JOIN evaluation_mention_link m ON r.doc_id = m.doc_id AND r.subject = m.span
      JOIN evaluation_mention_link n ON r.doc_id = n.doc_id AND r.object = n.span
 );
+CREATE UNIQUE INDEX evaluation_entity_relation_key ON evaluation_entity_relation(doc_id, subject, object, subject_link_name, object_link_name);
 
 DROP MATERIALIZED VIEW IF EXISTS submission_entries_list CASCADE;
 CREATE MATERIALIZED VIEW submission_entries_list AS (
@@ -176,6 +182,8 @@ CREATE MATERIALIZED VIEW submission_entries_list AS (
     r.doc_id,
     r.subject,
     r.object,
+    er.subject_link_name AS subject_link_name_gold,
+    er.object_link_name AS object_link_name_gold,
 
     -- Entity linking stuff
     r.subject_type,
@@ -211,6 +219,7 @@ CREATE MATERIALIZED VIEW submission_entries_list AS (
     -- match OR the subject's canonical gloss will match. 
     JOIN evaluation_entity_relation er ON (r.doc_id = er.doc_id AND r.subject = er.subject AND r.object = er.object)
 );
+CREATE UNIQUE INDEX submission_entries_list_key ON submission_entries_list(submission_id, doc_id, subject, object, subject_link_name_gold, object_link_name_gold);
 
 DROP MATERIALIZED VIEW IF EXISTS submission_entries;
 CREATE MATERIALIZED VIEW submission_entries AS (
@@ -254,5 +263,24 @@ CREATE MATERIALIZED VIEW submission_entries AS (
             subject_entity_match DESC, object_entity_match DESC,
             r.subject_entity_correct, r.object_entity_correct  
 );
+CREATE UNIQUE INDEX submission_entries_key ON submission_entries(submission_id, doc_id, subject, object);
+
+-- Bookkeeping for kbpo.refresh: when each materialized view was last
+-- requested and refreshed, and how long its refreshes took.
+CREATE TABLE  view_refresh (
+  view_name TEXT PRIMARY KEY,
+  requested TIMESTAMP, -- the latest time at which the view's sources changed
+  refreshed TIMESTAMP, -- the start of the latest completed refresh
+  duration REAL -- of the latest completed refresh, in seconds
+);
+COMMENT ON TABLE view_refresh IS 'Refresh requests for materialized views';
+
+CREATE TABLE  view_refresh_log (
+  view_name TEXT NOT NULL,
+  started TIMESTAMP NOT NULL,
+  duration REAL NOT NULL
+);
+COMMENT ON TABLE view_refresh_log IS 'Durations of materialized view refreshes';
+CREATE INDEX view_refresh_log_view_idx ON view_refresh_log(view_name, started);
 
 COMMIT;
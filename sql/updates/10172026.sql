@@ -0,0 +1,259 @@
+SET search_path TO kbpo;
+
+BEGIN TRANSACTION;
+
+-- Replaces the submission_* materialized views with tables maintained by update_submission_tables.
+-- NOTE: this cascades to submission_entries_list and submission_entries, which are recreated below.
+DROP MATERIALIZED VIEW IF EXISTS submission_mention_link CASCADE;
+
+-- The tables below are derived from submission_mention,
+-- submission_link and submission_relation. They are maintained per
+-- submission by update_submission_tables (called when a submission
+-- is uploaded) rather than as materialized views, so that uploads do
+-- not recompute every other submission.
+
+-- submission_mention_link
+CREATE TABLE  submission_mention_link (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  doc_id TEXT NOT NULL,
+  span INT4RANGE NOT NULL,
+  mention_type TEXT NOT NULL,
+  gloss TEXT,
+  canonical_span INT4RANGE NOT NULL,
+  canonical_gloss TEXT,
+  entity TEXT,
+
+  PRIMARY KEY (submission_id, doc_id, span)
+);
+COMMENT ON TABLE submission_mention_link IS 'Mentions of a submission with their canonical mentions and entity links';
+
+-- submission_entity_relation
+CREATE TABLE  submission_entity_relation (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  doc_id TEXT NOT NULL,
+  subject INT4RANGE NOT NULL,
+  object INT4RANGE NOT NULL,
+  subject_gloss TEXT,
+  object_gloss TEXT,
+  subject_canonical INT4RANGE,
+  object_canonical INT4RANGE,
+  subject_canonical_gloss TEXT,
+  object_canonical_gloss TEXT,
+  subject_type TEXT,
+  object_type TEXT,
+  subject_entity TEXT,
+  object_entity TEXT,
+  relation TEXT NOT NULL,
+  provenances INT4RANGE[] NOT NULL,
+  confidence REAL,
+
+  PRIMARY KEY (submission_id, doc_id, subject, object)
+);
+COMMENT ON TABLE submission_entity_relation IS 'Relations of a submission with their entities';
+CREATE INDEX submission_entity_relation_doc_idx ON submission_entity_relation(doc_id, subject, object);
+
+-- submission_statistics
+CREATE TABLE  submission_statistics (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  subject_entity TEXT,
+  relation TEXT NOT NULL,
+  object_entity TEXT,
+  count BIGINT NOT NULL
+);
+CREATE INDEX submission_statistics_submission_idx ON submission_statistics(submission_id);
+
+CREATE TABLE  submission_relation_counts (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  relation TEXT NOT NULL,
+  count NUMERIC NOT NULL
+);
+CREATE INDEX submission_relation_counts_submission_idx ON submission_relation_counts(submission_id, relation);
+
+CREATE TABLE  submission_entity_counts (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  subject_entity TEXT,
+  count NUMERIC NOT NULL
+);
+CREATE INDEX submission_entity_counts_submission_idx ON submission_entity_counts(submission_id, subject_entity);
+
+CREATE TABLE  submission_entity_relation_counts (
+  submission_id INTEGER NOT NULL REFERENCES submission(id),
+  subject_entity TEXT,
+  count BIGINT NOT NULL
+);
+CREATE INDEX submission_entity_relation_counts_submission_idx ON submission_entity_relation_counts(submission_id, subject_entity);
+
+-- Recomputes the derived tables above for a single submission.
+CREATE OR REPLACE FUNCTION update_submission_tables(sid INTEGER) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM submission_entity_relation_counts WHERE submission_id = sid;
+    DELETE FROM submission_entity_counts WHERE submission_id = sid;
+    DELETE FROM submission_relation_counts WHERE submission_id = sid;
+    DELETE FROM submission_statistics WHERE submission_id = sid;
+    DELETE FROM submission_entity_relation WHERE submission_id = sid;
+    DELETE FROM submission_mention_link WHERE submission_id = sid;
+
+    INSERT INTO submission_mention_link (submission_id, doc_id, span, mention_type, gloss, canonical_span, canonical_gloss, entity)
+    SELECT 
+        m.submission_id,
+        m.doc_id,
+        m.span,
+        m.mention_type,
+        m.gloss,
+        n.span AS canonical_span,
+        CASE
+            WHEN n.mention_type = 'TITLE' THEN 'gloss:' || n.gloss
+            WHEN n.mention_type = 'DATE' THEN 'date:' || n.gloss
+            ELSE 'gloss:' || n.gloss
+        END AS canonical_gloss,
+        CASE
+            WHEN n.mention_type = 'TITLE' THEN 'gloss:' || n.gloss
+            WHEN n.mention_type = 'DATE' THEN COALESCE(l.link_name, 'date:' || n.gloss)
+            ELSE COALESCE(l.link_name, 'gloss:' || n.gloss)
+        END AS entity
+    FROM submission_mention m
+    JOIN submission_mention n ON (m.submission_id = n.submission_id AND m.doc_id = n.doc_id AND m.canonical_span = n.span)
+    LEFT JOIN submission_link l ON (m.submission_id = l.submission_id AND m.doc_id = l.doc_id AND m.canonical_span = l.span)
+    WHERE m.submission_id = sid;
+
+    INSERT INTO submission_entity_relation
+    SELECT s.submission_id,
+           s.doc_id,
+           s.subject,
+           s.object,
+           m.gloss AS subject_gloss,
+           n.gloss AS object_gloss,
+           m.canonical_span AS subject_canonical,
+           n.canonical_span AS  object_canonical,
+           m.canonical_gloss AS subject_canonical_gloss,
+           n.canonical_gloss AS  object_canonical_gloss,
+           m.mention_type AS subject_type,
+           n.mention_type AS object_type,
+           m.entity AS subject_entity,
+           n.entity AS object_entity,
+           s.relation,
+           s.provenances,
+           s.confidence
+    FROM submission_relation s
+    JOIN submission_mention_link m ON (s.submission_id = m.submission_id AND s.doc_id = m.doc_id AND s.subject = m.span)
+    JOIN submission_mention_link n ON (s.submission_id = n.submission_id AND s.doc_id = n.doc_id AND s.object = n.span)
+    WHERE s.submission_id = sid;
+
+    INSERT INTO submission_statistics
+    SELECT s.submission_id, subject_entity, relation, 
+        CASE WHEN is_entity_type(FIRST(object_type)) THEN object_entity
+        ELSE 'STRING' END AS object_entity, COUNT(*) 
+    FROM submission_entity_relation s
+    WHERE s.submission_id = sid
+    GROUP BY s.submission_id, subject_entity, relation, object_entity;
+
+    INSERT INTO submission_relation_counts
+    SELECT submission_id, relation, SUM(count) AS count
+    FROM submission_statistics
+    WHERE submission_id = sid
+    GROUP BY submission_id, relation;
+
+    INSERT INTO submission_entity_counts
+    SELECT submission_id, subject_entity, SUM(count) AS count
+    FROM submission_statistics
+    WHERE submission_id = sid
+    GROUP BY submission_id, subject_entity;
+
+    INSERT INTO submission_entity_relation_counts
+    SELECT submission_id, subject_entity, COUNT(DISTINCT object_entity)
+    FROM submission_statistics
+    WHERE submission_id = sid
+    GROUP BY submission_id, subject_entity;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT update_submission_tables(id) FROM submission;
+
+DROP MATERIALIZED VIEW IF EXISTS submission_entries_list CASCADE;
+CREATE MATERIALIZED VIEW submission_entries_list AS (
+    SELECT
+    -- Keys
+    r.submission_id,
+    r.doc_id,
+    r.subject,
+    r.object,
+
+    -- Entity linking stuff
+    r.subject_type,
+    r.subject_gloss,
+    r.subject_canonical_gloss,
+    r.subject_entity,
+    er.subject_entity AS subject_entity_gold,
+
+    r.object_type,
+    r.object_gloss,
+    r.object_canonical_gloss,
+    r.object_entity,
+    er.object_entity AS object_entity_gold,
+
+    -- Relations
+    r.relation AS predicate_name,
+    er.relation AS predicate_gold,
+
+    -- Labels
+    r.subject_type = er.subject_type AS subject_type_match,
+    r.object_type = er.object_type AS object_type_match,
+
+    r.subject_entity = er.subject_entity OR r.subject_canonical_gloss = er.subject_entity AS subject_entity_match,
+    er.subject_entity_correct AS matched_subject_entity_correct,
+    r.object_entity = er.object_entity OR r.object_canonical_gloss = er.object_entity AS object_entity_match,
+    er.object_entity_correct AS matched_object_entity_correct,
+
+    r.relation = er.relation AS matched_predicate_correct
+
+    FROM submission_entity_relation r
+    -- In the current format of the linking, we have two rows, one for
+    -- the entity link, and the other for the entity gloss
+    -- match OR the subject's canonical gloss will match. 
+    JOIN evaluation_entity_relation er ON (r.doc_id = er.doc_id AND r.subject = er.subject AND r.object = er.object)
+);
+
+DROP MATERIALIZED VIEW IF EXISTS submission_entries;
+CREATE MATERIALIZED VIEW submission_entries AS (
+    WITH _null_columns AS (
+        SELECT *,
+            CASE 
+                WHEN subject_type_match AND subject_entity_match THEN matched_subject_entity_correct 
+                ELSE NULL 
+            END AS subject_entity_correct,
+
+            CASE 
+                WHEN object_type_match AND object_entity_match THEN matched_object_entity_correct 
+                ELSE NULL 
+            END AS object_entity_correct,
+
+            CASE 
+                WHEN subject_type_match AND object_type_match THEN matched_predicate_correct
+                ELSE NULL 
+            END AS predicate_correct
+        FROM submission_entries_list)
+    SELECT DISTINCT ON (r.submission_id, r.doc_id, r.subject, r.object)
+    -- Document viewing stuff
+    d.title,
+    t.tag AS corpus_tag,
+    s.gloss AS sentence,
+    s.span AS sentence_span,
+
+    -- Keys
+    r.*,
+
+    -- Labels
+    r.subject_entity_correct AND r.object_entity_correct  AND r.predicate_correct AS correct
+
+    FROM 
+    _null_columns r
+    JOIN sentence s ON (s.doc_id = r.doc_id AND s.span @> r.subject)
+    JOIN document d ON (r.doc_id = d.id)
+    JOIN document_tag t ON (r.doc_id = t.doc_id)
+    ORDER BY r.submission_id, r.doc_id, r.subject, r.object,
+            subject_type_match DESC, object_type_match DESC,
+            subject_entity_match DESC, object_entity_match DESC,
+            r.subject_entity_correct, r.object_entity_correct  
+);
+
+COMMIT;
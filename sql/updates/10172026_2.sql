@@ -0,0 +1,162 @@
+SET search_path TO kbpo;
+
+BEGIN TRANSACTION;
+
+-- Recreates the evaluation views with the unique indexes needed to refresh them CONCURRENTLY.
+DROP MATERIALIZED VIEW IF EXISTS evaluation_mention_link CASCADE;
+CREATE MATERIALIZED VIEW evaluation_mention_link AS (
+ SELECT 
+    m.doc_id,
+    m.span,
+    m.mention_type,
+    m.gloss,
+    CASE
+        WHEN m.mention_type = 'TITLE' THEN 'gloss:' || m.gloss
+        WHEN m.mention_type = 'DATE' THEN COALESCE(l.link_name, 'date:' || m.gloss)
+        ELSE COALESCE(l.link_name, 'gloss:' || m.gloss)
+    END AS entity,
+    l.link_name,
+    m.weight AS mention_weight,
+    l.weight AS link_weight,
+    l.correct AS link_correct
+   FROM evaluation_mention m 
+   LEFT JOIN evaluation_link l ON m.doc_id = l.doc_id AND (m.span = l.span)
+   WHERE NOT (m.mention_type = 'TITLE' AND substring(l.link_name, 0, 6) = 'wiki:') -- ignore wiki links with titles.
+);
+-- Unique indexes allow the views to be refreshed CONCURRENTLY (see kbpo.refresh).
+CREATE UNIQUE INDEX evaluation_mention_link_key ON evaluation_mention_link(doc_id, span, link_name);
+
+DROP MATERIALIZED VIEW IF EXISTS evaluation_entity_relation;
+CREATE MATERIALIZED VIEW evaluation_entity_relation AS (
+ SELECT 
+    r.doc_id,
+    r.subject,
+    r.object,
+    m.mention_type AS subject_type,
+    n.mention_type AS object_type,
+    m.gloss AS subject_gloss,
+    n.gloss AS  object_gloss,
+    m.entity AS subject_entity,
+    n.entity AS object_entity,
+    m.link_name AS subject_link_name,
+    n.link_name AS object_link_name,
+    m.link_correct AS subject_entity_correct, -- could be null
+    n.link_correct AS object_entity_correct,  -- could be null
+    r.relation,
+    r.weight AS relation_weight
+   FROM evaluation_relation r
+     JOIN evaluation_mention_link m ON r.doc_id = m.doc_id AND r.subject = m.span
+     JOIN evaluation_mention_link n ON r.doc_id = n.doc_id AND r.object = n.span
+);
+CREATE UNIQUE INDEX evaluation_entity_relation_key ON evaluation_entity_relation(doc_id, subject, object, subject_link_name, object_link_name);
+
+DROP MATERIALIZED VIEW IF EXISTS submission_entries_list CASCADE;
+CREATE MATERIALIZED VIEW submission_entries_list AS (
+    SELECT
+    -- Keys
+    r.submission_id,
+    r.doc_id,
+    r.subject,
+    r.object,
+    er.subject_link_name AS subject_link_name_gold,
+    er.object_link_name AS object_link_name_gold,
+
+    -- Entity linking stuff
+    r.subject_type,
+    r.subject_gloss,
+    r.subject_canonical_gloss,
+    r.subject_entity,
+    er.subject_entity AS subject_entity_gold,
+
+    r.object_type,
+    r.object_gloss,
+    r.object_canonical_gloss,
+    r.object_entity,
+    er.object_entity AS object_entity_gold,
+
+    -- Relations
+    r.relation AS predicate_name,
+    er.relation AS predicate_gold,
+
+    -- Labels
+    r.subject_type = er.subject_type AS subject_type_match,
+    r.object_type = er.object_type AS object_type_match,
+
+    r.subject_entity = er.subject_entity OR r.subject_canonical_gloss = er.subject_entity AS subject_entity_match,
+    er.subject_entity_correct AS matched_subject_entity_correct,
+    r.object_entity = er.object_entity OR r.object_canonical_gloss = er.object_entity AS object_entity_match,
+    er.object_entity_correct AS matched_object_entity_correct,
+
+    r.relation = er.relation AS matched_predicate_correct
+
+    FROM submission_entity_relation r
+    -- In the current format of the linking, we have two rows, one for
+    -- the entity link, and the other for the entity gloss
+    -- match OR the subject's canonical gloss will match. 
+    JOIN evaluation_entity_relation er ON (r.doc_id = er.doc_id AND r.subject = er.subject AND r.object = er.object)
+);
+CREATE UNIQUE INDEX submission_entries_list_key ON submission_entries_list(submission_id, doc_id, subject, object, subject_link_name_gold, object_link_name_gold);
+
+DROP MATERIALIZED VIEW IF EXISTS submission_entries;
+CREATE MATERIALIZED VIEW submission_entries AS (
+    WITH _null_columns AS (
+        SELECT *,
+            CASE 
+                WHEN subject_type_match AND subject_entity_match THEN matched_subject_entity_correct 
+                ELSE NULL 
+            END AS subject_entity_correct,
+
+            CASE 
+                WHEN object_type_match AND object_entity_match THEN matched_object_entity_correct 
+                ELSE NULL 
+            END AS object_entity_correct,
+
+            CASE 
+                WHEN subject_type_match AND object_type_match THEN matched_predicate_correct
+                ELSE NULL 
+            END AS predicate_correct
+        FROM submission_entries_list)
+    SELECT DISTINCT ON (r.submission_id, r.doc_id, r.subject, r.object)
+    -- Document viewing stuff
+    d.title,
+    t.tag AS corpus_tag,
+    s.gloss AS sentence,
+    s.span AS sentence_span,
+
+    -- Keys
+    r.*,
+
+    -- Labels
+    r.subject_entity_correct AND r.object_entity_correct  AND r.predicate_correct AS correct
+
+    FROM 
+    _null_columns r
+    JOIN sentence s ON (s.doc_id = r.doc_id AND s.span @> r.subject)
+    JOIN document d ON (r.doc_id = d.id)
+    JOIN document_tag t ON (r.doc_id = t.doc_id)
+    ORDER BY r.submission_id, r.doc_id, r.subject, r.object,
+            subject_type_match DESC, object_type_match DESC,
+            subject_entity_match DESC, object_entity_match DESC,
+            r.subject_entity_correct, r.object_entity_correct  
+);
+CREATE UNIQUE INDEX submission_entries_key ON submission_entries(submission_id, doc_id, subject, object);
+
+-- Bookkeeping for kbpo.refresh: when each materialized view was last
+-- requested and refreshed, and how long its refreshes took.
+CREATE TABLE  view_refresh (
+  view_name TEXT PRIMARY KEY,
+  requested TIMESTAMP, -- the latest time at which the view's sources changed
+  refreshed TIMESTAMP, -- the start of the latest completed refresh
+  duration REAL -- of the latest completed refresh, in seconds
+);
+COMMENT ON TABLE view_refresh IS 'Refresh requests for materialized views';
+
+CREATE TABLE  view_refresh_log (
+  view_name TEXT NOT NULL,
+  started TIMESTAMP NOT NULL,
+  duration REAL NOT NULL
+);
+COMMENT ON TABLE view_refresh_log IS 'Durations of materialized view refreshes';
+CREATE INDEX view_refresh_log_view_idx ON view_refresh_log(view_name, started);
+
+COMMIT;
@@ -0,0 +1,12 @@
+SET search_path TO kbpo;
+
+BEGIN TRANSACTION;
+
+-- Matches the keys of evaluation_relation_question (see kbpo.questions).
+CREATE INDEX evaluation_question_relation_idx ON evaluation_question (
+    (params->>'doc_id'),
+    int4range((params#>>'{subject,span,0}')::integer, (params#>>'{subject,span,1}')::integer),
+    int4range((params#>>'{object,span,0}')::integer, (params#>>'{object,span,1}')::integer))
+    WHERE state <> 'done';
+
+COMMIT;
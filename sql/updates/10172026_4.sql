@@ -0,0 +1,8 @@
+SET search_path TO kbpo;
+
+BEGIN TRANSACTION;
+
+-- Importance weights of samples that were not drawn from the submission's distribution (see kbpo.sampling).
+ALTER TABLE submission_sample ADD COLUMN weight REAL NOT NULL DEFAULT 1.0;
+
+COMMIT;
@@ -24,25 +24,24 @@ def construct_example(samples):
     mentions (as strings) to render.
     """
     Row = namedtuple("Row", ["doc_id", "gloss", "span", "subject", "object"])
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("""CREATE TEMPORARY TABLE _samples (
-                    doc_id TEXT NOT NULL,
-                    subject INT4RANGE NOT NULL,
-                    object INT4RANGE NOT NULL
-                    ) ON COMMIT DROP;""")
-            db.execute_values(cur, "INSERT INTO _samples VALUES %s", [
-                (doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_)) for doc_id, subject, object_ in samples
-                ])
-
-            ret = []
-            for row in db.select(r"""
-                SELECT x.doc_id, gloss, span, subject, object
-                FROM _samples x
-                JOIN sentence s ON (x.doc_id = s.doc_id AND x.subject <@ s.span AND x.object <@ s.span)
-                """):
-                elem = Row(row.doc_id, row.gloss, (row.span.lower, row.span.upper), (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper))
-                ret.append(elem)
+    with db.cursor() as cur:
+        cur.execute("""CREATE TEMPORARY TABLE _samples (
+                doc_id TEXT NOT NULL,
+                subject INT4RANGE NOT NULL,
+                object INT4RANGE NOT NULL
+                ) ON COMMIT DROP;""")
+        db.execute_values(cur, "INSERT INTO _samples VALUES %s", [
+            (doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_)) for doc_id, subject, object_ in samples
+            ])
+
+        ret = []
+        for row in db.select(r"""
+            SELECT x.doc_id, gloss, span, subject, object
+            FROM _samples x
+            JOIN sentence s ON (x.doc_id = s.doc_id AND x.subject <@ s.span AND x.object <@ s.span)
+            """):
+            elem = Row(row.doc_id, row.gloss, (row.span.lower, row.span.upper), (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper))
+            ret.append(elem)
     return ret
 
 def get_entity_relation(corpus_tag, submission_id=None):
@@ -174,13 +173,12 @@ def do_entity_histogram(args):
     # -- Plot histogram of entities.
 
 def do_compute_entity_bins(args):
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("""SELECT link_name, count
-                           FROM suggested_link_frequencies
-                           WHERE tag = %(corpus_tag)s
-                           """.format(link_table=args.link_table, mention_table=args.mention_table), {"corpus_tag": args.corpus_tag})
-            data = np.array([row.count for row in cur])
+    with db.cursor() as cur:
+        cur.execute("""SELECT link_name, count
+                       FROM suggested_link_frequencies
+                       WHERE tag = %(corpus_tag)s
+                       """.format(link_table=args.link_table, mention_table=args.mention_table), {"corpus_tag": args.corpus_tag})
+        data = np.array([row.count for row in cur])
 
     low, med, high = np.percentile(data, 50), np.percentile(data, 90), np.percentile(data, 100)
     print("Frequency bins: low (50%) {}, medium (90%) {} and high (100%) {}".format(low, med, high))
@@ -30,7 +30,7 @@ def do_evaluate(args):
                      'err-p-left', 'err-r-left', 'err-f1-left',
                      'err-p-right', 'err-r-right', 'err-f1-right',
                     ])
-    for system, score in evaluation_api.get_updated_scores(args.corpus_tag, mode=args.mode, num_epochs=args.num_epochs):
+    for system, score in evaluation_api.get_updated_scores(args.corpus_tag, mode=args.mode, num_epochs=args.num_epochs, engine=args.engine, workers=args.workers, seed=args.seed, cache_dir=args.cache_dir):
         score = score._replace(
             p_left=score.p - score.p_left,
             r_left=score.r - score.r_left,
@@ -45,7 +45,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Evaluate submissions from the KBPO database')
     parser.add_argument('-m', '--mode', choices=['simple', 'joint'], default='simple', help='Mode to evaluate experiments with')
     parser.add_argument('-t', '--corpus-tag', choices=['kbp2016'], default='kbp2016', help='Evaluation corpus to get scores for')
+    parser.add_argument('-e', '--engine', choices=['python', 'matrix'], default='python', help='Implementation of the estimators to use')
     parser.add_argument('-n', '--num-epochs', type=int, default=1000, help="Number of epochs to average over")
+    parser.add_argument('-j', '--workers', type=int, default=1, help="Number of processes to bootstrap with (matrix engine only)")
+    parser.add_argument('-s', '--seed', type=int, default=None, help="Seed for the bootstrap (matrix engine only)")
+    parser.add_argument('-c', '--cache-dir', default=None, help="Directory to keep versioned snapshots of the distributions and samples in")
     parser.add_argument('-o', '--output', type=argparse.FileType('w'), default=sys.stdout, help="Outputs a list of results for every system (true, predicted, stdev)")
     parser.set_defaults(func=do_evaluate)
 
@@ -17,13 +17,12 @@ logging.basicConfig(level=logging.INFO)
 
 def do_submission(args):
     mfile = MFile.from_stream(csv.reader(args.input, delimiter="\t"))
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            # Create the submission
-            cur.execute("""INSERT INTO submission(name, details) VALUES %s""", [(args.name, args.description)])
-            cur.execute("""SELECT MAX(id) FROM submission""")
-            submission_id, = next(cur)
-            logger.info("Inserting submission %d", submission_id)
+    with db.cursor() as cur:
+        # Create the submission
+        cur.execute("""INSERT INTO submission(name, details) VALUES %s""", [(args.name, args.description)])
+        cur.execute("""SELECT MAX(id) FROM submission""")
+        submission_id, = next(cur)
+        logger.info("Inserting submission %d", submission_id)
     upload_submission(submission_id, mfile)
 
 def do_responses(args):
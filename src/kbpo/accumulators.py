@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming accumulators for the precision and recall estimators.
+
+Accumulators consume samples one at a time (add) or as NumPy chunks
+(add_chunk), e.g. straight from a server-side cursor (consume), and
+can be merged across shards; they only keep a few running sums.
+
+They compute the averages of the python engine (see evaluation), and
+distribution.Xh_accumulators and distribution.Y0_accumulators use them
+for simple point estimates that never materialize the samples. The
+joint estimators and their bootstrap intervals still need the samples
+themselves.
+"""
+
+import numpy as np
+
+def chunks(cur, chunk_size=10000):
+    """
+    Yields lists of up to @chunk_size rows from the cursor @cur.
+    """
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+def _as_array(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+class PrecisionAccumulator(object):
+    r"""
+    Accumulates $1/n \sum_{x} w(x) f(x)$ over the annotated samples
+    (those with f(x) not None), where w(x) is an optional importance
+    weight, e.g. p_i(x)/q_i(x) for $\pi_{ij}$.
+    """
+    def __init__(self, total=0., n=0):
+        self.total = total
+        self.n = n
+
+    def add(self, fx, weight=1.):
+        if fx is not None:
+            self.total += weight * fx
+            self.n += 1
+        return self
+
+    def add_chunk(self, fxs, weights=None):
+        """
+        @fxs - an array of f(x) with NaN (or None) for unannotated samples.
+        @weights - an optional array of importance weights.
+        """
+        fxs = _as_array(fxs)
+        valid = ~np.isnan(fxs)
+        if weights is not None:
+            fxs = fxs * np.asarray(weights, dtype=np.float64)
+        self.total += fxs[valid].sum()
+        self.n += int(valid.sum())
+        return self
+
+    def consume(self, cur, column="fx", chunk_size=10000):
+        """
+        Consumes the rows of @cur in chunks of @chunk_size, reading f(x) from @column.
+        """
+        for rows in chunks(cur, chunk_size):
+            self.add_chunk([getattr(row, column) for row in rows])
+        return self
+
+    def merge(self, other):
+        return PrecisionAccumulator(self.total + other.total, self.n + other.n)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    @property
+    def value(self):
+        return self.total / self.n if self.n > 0 else 0.
+
+class RecallAccumulator(object):
+    r"""
+    Accumulates $\sum_{x} P_0(x) g(x) / \sum_{x} P_0(x)$ over the
+    annotated samples of Y0 (those with g(x) not None).
+    """
+    def __init__(self, total=0., Z=0.):
+        self.total = total
+        self.Z = Z
+
+    def add(self, gx, p0=1.):
+        if gx is not None:
+            self.total += p0 * gx
+            self.Z += p0
+        return self
+
+    def add_chunk(self, gxs, p0s=None):
+        """
+        @gxs - an array of g(x) with NaN (or None) for unannotated samples.
+        @p0s - an optional array of P0(x); defaults to the uniform distribution.
+        """
+        gxs = _as_array(gxs)
+        valid = ~np.isnan(gxs)
+        p0s = np.ones(len(gxs)) if p0s is None else np.asarray(p0s, dtype=np.float64)
+        self.total += float((p0s * gxs)[valid].sum())
+        self.Z += float(p0s[valid].sum())
+        return self
+
+    def consume(self, cur, column="gx", chunk_size=10000):
+        """
+        Consumes the rows of @cur in chunks of @chunk_size, reading g(x) from @column.
+        """
+        for rows in chunks(cur, chunk_size):
+            self.add_chunk([getattr(row, column) for row in rows])
+        return self
+
+    def merge(self, other):
+        return RecallAccumulator(self.total + other.total, self.Z + other.Z)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    @property
+    def value(self):
+        # Like the recall estimators, raises ZeroDivisionError without
+        # any annotated sample.
+        return self.total / self.Z
+
+def consume_grouped(cur, factory, key="submission_id", column="fx", chunk_size=10000, weight_column=None):
+    """
+    Consumes the rows of @cur in chunks of @chunk_size into one
+    accumulator (built by @factory) per distinct value of @key,
+    optionally weighting every row by its @weight_column.
+    @returns: a dictionary of accumulators.
+    """
+    ret = {}
+    for rows in chunks(cur, chunk_size):
+        keys = np.array([getattr(row, key) for row in rows])
+        values = _as_array([getattr(row, column) for row in rows])
+        weights = None if weight_column is None else np.array([getattr(row, weight_column) for row in rows], dtype=np.float64)
+        for key_ in np.unique(keys):
+            if key_ not in ret:
+                ret[key_] = factory()
+            mask = keys == key_
+            if weights is None:
+                ret[key_].add_chunk(values[mask])
+            else:
+                ret[key_].add_chunk(values[mask], weights[mask])
+    return ret
+
+def test_precision_accumulator():
+    acc = PrecisionAccumulator()
+    for fx in [1., 0., None, 1.]:
+        acc.add(fx)
+    assert acc.n == 3
+    assert np.allclose(acc.value, 2./3)
+
+    acc_ = PrecisionAccumulator().add_chunk(np.array([1., np.nan, 0., 0.]))
+    assert acc_.n == 3
+    assert np.allclose(acc.merge(acc_).value, 3./6)
+
+def test_recall_accumulator():
+    acc = RecallAccumulator()
+    for gx, p0 in [(1., 0.5), (0., 0.25), (None, 1.), (1., 0.25)]:
+        acc.add(gx, p0)
+    assert np.allclose(acc.value, 0.75)
+
+    acc_ = RecallAccumulator().add_chunk([1., None, 0.], [1., 1., 1.])
+    assert np.allclose((acc + acc_).value, 1.75/3)
+
+    for acc in [RecallAccumulator(), RecallAccumulator().add(None), RecallAccumulator().add_chunk([None])]:
+        try:
+            acc.value
+            assert False, "Expected a ZeroDivisionError"
+        except ZeroDivisionError:
+            pass
+
+def test_consume():
+    from collections import namedtuple
+    Row = namedtuple("Row", ["fx"])
+
+    class _Cursor(object):
+        def __init__(self, rows):
+            self.rows = rows
+        def fetchmany(self, size):
+            ret, self.rows = self.rows[:size], self.rows[size:]
+            return ret
+
+    acc = PrecisionAccumulator().consume(_Cursor([Row(1.), Row(None), Row(0.), Row(1.)]), chunk_size=3)
+    assert acc.n == 3
+    assert np.allclose(acc.value, 2./3)
+
+    GroupRow = namedtuple("GroupRow", ["submission_id", "fx"])
+    accs = consume_grouped(_Cursor([GroupRow(1, 1.), GroupRow(1, 0.), GroupRow(2, None), GroupRow(2, 1.)]), PrecisionAccumulator, chunk_size=3)
+    assert sorted(accs) == [1, 2]
+    assert np.allclose(accs[1].value, 0.5)
+    assert accs[2].n == 1 and np.allclose(accs[2].value, 1.)
+
+    WeightedRow = namedtuple("WeightedRow", ["submission_id", "fx", "weight"])
+    accs = consume_grouped(_Cursor([WeightedRow(1, 1., 2.), WeightedRow(1, 0., 1.), WeightedRow(1, None, 5.)]), PrecisionAccumulator, weight_column="weight")
+    assert accs[1].n == 2 and np.allclose(accs[1].value, 1.)
@@ -2,6 +2,7 @@
 Utilities connecting the web interface to database
 Interfacing with database API
 """
+import time
 import logging
 from datetime import date, datetime
 from collections import Counter
@@ -10,6 +11,8 @@ import json
 from . import db
 from . import defs
 from .util import stuple
+from .schema import Provenance
+from .columns import Columns
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -31,6 +34,19 @@ def test_get_documents():
     assert len(docs) == 15001
     assert "NYT_ENG_20131216.0031" in docs
 
+_GET_DOCUMENT = db.prepare("get_document", """
+        SELECT id, title, doc_date
+        FROM document
+        WHERE id = %(doc_id)s
+        """)
+
+_GET_DOCUMENT_SENTENCES = db.prepare("get_document_sentences", """
+        SELECT sentence_index, token_spans, words, lemmas, pos_tags, ner_tags
+        FROM sentence
+        WHERE doc_id = %(doc_id)s
+        ORDER BY sentence_index
+        """)
+
 def get_document(doc_id):
     """
     Returns id, date, title and sentences for a given @doc_id
@@ -47,20 +63,11 @@ def get_document(doc_id):
         "`": "'",
         }
 
-    doc_info = db.get("""
-        SELECT id, title, doc_date
-        FROM document
-        WHERE id = %(doc_id)s
-        """, doc_id=doc_id)
+    doc_info = _GET_DOCUMENT.get(doc_id=doc_id)
     assert doc_info.id == doc_id
 
     sentences = []
-    for row in db.select("""
-            SELECT sentence_index, token_spans, words, lemmas, pos_tags, ner_tags
-            FROM sentence
-            WHERE doc_id = %(doc_id)s
-            ORDER BY sentence_index
-            """, doc_id=doc_id):
+    for row in _GET_DOCUMENT_SENTENCES.select(doc_id=doc_id):
         _, token_spans, words, lemmas, pos_tags, ner_tags = row
 
         words = list(map(lambda w: T.get(w, w), words))
@@ -93,19 +100,21 @@ def test_get_document():
 
     assert doc["id"] == "NYT_ENG_20131216.0031"
 
+_GET_SUGGESTED_MENTIONS = db.prepare("get_suggested_mentions", """
+        SELECT m.span, m.gloss, m.mention_type, n.span AS canonical_span, n.gloss AS canonical_gloss, l.link_name
+        FROM suggested_mention m
+        JOIN suggested_mention n ON (m.doc_id = n.doc_id AND m.canonical_span = n.span)
+        LEFT OUTER JOIN suggested_link l ON (n.doc_id = l.doc_id AND n.span = l.span)
+        WHERE m.doc_id = %(doc_id)s
+        ORDER BY m.span
+        """)
+
 def get_suggested_mentions(doc_id):
     """
     Get suggested mentions for a document.
     """
     mentions = []
-    for row in db.select("""
-            SELECT m.span, m.gloss, m.mention_type, n.span AS canonical_span, n.gloss AS canonical_gloss, l.link_name
-            FROM suggested_mention m
-            JOIN suggested_mention n ON (m.doc_id = n.doc_id AND m.canonical_span = n.span)
-            LEFT OUTER JOIN suggested_link l ON (n.doc_id = l.doc_id AND n.span = l.span)
-            WHERE m.doc_id = %(doc_id)s
-            ORDER BY m.span
-            """, doc_id=doc_id):
+    for row in _GET_SUGGESTED_MENTIONS.select(doc_id=doc_id):
         mention = {
             "span": (row.span.lower, row.span.upper),
             "gloss": row.gloss,
@@ -209,19 +218,21 @@ def test_get_submission_mentions():
             },
         }
 
+_GET_EVALUATION_MENTIONS = db.prepare("get_evaluation_mentions", """
+        SELECT m.span, m.gloss, m.mention_type, n.span AS canonical_span, n.gloss AS canonical_gloss, l.link_name
+        FROM evaluation_mention m
+        JOIN evaluation_mention n ON (m.doc_id = n.doc_id AND m.canonical_span = n.span)
+        LEFT OUTER JOIN evaluation_link l ON (n.doc_id = l.doc_id AND n.span = l.span)
+        WHERE m.doc_id = %(doc_id)s
+        ORDER BY m.span
+        """)
+
 def get_evaluation_mentions(doc_id):
     """
     Get mention pairs from exhaustive mentions for a document.
     """
     mentions = []
-    for i, row in enumerate(db.select("""
-            SELECT m.span, m.gloss, m.mention_type, n.span AS canonical_span, n.gloss AS canonical_gloss, l.link_name
-            FROM evaluation_mention m
-            JOIN evaluation_mention n ON (m.doc_id = n.doc_id AND m.canonical_span = n.span)
-            LEFT OUTER JOIN evaluation_link l ON (n.doc_id = l.doc_id AND n.span = l.span)
-            WHERE m.doc_id = %(doc_id)s
-            ORDER BY m.span
-            """, doc_id=doc_id)):
+    for i, row in enumerate(_GET_EVALUATION_MENTIONS.select(doc_id=doc_id)):
         mention = {
             "id": i,
             "span": (row.span.lower, row.span.upper),
@@ -349,18 +360,20 @@ def test_get_evaluation_mention_pairs():
     assert pair['subject'] == (628, 642)
     assert pair['object'] == (568, 574)
 
+_GET_EVALUATION_RELATIONS = db.prepare("get_evaluation_relations", """
+        SELECT DISTINCT ON (subject, object)
+        r.subject, r.subject_type, r.relation, r.object, r.object_type
+        FROM evaluation_entity_relation r
+        WHERE r.doc_id = %(doc_id)s
+        ORDER BY r.subject, r.object, r.relation
+        """)
+
 def get_evaluation_relations(doc_id):
     """
     Get relations for a document.
     """
     relations = []
-    for row in db.select("""
-            SELECT DISTINCT ON (subject, object)
-            r.subject, r.subject_type, r.relation, r.object, r.object_type
-            FROM evaluation_entity_relation r
-            WHERE r.doc_id = %(doc_id)s
-            ORDER BY r.subject, r.object, r.relation
-            """, doc_id=doc_id):
+    for row in _GET_EVALUATION_RELATIONS.select(doc_id=doc_id):
         if not defs.is_canonical_relation(row.relation, row.subject_type, row.object_type):
             continue
 
@@ -471,33 +484,32 @@ def insert_assignment(
         assignment_id, hit_id, worker_id,
         worker_time, comments, response,
         state="pending-extraction", created=datetime.now()):
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            batch_id = db.get("""SELECT batch_id FROM mturk_hit WHERE id = %(hit_id)s;""", hit_id=hit_id, cur=cur)
-            existing_response = db.select("SELECT * FROM mturk_assignment WHERE id = %(assignment_id)s;", assignment_id=assignment_id, cur=cur)
-            if len(existing_response) >= 1:
-                assert len(existing_response) == 1, "More than 1 assignment stored for an assignment_id"
-                existing_response = existing_response[0]
-                existing_response_json = json.dumps(existing_response.response, sort_keys=True)
-                response_json = json.dumps(response, sort_keys=True)
-                assert existing_response_json == response_json, "Existing response %s doesn't match with the one being inserted %s"%(existing_response_json, response_json)
-                if state == 'submitted':
-                    state = existing_response.state
-                else:
-                    #states could be approved or rejected
-                    pass
-            db.execute("""
-                INSERT INTO mturk_assignment (id, hit_id, batch_id, worker_id, created, worker_time, response, comments, state)
-                VALUES (%(assignment_id)s, %(hit_id)s, %(batch_id)s, %(worker_id)s, %(created)s, %(worker_time)s, %(response)s, %(comments)s, %(state)s) ON CONFLICT (id)  DO UPDATE SET state=%(state)s""",
-                       assignment_id=assignment_id,
-                       hit_id=hit_id,
-                       batch_id=batch_id,
-                       worker_id= worker_id,
-                       created= created,
-                       worker_time=int(float(worker_time)),
-                       response=db.Json(response),
-                       comments=comments,
-                       state=state)
+    with db.cursor() as cur:
+        batch_id = db.get("""SELECT batch_id FROM mturk_hit WHERE id = %(hit_id)s;""", hit_id=hit_id, cur=cur)
+        existing_response = db.select("SELECT * FROM mturk_assignment WHERE id = %(assignment_id)s;", assignment_id=assignment_id, cur=cur)
+        if len(existing_response) >= 1:
+            assert len(existing_response) == 1, "More than 1 assignment stored for an assignment_id"
+            existing_response = existing_response[0]
+            existing_response_json = json.dumps(existing_response.response, sort_keys=True)
+            response_json = json.dumps(response, sort_keys=True)
+            assert existing_response_json == response_json, "Existing response %s doesn't match with the one being inserted %s"%(existing_response_json, response_json)
+            if state == 'submitted':
+                state = existing_response.state
+            else:
+                #states could be approved or rejected
+                pass
+        db.execute("""
+            INSERT INTO mturk_assignment (id, hit_id, batch_id, worker_id, created, worker_time, response, comments, state)
+            VALUES (%(assignment_id)s, %(hit_id)s, %(batch_id)s, %(worker_id)s, %(created)s, %(worker_time)s, %(response)s, %(comments)s, %(state)s) ON CONFLICT (id)  DO UPDATE SET state=%(state)s""",
+                   assignment_id=assignment_id,
+                   hit_id=hit_id,
+                   batch_id=batch_id,
+                   worker_id= worker_id,
+                   created= created,
+                   worker_time=int(float(worker_time)),
+                   response=db.Json(response),
+                   comments=comments,
+                   state=state)
     return assignment_id
 
 def get_hits(limit=None):
@@ -506,18 +518,26 @@ def get_hits(limit=None):
     else:
         return db.select("""SELECT * FROM mturk_hit ORDER BY id LIMIT %(limit)s""", limit=limit)
 
+_GET_HIT = db.prepare("get_hit", """
+        SELECT id, batch_id, question_batch_id, question_id, created, type_id, price, units, state, message
+        FROM mturk_hit
+        WHERE id=%(hit_id)s
+        """)
+
 def get_hit(hit_id):
-    return db.get("""SELECT * FROM mturk_hit WHERE hit_id=%(hit_id)s""", hit_id=hit_id)
+    return _GET_HIT.get(hit_id=hit_id)
+
+_GET_TASK_PARAMS = db.prepare("get_task_params", """
+        SELECT params 
+        FROM mturk_hit h 
+        JOIN evaluation_question q ON (h.question_batch_id = q.batch_id AND h.question_id = q.id)
+        WHERE h.id=%(hit_id)s""")
 
 def get_task_params(hit_id):
     """
     Gets parameters from the task.
     """
-    return db.get("""
-        SELECT params 
-        FROM mturk_hit h 
-        JOIN evaluation_question q ON (h.question_batch_id = q.batch_id AND h.question_id = q.id)
-        WHERE h.id=%(hit_id)s""", hit_id=hit_id).params
+    return _GET_TASK_PARAMS.get(hit_id=hit_id).params
 
 def get_submission_entries(submission_id):
     """
@@ -525,7 +545,7 @@ def get_submission_entries(submission_id):
     """
     distinct = set()
     entries = []
-    for i, row in enumerate(db.select("""
+    with db.stream("""
         SELECT doc_id,
                title,
                corpus_tag,
@@ -558,59 +578,60 @@ def get_submission_entries(submission_id):
           AND subject_type_match AND object_type_match
           AND subject_entity_match AND object_entity_match
         ORDER BY doc_id, subject, object
-        """, submission_id=submission_id)):
-
-        # Only keep non-inverted relations.
-        if not defs.is_canonical_relation(row.predicate_name, row.subject_type, row.object_type):
-            continue # skip because the inverted relation will come along.
-        if not defs.is_canonical_relation(row.predicate_gold, row.subject_type, row.object_type):
-            continue # skip because the inverted relation will come along.
-
-        key = row.doc_id, stuple(row.subject), stuple(row.object)
-        key = key[0], min(key[1], key[2]), max(key[1], key[2])
-        if key in distinct:
-            continue
-        distinct.add(key)
-
-        entry = {
-            "doc_id": row.doc_id,
-            "corpus_tag": row.corpus_tag,
-            "title": row.title,
-            "sentence": row.sentence,
-            "subject": {
-                # Relative to sentences
-                "span": [row.subject.lower - row.sentence_span.lower, row.subject.upper  - row.sentence_span.lower],
-                "type": row.subject_type,
-                "gloss": row.subject_gloss,
-                "entity": {
+        """, submission_id=submission_id) as rows:
+        for i, row in enumerate(rows):
+
+            # Only keep non-inverted relations.
+            if not defs.is_canonical_relation(row.predicate_name, row.subject_type, row.object_type):
+                continue # skip because the inverted relation will come along.
+            if not defs.is_canonical_relation(row.predicate_gold, row.subject_type, row.object_type):
+                continue # skip because the inverted relation will come along.
+
+            key = row.doc_id, stuple(row.subject), stuple(row.object)
+            key = key[0], min(key[1], key[2]), max(key[1], key[2])
+            if key in distinct:
+                continue
+            distinct.add(key)
+
+            entry = {
+                "doc_id": row.doc_id,
+                "corpus_tag": row.corpus_tag,
+                "title": row.title,
+                "sentence": row.sentence,
+                "subject": {
+                    # Relative to sentences
+                    "span": [row.subject.lower - row.sentence_span.lower, row.subject.upper  - row.sentence_span.lower],
                     "type": row.subject_type,
-                    "gloss": row.subject_canonical_gloss,
-                    "link": row.subject_entity,
-                    "linkGold": row.subject_entity_gold,
-                    "linkCorrect": row.subject_entity_correct,
+                    "gloss": row.subject_gloss,
+                    "entity": {
+                        "type": row.subject_type,
+                        "gloss": row.subject_canonical_gloss,
+                        "link": row.subject_entity,
+                        "linkGold": row.subject_entity_gold,
+                        "linkCorrect": row.subject_entity_correct,
+                        },
                     },
-                },
-            "object": {
-                # Relative to sentences
-                "span": [row.object.lower - row.sentence_span.lower, row.object.upper  - row.sentence_span.lower],
-                "type": row.object_type,
-                "gloss": row.object_gloss,
-                "entity": {
+                "object": {
+                    # Relative to sentences
+                    "span": [row.object.lower - row.sentence_span.lower, row.object.upper  - row.sentence_span.lower],
                     "type": row.object_type,
-                    "gloss": row.object_canonical_gloss,
-                    "link": row.object_entity,
-                    "linkGold": row.object_entity_gold,
-                    "linkCorrect": row.object_entity_correct,
+                    "gloss": row.object_gloss,
+                    "entity": {
+                        "type": row.object_type,
+                        "gloss": row.object_canonical_gloss,
+                        "link": row.object_entity,
+                        "linkGold": row.object_entity_gold,
+                        "linkCorrect": row.object_entity_correct,
+                        },
                     },
-                },
-            "predicate": {
-                "name": row.predicate_name,
-                "gold": row.predicate_gold,
-                "isCorrect": row.predicate_correct,
-                },
-            "isCorrect": row.correct,
-            }
-        entries.append(entry)
+                "predicate": {
+                    "name": row.predicate_name,
+                    "gold": row.predicate_gold,
+                    "isCorrect": row.predicate_correct,
+                    },
+                "isCorrect": row.correct,
+                }
+            entries.append(entry)
     return entries
 
 def test_get_submission_entries():
@@ -750,59 +771,78 @@ def test_get_corpus_listing():
         "relationCount": 119,
         }
 
-def upload_submission(submission_id, mfile):
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            # TODO: What about husk sample_batches created this way?
-            db.execute("""DELETE FROM submission_sample WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
-            db.execute("""DELETE FROM submission_relation WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
-            db.execute("""DELETE FROM submission_link WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
-            db.execute("""DELETE FROM submission_mention WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
-
-            # Create the submission
-            mentions, links, relations = [], [], []
-
-            def _p(prov):
-                return db.Int4NumericRange(prov.begin, prov.end)
-
-
-            for mention_id in mfile.mention_ids:
-                mention_type, gloss, canonical_id = mfile.get_type(mention_id), mfile.get_gloss(mention_id), mfile.get_cmention(mention_id)
-                mention_id, canonical_id = mention_id, canonical_id
-                doc_id = mention_id.doc_id
-                mentions.append((submission_id, doc_id, _p(mention_id), _p(canonical_id), mention_type, gloss))
-            for row in mfile.links:
-                mention_id = row.subj
-                doc_id = mention_id.doc_id
-                link_name = row.obj
-                weight = row.weight
-                links.append((submission_id, doc_id, _p(mention_id), link_name, weight))
-            for row in mfile.relations:
-                subject_id = row.subj
-                object_id = row.obj
-                doc_id = subject_id.doc_id
-
-                relation = row.reln
-                provs = list(row.prov) if row.prov else []
-                weight = row.weight
-                relations.append((submission_id, doc_id, _p(subject_id), _p(object_id), relation, [_p(prov) for prov in provs], weight))
-
-            # mentions
-            db.execute_values(cur, """INSERT INTO submission_mention (submission_id, doc_id, span, canonical_span, mention_type, gloss) VALUES %s """, mentions)
-
-            # links
-            db.execute_values(cur, """INSERT INTO submission_link (submission_id, doc_id, span, link_name, confidence) VALUES %s """, links)
-
-            # relations
-            db.execute_values(cur, """INSERT INTO submission_relation (submission_id, doc_id, subject, object, relation, provenances, confidence) VALUES %s """, relations)
-
-            # refresh materialized views.
-            cur.execute("""REFRESH MATERIALIZED VIEW submission_mention_link""")
-            cur.execute("""REFRESH MATERIALIZED VIEW submission_entity_relation""")
-            cur.execute("""REFRESH MATERIALIZED VIEW submission_statistics""")
-            cur.execute("""REFRESH MATERIALIZED VIEW submission_relation_counts""")
-            cur.execute("""REFRESH MATERIALIZED VIEW submission_entity_counts""")
-            cur.execute("""REFRESH MATERIALIZED VIEW submission_entity_relation_counts""")
+def _p(prov):
+    return db.Int4NumericRange(prov.begin, prov.end)
+
+def _submission_mentions(submission_id, mfile):
+    for mention_id in mfile.mention_ids:
+        mention_type, gloss, canonical_id = mfile.get_type(mention_id), mfile.get_gloss(mention_id), mfile.get_cmention(mention_id)
+        yield (submission_id, mention_id.doc_id, _p(mention_id), _p(canonical_id), mention_type, gloss)
+
+def _submission_links(submission_id, mfile):
+    for row in mfile.links:
+        yield (submission_id, row.subj.doc_id, _p(row.subj), row.obj, row.weight)
+
+def _submission_relations(submission_id, mfile):
+    for row in mfile.relations:
+        # Relations without provenances have a single Provenance (or None).
+        provs = [] if not row.prov else [row.prov] if isinstance(row.prov, Provenance) else list(row.prov)
+        yield (submission_id, row.subj.doc_id, _p(row.subj), _p(row.obj), row.reln, [_p(prov) for prov in provs], row.weight)
+
+def _documents(mfile, tables):
+    # Saved columns are turned into entries one document at a time,
+    # building only the @tables the rows are read from.
+    return (part for _, part in mfile.iter_documents(tables)) if isinstance(mfile, Columns) else [mfile]
+
+# (table, columns, rows, the MFile tables the rows are built from)
+_SUBMISSION_TABLES = [
+    ("submission_mention", ["submission_id", "doc_id", "span", "canonical_span", "mention_type", "gloss"], _submission_mentions, ("types", "cmentions")),
+    ("submission_link", ["submission_id", "doc_id", "span", "link_name", "confidence"], _submission_links, ("links",)),
+    ("submission_relation", ["submission_id", "doc_id", "subject", "object", "relation", "provenances", "confidence"], _submission_relations, ("relations",)),
+    ]
+
+def upload_submission(submission_id, mfile, drop_indexes=False):
+    """
+    Loads the mentions, links and relations of @mfile (an MFile or the
+    Columns of a validated submission, see columns) into the database
+    as @submission_id, replacing any existing rows. Rows are streamed
+    with COPY, one document at a time for Columns; with @drop_indexes,
+    the secondary indexes of each table are dropped during the load and
+    rebuilt afterwards, which is faster for very large submissions (but
+    locks the tables).
+
+    @returns: a dictionary with the rows/s loaded into each table.
+    """
+    stats = {}
+    with db.cursor() as cur:
+        # TODO: What about husk sample_batches created this way?
+        db.execute("""DELETE FROM submission_sample WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
+        db.execute("""DELETE FROM submission_relation WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
+        db.execute("""DELETE FROM submission_link WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
+        db.execute("""DELETE FROM submission_mention WHERE submission_id=%(submission_id)s""", cur=cur, submission_id=submission_id)
+
+        indexes = []
+        if drop_indexes:
+            for table, _, _, _ in _SUBMISSION_TABLES:
+                indexes.extend(db.secondary_indexes(table, cur=cur))
+            for index in indexes:
+                cur.execute("""DROP INDEX {}""".format(index.name))
+
+        for table, columns, rows, tables in _SUBMISSION_TABLES:
+            start = time.time()
+            n_rows = db.copy_from(cur, table, columns, (row for part in _documents(mfile, tables) for row in rows(submission_id, part)))
+            elapsed = time.time() - start
+            stats[table] = n_rows / elapsed if elapsed > 0 else float(n_rows)
+            logger.info("Loaded %d rows into %s (%.0f rows/s)", n_rows, table, stats[table])
+
+        for index in indexes:
+            start = time.time()
+            cur.execute(index.definition)
+            logger.info("Rebuilt index %s in %.2fs", index.name, time.time() - start)
+
+        # update the tables derived from this submission.
+        db.execute("""SELECT update_submission_tables(%(submission_id)s)""", cur=cur, submission_id=submission_id)
+    return stats
 
 def get_question_batch(question_batch_id):
     return db.get("""
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A columnar binary format for validated submissions.
+
+A validated MFile is stored as a directory of .npy files with one set
+of columns per table (types, canonical_mentions, links, relations),
+which are memory-mapped when loaded.
+Mentions are (doc_idx, begin, end) integer columns over a shared table
+of doc_ids, strings are stored as UTF-8 buffers with offsets and
+types/relations as codes into a vocabulary, so that a submission can
+be loaded without re-parsing and re-validating its m-file.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+from .parser import Entry, MFile
+from .schema import Provenance, ProvenanceIndex
+
+def _pack_strings(strs):
+    data = [s.encode("utf-8") for s in strs]
+    offsets = np.cumsum([0] + [len(d) for d in data]).astype(np.int64)
+    return np.frombuffer(b"".join(data), dtype=np.uint8), offsets
+
+def _unpack_strings(data, offsets):
+    buf = data.tobytes()
+    return [buf[offsets[i]:offsets[i+1]].decode("utf-8") for i in range(len(offsets)-1)]
+
+def _provenances(prov):
+    # Relations without a provenance are given a single Provenance
+    # rather than a tuple by the reader.
+    if prov is None:
+        return ()
+    return (prov,) if isinstance(prov, Provenance) else tuple(prov)
+
+class ColumnWriter(object):
+    """
+    Accumulates the columns of one or more MFiles (e.g. the documents
+    yielded by MFileReader.iter_documents) and saves them to a directory
+    of .npy files.
+    """
+    def __init__(self):
+        self._index = ProvenanceIndex()
+        self._vocab = {}
+        self._columns = {}
+
+    def _code(self, value):
+        ix = self._vocab.get(value)
+        if ix is None:
+            ix = self._vocab[value] = len(self._vocab)
+        return ix
+
+    def _extend(self, table, columns):
+        for name, values in columns.items():
+            self._columns.setdefault((table, name), []).extend(values)
+
+    def _span(self, table, provs):
+        triples = [self._index.encode(p) for p in provs]
+        self._extend(table, {
+            "doc": [d for d, _, _ in triples],
+            "begin": [b for _, b, _ in triples],
+            "end": [e for _, _, e in triples],
+            })
+
+    def add(self, mfile):
+        self._span("types", [row.subj for row in mfile.types])
+        self._extend("types", {
+            "type": [self._code(row.reln) for row in mfile.types],
+            "gloss": [row.obj for row in mfile.types],
+            })
+
+        self._span("cmentions", [row.subj for row in mfile.canonical_mentions])
+        self._span("cmentions_target", [row.obj for row in mfile.canonical_mentions])
+        self._extend("cmentions", {"weight": [row.weight for row in mfile.canonical_mentions]})
+
+        self._span("links", [row.subj for row in mfile.links])
+        self._extend("links", {
+            "name": [row.obj for row in mfile.links],
+            "weight": [row.weight for row in mfile.links],
+            })
+
+        provs = [_provenances(row.prov) for row in mfile.relations]
+        self._span("relations", [row.subj for row in mfile.relations])
+        self._span("relations_object", [row.obj for row in mfile.relations])
+        self._extend("relations", {
+            "reln": [self._code(row.reln) for row in mfile.relations],
+            "weight": [row.weight for row in mfile.relations],
+            "n_provs": [len(ps) for ps in provs],
+            })
+        self._span("provenances", [p for ps in provs for p in ps])
+        return self
+
+    def arrays(self):
+        arrays = {}
+        arrays["doc_ids"], arrays["doc_ids_offsets"] = _pack_strings(self._index.doc_ids)
+        arrays["vocab"], arrays["vocab_offsets"] = _pack_strings(list(self._vocab))
+        for table in ["types", "cmentions", "cmentions_target", "links", "relations", "relations_object", "provenances"]:
+            for name in ["doc", "begin", "end"]:
+                arrays["{}_{}".format(table, name)] = np.array(self._columns.get((table, name), []), dtype=np.int32)
+        for table, name in [("types", "type"), ("relations", "reln"), ("relations", "n_provs")]:
+            arrays["{}_{}".format(table, name)] = np.array(self._columns.get((table, name), []), dtype=np.int32)
+        for table in ["cmentions", "links", "relations"]:
+            arrays["{}_weight".format(table)] = np.array(self._columns.get((table, "weight"), []), dtype=np.float64)
+        arrays["types_gloss"], arrays["types_gloss_offsets"] = _pack_strings(self._columns.get(("types", "gloss"), []))
+        arrays["links_name"], arrays["links_name_offsets"] = _pack_strings(self._columns.get(("links", "name"), []))
+        return arrays
+
+    def save(self, path):
+        tmp, old = path + ".tmp", path + ".old"
+        for dir_ in [tmp, old]:
+            shutil.rmtree(dir_, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, array in self.arrays().items():
+            np.save(os.path.join(tmp, name + ".npy"), array)
+        # Swap the directories so that readers never see a partial one.
+        if os.path.exists(path):
+            os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+class Columns(object):
+    """
+    The columns of a saved submission (see ColumnWriter).
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.doc_ids = _unpack_strings(arrays["doc_ids"], arrays["doc_ids_offsets"])
+        self.vocab = _unpack_strings(arrays["vocab"], arrays["vocab_offsets"])
+        self._glosses = arrays["types_gloss"], arrays["types_gloss_offsets"]
+        self._names = arrays["links_name"], arrays["links_name_offsets"]
+        self._prov_offsets = np.cumsum(np.concatenate([[0], arrays["relations_n_provs"]])).astype(np.int64)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-maps the columns saved at @path: only the rows that are
+        read are paged in.
+        """
+        return cls({name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r", allow_pickle=False)
+                    for name in os.listdir(path) if name.endswith(".npy")})
+
+    def __len__(self):
+        return len(self.arrays["relations_doc"])
+
+    def _spans(self, table, ixs):
+        doc_ids = self.doc_ids
+        a = self.arrays
+        return [tuple.__new__(Provenance, (doc_ids[d], b, e)) for d, b, e in zip(a[table + "_doc"][ixs].tolist(), a[table + "_begin"][ixs].tolist(), a[table + "_end"][ixs].tolist())]
+
+    @staticmethod
+    def _strings(strings, ixs):
+        buf, offsets = strings
+        return [buf[offsets[i]:offsets[i+1]].tobytes().decode("utf-8") for i in ixs.tolist()]
+
+    def _types(self, ixs):
+        a, vocab = self.arrays, self.vocab
+        return [Entry(m, vocab[t], g, None, None, None) for m, t, g in zip(self._spans("types", ixs), a["types_type"][ixs].tolist(), self._strings(self._glosses, ixs))]
+
+    def _cmentions(self, ixs):
+        return [Entry(m, 'canonical_mention', n, None, w, None) for m, n, w in zip(self._spans("cmentions", ixs), self._spans("cmentions_target", ixs), self.arrays["cmentions_weight"][ixs].tolist())]
+
+    def _links(self, ixs):
+        return [Entry(m, 'link', l, None, w, None) for m, l, w in zip(self._spans("links", ixs), self._strings(self._names, ixs), self.arrays["links_weight"][ixs].tolist())]
+
+    def _relations(self, ixs):
+        a, vocab, offsets = self.arrays, self.vocab, self._prov_offsets
+        prov_ixs = np.concatenate([np.arange(offsets[i], offsets[i+1]) for i in ixs.tolist()]) if len(ixs) > 0 else np.zeros(0, dtype=np.int64)
+        provs = self._spans("provenances", prov_ixs)
+        ends = np.cumsum(offsets[ixs + 1] - offsets[ixs]).tolist()
+        return [Entry(m, vocab[r], n, tuple(provs[end - (offsets[i+1] - offsets[i]):end]), w, None)
+                for i, end, m, n, r, w in zip(ixs.tolist(), ends, self._spans("relations", ixs), self._spans("relations_object", ixs), a["relations_reln"][ixs].tolist(), a["relations_weight"][ixs].tolist())]
+
+    def _mfile(self, types, cmentions, links, relations):
+        return MFile(self._types(types), self._links(links), self._cmentions(cmentions), self._relations(relations))
+
+    _TABLES = ("types", "cmentions", "links", "relations")
+
+    def mfile(self):
+        """
+        @returns: the saved MFile.
+        """
+        a = self.arrays
+        return self._mfile(*(np.arange(len(a[table + "_doc"])) for table in self._TABLES))
+
+    def iter_documents(self, tables=_TABLES):
+        """
+        Yields (doc_id, MFile) for every document, in the order the
+        documents were added, building the entries of one document at a
+        time. Concatenating the yielded MFiles gives the rows of mfile()
+        (grouped by document). Only the entries of @tables (a subset of
+        types, cmentions, links and relations) are built; the other
+        tables are left empty.
+        """
+        groups = []
+        for table in self._TABLES:
+            docs = self.arrays[table + "_doc"] if table in tables else np.zeros(0, dtype=np.int32)
+            order = np.argsort(docs, kind="stable")
+            groups.append((order, np.searchsorted(docs[order], np.arange(len(self.doc_ids) + 1))))
+        for d, doc_id in enumerate(self.doc_ids):
+            yield doc_id, self._mfile(*(order[bounds[d]:bounds[d+1]] for order, bounds in groups))
+
+def save_columns(mfile, path):
+    ColumnWriter().add(mfile).save(path)
+
+def load_columns(path):
+    return Columns.load(path)
+
+def test_columns(tmpdir):
+    import io
+    from .parser import MFileReader, _test_mfile
+    mfile = MFileReader().parse(io.StringIO(_test_mfile()))
+
+    path = str(tmpdir.join("submission.m.columns"))
+    writer = ColumnWriter()
+    for _, part in MFileReader().iter_documents(io.StringIO(_test_mfile())):
+        writer.add(part)
+    writer.save(path)
+    # Saving again replaces the columns.
+    writer.save(path)
+    assert sorted(os.listdir(str(tmpdir))) == ["submission.m.columns"]
+
+    columns = load_columns(path)
+    assert isinstance(columns.arrays["relations_doc"], np.memmap)
+    mfile_ = columns.mfile()
+    assert mfile_.types == mfile.types
+    assert mfile_.links == mfile.links
+    assert mfile_.canonical_mentions == mfile.canonical_mentions
+    assert [row._replace(prov=_provenances(row.prov)) for row in mfile.relations] == mfile_.relations
+
+    parts = list(columns.iter_documents())
+    assert [doc_id for doc_id, _ in parts] == columns.doc_ids
+    for doc_id, part in parts:
+        assert all(row.subj.doc_id == doc_id for table in part for row in table)
+    assert MFile.concatenate(part for _, part in parts) == mfile_
+
+    parts = list(columns.iter_documents(tables=("links",)))
+    assert MFile.concatenate(part for _, part in parts) == MFile([], mfile_.links, [], [])
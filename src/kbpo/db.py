@@ -4,9 +4,18 @@
 Database utilities.
 """
 
+import sys
+import time
 import logging
 import re
+import threading
+import bisect
+import weakref
+import itertools
+from contextlib import contextmanager
+from collections import namedtuple
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extras import execute_values, NumericRange, register_composite, Json
 
 # TODO: use django settings instead?
@@ -24,47 +33,285 @@ def connect(params=_PARAMS):
     register_composite('kbpo.score', conn, True)
     return conn
 
-CONN = None
+# Maximum number of pooled connections.
+POOL_SIZE = 8
 
-try:
-    CONN = connect()
-except:
-    logging.error("Unable to connect to database")
+class _Pool(object):
+    """
+    A ThreadedConnectionPool that blocks (instead of failing) when
+    every connection is in use.
+    """
+    def __init__(self, params, maxconn):
+        params = dict(params)
+        params["options"] = (params.get("options", "") + " -c search_path=kbpo").strip()
+        self._pool = ThreadedConnectionPool(1, maxconn, **params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        conn = self._pool.getconn()
+        try:
+            register_composite('kbpo.score', conn, True)
+            conn.commit()
+        finally:
+            self._pool.putconn(conn)
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            return self._pool.getconn()
+        except:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            self._pool.putconn(conn, close=conn.closed)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def connect_pool(params=_PARAMS, maxconn=POOL_SIZE):
+    """
+    (Re)creates the connection pool to connect to the database with @params.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.closeall()
+        _POOL = _Pool(params, maxconn)
+    return _POOL
+
+def get_pool():
+    """
+    @returns: the connection pool, connecting to the database on first use.
+    """
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = _Pool(_PARAMS, POOL_SIZE)
+    return _POOL
+
+AcquisitionStats = namedtuple("AcquisitionStats", ["count", "total", "max"])
+_ACQUISITIONS = {}
+_ACQUISITIONS_LOCK = threading.Lock()
+
+def _call_site(depth):
+    frame = sys._getframe(depth)
+    return "{}:{}".format(frame.f_globals.get("__name__"), frame.f_code.co_name)
+
+def _record_acquisition(site, wait):
+    with _ACQUISITIONS_LOCK:
+        count, total, max_ = _ACQUISITIONS.get(site, (0, 0., 0.))
+        _ACQUISITIONS[site] = AcquisitionStats(count + 1, total + wait, max(max_, wait))
+
+def acquisition_stats():
+    """
+    @returns: the number of connections acquired from the pool, and the
+    total and maximum time spent waiting for them, for every call site
+    (module:function).
+    """
+    with _ACQUISITIONS_LOCK:
+        return dict(_ACQUISITIONS)
+
+@contextmanager
+def _connection(site):
+    pool = get_pool()
+    start = time.time()
+    conn = pool.getconn()
+    _record_acquisition(site, time.time() - start)
+    try:
+        # Commits on success and rolls back on failure.
+        with conn:
+            yield conn
+    finally:
+        pool.putconn(conn)
+
+def connection(site=None):
+    """
+    A context manager that checks out a connection from the pool for a
+    single transaction, committed when the block exits successfully.
+    """
+    return _connection(site or _call_site(2))
+
+@contextmanager
+def _cursor(name, site):
+    with _connection(site) as conn:
+        with conn.cursor(name) as cur:
+            yield cur
+
+def cursor(name=None, site=None):
+    """
+    A context manager for a cursor (a server-side cursor if @name is
+    given) on a pooled connection, in its own transaction.
+    """
+    return _cursor(name, site or _call_site(2))
 
 def get(sql, cur=None, **kwargs):
     """
     Gets a single row from the SQL statement above.
     """
     if cur is None:
-        with CONN:
-            with CONN.cursor() as cur:
-                return get(sql, cur, **kwargs)
+        with _cursor(None, _call_site(2)) as cur:
+            return get(sql, cur, **kwargs)
     else:
         cur.execute(sql, kwargs)
         return cur.fetchone()
 
 # NOTE: We aren't returning a generator because it is dangerous!
 # If some of these handles are left unconsumed, then the cursor may not
-# be closed and that causes hung transactions.
+# be closed and that causes hung transactions. Use stream() to iterate
+# over large result sets instead.
 def select(sql, cur=None, **kwargs):
     """Wrapper around psycopg execute function to yield the result of a SELECT statement"""
     if cur is None:
-        with CONN:
-            with CONN.cursor() as cur:
-                cur.execute(sql, kwargs)
-                return [row for row in cur]
+        with _cursor(None, _call_site(2)) as cur:
+            cur.execute(sql, kwargs)
+            return [row for row in cur]
     else:
         cur.execute(sql, kwargs)
         return [row for row in cur]
 
+# Rows fetched per round trip by stream().
+ITERSIZE = 10000
+_STREAM_IDS = itertools.count()
+
+@contextmanager
+def _stream(sql, itersize, site, kwargs):
+    with _cursor("stream_{}".format(next(_STREAM_IDS)), site) as cur:
+        cur.itersize = itersize
+        cur.execute(sql, kwargs)
+        yield cur
+
+def stream(sql, itersize=ITERSIZE, **kwargs):
+    """
+    A streaming variant of select: a context manager for a server-side
+    cursor over the rows of the SELECT statement @sql, which fetches
+    @itersize rows at a time. Unlike a generator, the cursor and its
+    transaction are closed when the block exits, even if the rows have
+    not all been consumed.
+
+        with db.stream("SELECT ...", corpus_tag=corpus_tag) as rows:
+            for row in rows:
+                ...
+    """
+    return _stream(sql, itersize, _call_site(2), kwargs)
+
+class LatencyHistogram(object):
+    """
+    A thread-safe histogram of latencies (in seconds), with buckets
+    bounded by BUCKETS (in milliseconds).
+    """
+    BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        ix = bisect.bisect_left(self.BUCKETS, seconds * 1000)
+        with self._lock:
+            self.counts[ix] += 1
+            self.count += 1
+            self.total += seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def as_dict(self):
+        """
+        @returns: the count of latencies under each bucket boundary
+        ("inf" for the rest), with the number and mean of all latencies.
+        """
+        with self._lock:
+            buckets = {("{}ms".format(b)): c for b, c in zip(self.BUCKETS, self.counts)}
+            buckets["inf"] = self.counts[-1]
+            return {"count": self.count, "mean": self.mean(), "buckets": buckets}
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s")
+
+class PreparedStatement(object):
+    """
+    A statement that is PREPAREd once on every pooled connection that
+    runs it, and then EXECUTEd by name.
+        name - the name of the statement.
+        sql - the statement, with %(name)s parameters (like select).
+        histogram - a LatencyHistogram of its executions.
+    """
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.params = []
+        def _positional(match):
+            if match.group(1) not in self.params:
+                self.params.append(match.group(1))
+            return "${}".format(self.params.index(match.group(1)) + 1)
+        self._prepare_sql = "PREPARE {} AS {}".format(name, _PARAM_RE.sub(_positional, sql).replace("%%", "%"))
+        self._execute_sql = "EXECUTE {}".format(name) + (" ({})".format(", ".join(["%s"] * len(self.params))) if self.params else "")
+        self.histogram = LatencyHistogram()
+        # The connections (weakly referenced) this statement is prepared on.
+        self._connections = weakref.WeakSet()
+
+    def execute(self, cur, **kwargs):
+        start = time.time()
+        conn = cur.connection
+        if conn not in self._connections:
+            cur.execute(self._prepare_sql)
+            self._connections.add(conn)
+        cur.execute(self._execute_sql, [kwargs[param] for param in self.params])
+        self.histogram.observe(time.time() - start)
+
+    def get(self, cur=None, **kwargs):
+        """
+        Gets a single row from the statement (see get).
+        """
+        if cur is None:
+            with _cursor(None, _call_site(2)) as cur:
+                return self.get(cur, **kwargs)
+        self.execute(cur, **kwargs)
+        return cur.fetchone()
+
+    def select(self, cur=None, **kwargs):
+        """
+        Gets every row from the statement (see select).
+        """
+        if cur is None:
+            with _cursor(None, _call_site(2)) as cur:
+                return self.select(cur, **kwargs)
+        self.execute(cur, **kwargs)
+        return [row for row in cur]
+
+STATEMENTS = {}
+
+def prepare(name, sql):
+    """
+    Registers the statement @sql as @name (see PreparedStatement).
+    """
+    statement = STATEMENTS.get(name)
+    if statement is None:
+        statement = STATEMENTS[name] = PreparedStatement(name, sql)
+    elif statement.sql != sql:
+        raise ValueError("A different statement has already been registered as {}".format(name))
+    return statement
+
+def statement_stats():
+    """
+    @returns: the latency histogram of every registered statement.
+    """
+    return {name: statement.histogram.as_dict() for name, statement in STATEMENTS.items()}
+
 def mogrify(sql, cur=None, verbose = True, **kwargs):
     """Wrapper around psycopg mogrigy function"""
     if cur is None:
-        with CONN:
-            with CONN.cursor() as cur:
-                if verbose:
-                    print(cur.mogrify(sql, kwargs))
-                return cur.mogrify(sql, kwargs)
+        with _cursor(None, _call_site(2)) as cur:
+            if verbose:
+                print(cur.mogrify(sql, kwargs))
+            return cur.mogrify(sql, kwargs)
     else:
         if verbose:
             print(cur.mogrify(sql, kwargs))
@@ -73,9 +320,8 @@ def mogrify(sql, cur=None, verbose = True, **kwargs):
 def execute(sql, cur=None, **kwargs):
     """Wrapper around psycopg execute function to not yield the result of execute statement"""
     if cur is None:
-        with CONN:
-            with CONN.cursor() as cur:
-                cur.execute(sql, kwargs)
+        with _cursor(None, _call_site(2)) as cur:
+            cur.execute(sql, kwargs)
     else:
         cur.execute(sql, kwargs)
 
@@ -95,3 +341,119 @@ class TypedNumericRangeAdapter(psycopg2._range.NumberRangeAdapter):
     def getquoted(self):
         return super(TypedNumericRangeAdapter, self).getquoted() + b'::' + self.adapted.pg_type
 psycopg2.extensions.register_adapter(Int4NumericRange, TypedNumericRangeAdapter)
+
+def _copy_text(value):
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, NumericRange):
+        return "{}{},{}{}".format(value.lower_inc and '[' or '(', value.lower, value.upper, value.upper_inc and ']' or ')')
+    elif isinstance(value, (list, tuple)):
+        # Array elements are double-quoted (ranges contain commas).
+        return "{" + ",".join('"' + _copy_text(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in value) + "}"
+    elif isinstance(value, float):
+        # Not repr(value): subclasses such as numpy.float64 decorate it.
+        return float.__repr__(float(value))
+    else:
+        return str(value)
+
+def _copy_value(value):
+    """
+    Encodes @value as a field of COPY's text format.
+    """
+    if value is None:
+        return r'\N'
+    return _copy_text(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class _CopyStream(object):
+    """
+    A file-like object that encodes the rows of a generator in COPY's
+    text format as they are read, so that rows are never all in memory.
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self.n_rows = 0
+
+    def read(self, size=-1):
+        chunks, length = [self._buffer], len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = "\t".join(_copy_value(v) for v in row) + "\n"
+            chunks.append(line)
+            length += len(line)
+            self.n_rows += 1
+        data = "".join(chunks)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+def copy_from(cur, table, columns, rows, chunk_size=1<<16):
+    """
+    Streams @rows (an iterable of tuples with @columns) into @table using COPY FROM STDIN.
+    @returns: the number of rows copied.
+    """
+    stream = _CopyStream(rows)
+    cur.copy_expert("COPY {} ({}) FROM STDIN".format(table, ", ".join(columns)), stream, size=chunk_size)
+    return stream.n_rows
+
+def secondary_indexes(table, cur=None):
+    """
+    @returns: the (name, definition) of every index on @table that is not backing a constraint.
+    """
+    return select("""
+        SELECT indexname AS name, indexdef AS definition
+        FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %(table)s
+          AND indexname NOT IN (SELECT conname FROM pg_constraint)
+        ORDER BY indexname
+        """, cur=cur, table=table)
+
+def test_acquisition_stats():
+    def _caller():
+        return _call_site(1)
+    site = _caller()
+    assert site == "{}:_caller".format(__name__)
+    _record_acquisition(site, 0.5)
+    _record_acquisition(site, 0.1)
+    stats = acquisition_stats()[site]
+    assert stats.count == 2 and abs(stats.total - 0.6) < 1e-9 and stats.max == 0.5
+
+def test_prepared_statement():
+    statement = PreparedStatement("_test_statement", """
+        SELECT * FROM document WHERE id = %(doc_id)s AND title LIKE 'A%%' AND id <> %(other)s OR id = %(doc_id)s
+        """)
+    assert statement.params == ["doc_id", "other"]
+    assert "id = $1 AND title LIKE 'A%' AND id <> $2 OR id = $1" in statement._prepare_sql
+    assert statement._execute_sql == "EXECUTE _test_statement (%s, %s)"
+
+    histogram = LatencyHistogram()
+    histogram.observe(0.0001)
+    histogram.observe(0.003)
+    histogram.observe(10.)
+    stats = histogram.as_dict()
+    assert stats["count"] == 3
+    assert stats["buckets"]["0.5ms"] == 1 and stats["buckets"]["5ms"] == 1 and stats["buckets"]["inf"] == 1
+
+def test_copy_value():
+    assert _copy_value(None) == r'\N'
+    assert _copy_value("a\tb\\c\nd") == r'a\tb\\c\nd'
+    assert _copy_value(0.5) == '0.5'
+    import numpy as np
+    assert _copy_value(np.float64(0.5)) == '0.5'
+    assert _copy_value(np.float64(1e-20)) == '1e-20'
+    assert _copy_value(Int4NumericRange(1, 10)) == '[1,10)'
+    assert _copy_value([Int4NumericRange(1, 10), Int4NumericRange(2, 3)]) == '{"[1,10)","[2,3)"}'
+    assert _copy_value(['a"b']) == r'{"a\\"b"}'
+
+def test_copy_stream():
+    stream = _CopyStream([(1, "a"), (2, None)])
+    assert stream.read(3) == "1\ta"
+    assert stream.read() == "\n2\t\\N\n"
+    assert stream.read(10) == ""
+    assert stream.n_rows == 2
@@ -3,13 +3,96 @@ Various distributions from the database.
 """
 import logging
 from collections import Counter, defaultdict
+from itertools import islice
+
+import numpy as np
 
 from . import db
 from .api import get_documents, get_submissions, get_submission
 from .counter_utils import normalize
+from .instance_index import InstanceIndex
+from .accumulators import PrecisionAccumulator, RecallAccumulator, consume_grouped
 
 logger = logging.getLogger(__name__)
 
+def _key(row):
+    return (row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper))
+
+def _grouped_arrays(rows, column, index, chunk_size=10000):
+    # Only ids and values are kept per row, so that @rows can be
+    # streamed from a server-side cursor; keys are interned a chunk
+    # of rows at a time (see InstanceIndex.intern_many).
+    groups = defaultdict(lambda: ([], []))
+    rows = iter(rows)
+    for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+        for row, ix in zip(chunk, index.intern_many([_key(row) for row in chunk]).tolist()):
+            ids, values = groups[row.submission_id]
+            ids.append(ix)
+            value = getattr(row, column)
+            values.append(np.nan if value is None else value)
+    return {submission_id: (np.array(ids, dtype=np.int32), np.array(values, dtype=np.float64))
+            for submission_id, (ids, values) in groups.items()}
+
+def _distribution(rows, column, index=None):
+    """
+    Groups @rows by submission_id into Counters over instance keys, or,
+    if an InstanceIndex @index is given, into (ids, probs) arrays over @index.
+    """
+    if index is None:
+        distribution = defaultdict(Counter)
+        for row in rows:
+            distribution[row.submission_id][_key(row)] = float(getattr(row, column))
+        return distribution
+
+    return _grouped_arrays(rows, column, index)
+
+def _samples(rows, column, index=None):
+    """
+    Groups @rows by submission_id into lists of [x, f(x)], or, if an
+    InstanceIndex @index is given, into (ids, fxs) arrays over @index
+    with NaN for unannotated samples.
+    """
+    if index is None:
+        ret = defaultdict(list)
+        for row in rows:
+            ret[row.submission_id].append((_key(row), getattr(row, column)))
+        return ret
+
+    return _grouped_arrays(rows, column, index)
+
+def _weighted_samples(rows, column, index=None):
+    """
+    Like _samples, but also groups the importance weights of the
+    samples (aligned with the samples) from the "weight" column of @rows.
+    """
+    weights = defaultdict(list)
+    def _rows():
+        for row in rows:
+            weights[row.submission_id].append(row.weight)
+            yield row
+    samples = _samples(_rows(), column, index)
+    if index is not None:
+        weights = {submission_id: np.array(ws, dtype=np.float64) for submission_id, ws in weights.items()}
+    return samples, weights
+
+def test_grouped_arrays():
+    from collections import namedtuple
+    Row = namedtuple("Row", ["submission_id", "doc_id", "subject", "object", "fx"])
+    rows = [Row(1, "doc1", db.Int4NumericRange(0, 1), db.Int4NumericRange(2, 3), True),
+            Row(2, "doc1", db.Int4NumericRange(0, 1), db.Int4NumericRange(2, 3), None),
+            Row(1, "doc2", db.Int4NumericRange(0, 1), db.Int4NumericRange(2, 3), False),]
+    index = InstanceIndex()
+    ret = _samples(iter(rows), "fx", index)
+    assert ret[1][0].tolist() == [0, 1] and ret[1][1].tolist() == [1., 0.]
+    assert ret[2][0].tolist() == [0] and np.isnan(ret[2][1][0])
+
+    WeightedRow = namedtuple("WeightedRow", Row._fields + ("weight",))
+    rows = [WeightedRow(*row, weight=w) for row, w in zip(rows, [2., 1., 0.5])]
+    ret, weights = _weighted_samples(iter(rows), "fx", InstanceIndex())
+    assert ret[1][1].tolist() == [1., 0.] and weights[1].tolist() == [2., 0.5] and weights[2].tolist() == [1.]
+    ret, weights = _weighted_samples(iter(rows), "fx")
+    assert [fx for _, fx in ret[1]] == [True, False] and weights[1] == [2., 0.5]
+
 ## Document distributions
 def document_uniform(corpus_tag):
     """
@@ -37,30 +120,29 @@ def document_entity(corpus_tag, seed_documents, mention_table="evaluation_mentio
 
     # TODO: Reweight documents and mentions with some sort of TF-IDF scoring.
     distribution = Counter()
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("CREATE TEMPORARY TABLE _seed_document (doc_id TEXT NOT NULL) ON COMMIT DROP;")
-            db.execute_values(cur, "INSERT INTO _seed_document VALUES %s", seed_documents)
-            for row in db.select(r"""
-                WITH links AS (
-                    SELECT DISTINCT plainto_tsquery(m.gloss) AS query
-                    FROM {mention_table} m
-                    JOIN _seed_document d ON (m.doc_id = d.doc_id)
-                    WHERE m.canonical_span = m.span
-                    ),
-                    document_links AS (
-                    SELECT d.doc_id, query
-                    FROM document_tag d, document_index i,
-                         links l
-                    WHERE d.tag = %(corpus_tag)s
-                      AND i.doc_id = d.doc_id
-                      AND i.tsvector @@ query
-                    )
-                SELECT doc_id, COUNT(*) AS count
-                FROM document_links
-                GROUP BY doc_id;
-            """.format(mention_table=mention_table), cur, corpus_tag=corpus_tag):
-                distribution[row.doc_id] = row.count
+    with db.cursor() as cur:
+        cur.execute("CREATE TEMPORARY TABLE _seed_document (doc_id TEXT NOT NULL) ON COMMIT DROP;")
+        db.execute_values(cur, "INSERT INTO _seed_document VALUES %s", seed_documents)
+        for row in db.select(r"""
+            WITH links AS (
+                SELECT DISTINCT plainto_tsquery(m.gloss) AS query
+                FROM {mention_table} m
+                JOIN _seed_document d ON (m.doc_id = d.doc_id)
+                WHERE m.canonical_span = m.span
+                ),
+                document_links AS (
+                SELECT d.doc_id, query
+                FROM document_tag d, document_index i,
+                     links l
+                WHERE d.tag = %(corpus_tag)s
+                  AND i.doc_id = d.doc_id
+                  AND i.tsvector @@ query
+                )
+            SELECT doc_id, COUNT(*) AS count
+            FROM document_links
+            GROUP BY doc_id;
+        """.format(mention_table=mention_table), cur, corpus_tag=corpus_tag):
+            distribution[row.doc_id] = row.count
     return normalize(distribution)
 
 def test_document_entity():
@@ -72,28 +154,28 @@ def test_document_entity():
     assert abs(Z - 1.0) < 1.e-5, "Distribution for documents is not normalized: Z = {}".format(Z)
 
 ## Submission distributions
-def submission_instance(corpus_tag, submission_id=None):
+_SUBMISSION_INSTANCE_SQL = """
+    WITH _counts AS (
+        SELECT submission_id, SUM(count) AS count
+        FROM submission_statistics s
+        GROUP BY submission_id
+        )
+    SELECT s.submission_id, s.doc_id, s.subject, s.object, 1./c.count AS prob
+    FROM submission_relation s
+    JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
+    JOIN _counts c ON (s.submission_id = c.submission_id)
+    {where}
+    """
+
+def submission_instance(corpus_tag, submission_id=None, index=None):
     if submission_id is not None:
         assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
         where = "WHERE s.submission_id = %(submission_id)s"
     else:
         where = ""
 
-    distribution = defaultdict(Counter)
-    for row in db.select("""
-        WITH _counts AS (
-            SELECT submission_id, SUM(count) AS count
-            FROM submission_statistics s
-            GROUP BY submission_id
-            )
-        SELECT s.submission_id, s.doc_id, s.subject, s.object, 1./c.count AS prob
-        FROM submission_relation s
-        JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
-        JOIN _counts c ON (s.submission_id = c.submission_id)
-        {where}
-        """.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id):
-        distribution[row.submission_id][row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)] = float(row.prob)
-    return distribution
+    with db.stream(_SUBMISSION_INSTANCE_SQL.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id) as rows:
+        return _distribution(rows, "prob", index)
 
 def test_submission_instance():
     tag = 'kbp2016'
@@ -111,29 +193,29 @@ def test_submission_instance_with_id():
     Z = sum(P.values())
     assert abs(Z - 1.0) < 1.e-5, "Distribution for {} is not normalized: Z = {}".format(submission.id, Z)
 
-def submission_relation(corpus_tag, submission_id=None):
+_SUBMISSION_RELATION_SQL = """
+    WITH _counts AS (
+        SELECT submission_id, relation, SUM(count) AS count
+        FROM submission_statistics s
+        GROUP BY submission_id, relation),
+        _relation_counts AS (SELECT submission_id, COUNT(*) FROM _counts GROUP BY submission_id)
+    SELECT s.submission_id, s.doc_id, s.subject, s.object, (1./c.count)/(r.count) AS prob
+    FROM submission_relation s
+    JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
+    JOIN _counts c ON (s.submission_id = c.submission_id AND s.relation = c.relation)
+    JOIN _relation_counts r ON (s.submission_id = r.submission_id)
+    {where}
+    """
+
+def submission_relation(corpus_tag, submission_id=None, index=None):
     if submission_id is not None:
         assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
         where = "WHERE s.submission_id = %(submission_id)s"
     else:
         where = ""
 
-    distribution = defaultdict(Counter)
-    for row in db.select("""
-        WITH _counts AS (
-            SELECT submission_id, relation, SUM(count) AS count
-            FROM submission_statistics s
-            GROUP BY submission_id, relation),
-            _relation_counts AS (SELECT submission_id, COUNT(*) FROM _counts GROUP BY submission_id)
-        SELECT s.submission_id, s.doc_id, s.subject, s.object, (1./c.count)/(r.count) AS prob
-        FROM submission_relation s
-        JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
-        JOIN _counts c ON (s.submission_id = c.submission_id AND s.relation = c.relation)
-        JOIN _relation_counts r ON (s.submission_id = r.submission_id)
-        {where}
-        """.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id):
-        distribution[row.submission_id][row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)] = float(row.prob)
-    return distribution
+    with db.stream(_SUBMISSION_RELATION_SQL.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id) as rows:
+        return _distribution(rows, "prob", index)
 
 def test_submission_relation():
     tag = 'kbp2016'
@@ -151,29 +233,29 @@ def test_submission_relation_by_id():
     Z = sum(P.values())
     assert abs(Z - 1.0) < 1.e-5, "Distribution for {} is not normalized: Z = {}".format(submission.id, Z)
 
-def submission_entity(corpus_tag, submission_id=None):
+_SUBMISSION_ENTITY_SQL = """
+    WITH _counts AS (
+            SELECT submission_id, subject_entity, SUM(count) AS count
+            FROM submission_statistics s
+            GROUP BY submission_id, subject_entity),
+         _entity_counts AS (SELECT submission_id, COUNT(*) FROM _counts GROUP BY submission_id)
+    SELECT s.submission_id, s.doc_id, s.subject, s.object, s.subject_entity, (1./c.count)/(ec.count) AS prob
+    FROM submission_entity_relation s
+    JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
+    JOIN _counts c ON (s.submission_id = c.submission_id AND c.subject_entity = s.subject_entity)
+    JOIN _entity_counts ec ON (s.submission_id = ec.submission_id)
+    {where}
+    """
+
+def submission_entity(corpus_tag, submission_id=None, index=None):
     if submission_id is not None:
         assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
         where = "WHERE s.submission_id = %(submission_id)s"
     else:
         where = ""
 
-    distribution = defaultdict(Counter)
-    for row in db.select("""
-        WITH _counts AS (
-                SELECT submission_id, subject_entity, SUM(count) AS count
-                FROM submission_statistics s
-                GROUP BY submission_id, subject_entity),
-             _entity_counts AS (SELECT submission_id, COUNT(*) FROM _counts GROUP BY submission_id)
-        SELECT s.submission_id, s.doc_id, s.subject, s.object, s.subject_entity, (1./c.count)/(ec.count) AS prob
-        FROM submission_entity_relation s
-        JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
-        JOIN _counts c ON (s.submission_id = c.submission_id AND c.subject_entity = s.subject_entity)
-        JOIN _entity_counts ec ON (s.submission_id = ec.submission_id)
-        {where}
-        """.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id):
-        distribution[row.submission_id][row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)] = float(row.prob)
-    return distribution
+    with db.stream(_SUBMISSION_ENTITY_SQL.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id) as rows:
+        return _distribution(rows, "prob", index)
 
 def test_submission_entity():
     tag = 'kbp2016'
@@ -191,27 +273,31 @@ def test_submission_entity_by_id():
     Z = sum(P.values())
     assert abs(Z - 1.0) < 1.e-5, "Distribution for {} is not normalized: Z = {}".format(submission.id, Z)
 
-def submission_entity_relation(corpus_tag, submission_id=None):
+_SUBMISSION_ENTITY_RELATION_SQL = """
+    SELECT s.submission_id, s.doc_id, s.subject, s.object, s.subject_entity, (erc.count/ec.count)/(rc.count) AS likelihood
+    FROM submission_entity_relation s
+    JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
+    JOIN submission_relation_counts rc ON (s.submission_id = rc.submission_id AND rc.relation = s.relation)
+    JOIN submission_entity_counts ec ON (s.submission_id = ec.submission_id AND ec.subject_entity = s.subject_entity)
+    JOIN submission_entity_relation_counts erc ON (s.submission_id = erc.submission_id AND erc.subject_entity = s.subject_entity)
+    {where}
+    """
+
+def submission_entity_relation(corpus_tag, submission_id=None, index=None):
     if submission_id is not None:
         assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
         where = "WHERE s.submission_id = %(submission_id)s"
     else:
         where = ""
 
-    distribution = defaultdict(Counter)
-    for row in db.select("""
-        SELECT s.submission_id, s.doc_id, s.subject, s.object, s.subject_entity, (erc.count/ec.count)/(rc.count) AS likelihood
-        FROM submission_entity_relation s
-        JOIN submission s_ ON (s_.id = s.submission_id AND s_.corpus_tag = %(corpus_tag)s)
-        JOIN submission_relation_counts rc ON (s.submission_id = rc.submission_id AND rc.relation = s.relation)
-        JOIN submission_entity_counts ec ON (s.submission_id = ec.submission_id AND ec.subject_entity = s.subject_entity)
-        JOIN submission_entity_relation_counts erc ON (s.submission_id = erc.submission_id AND erc.subject_entity = s.subject_entity)
-        {where}
-        """.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id):
-        distribution[row.submission_id][row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)] = float(row.likelihood)
-    for submission_id in distribution:
-        distribution[submission_id] = normalize(distribution[submission_id])
-
+    with db.stream(_SUBMISSION_ENTITY_RELATION_SQL.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id) as rows:
+        distribution = _distribution(rows, "likelihood", index)
+    for submission_id, P in distribution.items():
+        if index is None:
+            distribution[submission_id] = normalize(P)
+        else:
+            ids, probs = P
+            distribution[submission_id] = (ids, probs / probs.sum())
     return distribution
 
 def test_submission_entity_relation():
@@ -221,6 +307,16 @@ def test_submission_entity_relation():
         Z = sum(Ps[submission.id].values())
         assert abs(Z - 1.0) < 1.e-5, "Distribution for {} is not normalized: Z = {}".format(submission.id, Z)
 
+def test_submission_entity_relation_index():
+    tag = 'kbp2016'
+    Ps = submission_entity_relation(tag)
+    index = InstanceIndex()
+    Ps_ = submission_entity_relation(tag, index=index)
+    assert sorted(Ps) == sorted(Ps_)
+    for submission_id, (ids, probs) in Ps_.items():
+        assert abs(probs.sum() - 1.0) < 1.e-5
+        assert dict(zip(index.keys(ids), probs)).keys() == Ps[submission_id].keys()
+
 def test_submission_entity_relation_by_id():
     tag = 'kbp2016'
     submission = get_submissions(tag)[0]
@@ -230,8 +326,78 @@ def test_submission_entity_relation_by_id():
     Z = sum(P.values())
     assert abs(Z - 1.0) < 1.e-5, "Distribution for {} is not normalized: Z = {}".format(submission.id, Z)
 
+def submission_distribution_sql(type_, submission_id=None):
+    """
+    @returns: the SQL (with a %(corpus_tag)s and, given @submission_id,
+    a %(submission_id)s parameter) of the submission distribution of type
+    @type_, and the name of its (possibly unnormalized) probability column.
+    """
+    where = "WHERE s.submission_id = %(submission_id)s" if submission_id is not None else ""
+    if type_ == "instance":
+        return _SUBMISSION_INSTANCE_SQL.format(where=where), "prob"
+    elif type_ == "relation":
+        return _SUBMISSION_RELATION_SQL.format(where=where), "prob"
+    elif type_ == "entity":
+        return _SUBMISSION_ENTITY_SQL.format(where=where), "prob"
+    elif type_ == "entity_relation":
+        return _SUBMISSION_ENTITY_RELATION_SQL.format(where=where), "likelihood"
+    else:
+        raise ValueError("Invalid submission sampling distribution type: {}".format(type_))
+
+def overlapping_distributions(corpus_tag, type_, submission_id):
+    """
+    @returns: the (normalized) distributions of type @type_ of the other
+    submissions on @corpus_tag, restricted to the instances of
+    @submission_id, with the mass outside of them on the key None.
+    Submissions that share no instance with @submission_id are left out.
+    Only the overlap is read from the database.
+    """
+    sql, column = submission_distribution_sql(type_)
+    with db.stream("""
+        SELECT p.submission_id, p.doc_id, p.subject, p.object, p.{column} / p.total AS prob
+        FROM (SELECT q.*, SUM(q.{column}) OVER (PARTITION BY q.submission_id) AS total FROM ({sql}) q) p
+        JOIN submission_relation r ON (r.submission_id = %(submission_id)s AND r.doc_id = p.doc_id AND r.subject = p.subject AND r.object = p.object)
+        WHERE p.submission_id <> %(submission_id)s AND p.{column} > 0
+        """.format(sql=sql, column=column), corpus_tag=corpus_tag, submission_id=submission_id) as rows:
+        distribution = _distribution(rows, "prob")
+    for P in distribution.values():
+        P[None] = max(1. - sum(P.values()), 0.)
+    return distribution
+
+def overlapping_samples(corpus_tag, type_, submission_id):
+    """
+    @returns: the samples [x, f(x)] of the other submissions on
+    @corpus_tag and their importance weights (see Xh), where every sample
+    outside the instances of @submission_id has the key None. Only the
+    overlapping samples are read from the database; the others are
+    counted.
+    """
+    with db.stream("""
+        SELECT b.submission_id, d.doc_id, d.subject, d.object, s.correct AS fx, d.weight
+        FROM sample_batch b
+        JOIN submission_sample d ON (b.id = d.batch_id)
+        JOIN submission_entries s ON (d.doc_id = s.doc_id AND d.subject = s.subject AND d.object = s.object AND b.submission_id = s.submission_id)
+        JOIN submission_relation r ON (r.submission_id = %(submission_id)s AND r.doc_id = d.doc_id AND r.subject = d.subject AND r.object = d.object)
+        WHERE b.corpus_tag = %(corpus_tag)s AND b.distribution_type = %(distribution_type)s AND b.submission_id <> %(submission_id)s
+        ORDER BY d.doc_id, d.subject, d.object, b.id
+        """, corpus_tag=corpus_tag, distribution_type=type_, submission_id=submission_id) as rows:
+        Xhs, Whs = _weighted_samples(rows, "fx")
+    for row in db.select("""
+        SELECT b.submission_id, COUNT(*) AS count, COUNT(s.correct) AS annotated
+        FROM sample_batch b
+        JOIN submission_sample d ON (b.id = d.batch_id)
+        JOIN submission_entries s ON (d.doc_id = s.doc_id AND d.subject = s.subject AND d.object = s.object AND b.submission_id = s.submission_id)
+        WHERE b.corpus_tag = %(corpus_tag)s AND b.distribution_type = %(distribution_type)s AND b.submission_id <> %(submission_id)s
+          AND NOT EXISTS (SELECT 1 FROM submission_relation r WHERE r.submission_id = %(submission_id)s AND r.doc_id = d.doc_id AND r.subject = d.subject AND r.object = d.object)
+        GROUP BY b.submission_id
+        """, corpus_tag=corpus_tag, distribution_type=type_, submission_id=submission_id):
+        # Their f(x) never counts (p(None) = 0), only whether they are annotated.
+        Xhs[row.submission_id].extend([(None, 0.)] * row.annotated + [(None, None)] * (row.count - row.annotated))
+        Whs[row.submission_id].extend([1.] * row.count)
+    return Xhs, Whs
+
 ## Obtaining samples from database.
-def Y0(corpus_tag, submission_id=None):
+def Y0(corpus_tag, submission_id=None, index=None):
     """
     Use the document_sample table to get which documents have been exhaustively sampled.
     """
@@ -241,10 +407,9 @@ def Y0(corpus_tag, submission_id=None):
     else:
         where = ""
 
-    ret = defaultdict(list)
     # NOTE: This is perfectly OK to do, BECAUSE it is the exhaustive
     # annotation.
-    rows = db.select("""
+    with db.stream("""
         SELECT s.id AS submission_id, r.doc_id, r.subject, r.object, COALESCE(s_.correct, FALSE) AS gx
         FROM submission s
         JOIN document_sample d ON (true)
@@ -253,10 +418,31 @@ def Y0(corpus_tag, submission_id=None):
         LEFT JOIN submission_entries s_ ON (s.id = submission_id AND r.doc_id = s_.doc_id AND r.subject = s_.subject AND r.object = s_.object)
         WHERE s.corpus_tag = %(corpus_tag)s {where}
         ORDER BY s.id, r.doc_id, r.subject, r.object
-        """.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id)
-    for row in rows:
-        ret[row.submission_id].append(((row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)), row.gx))
-    return ret
+        """.format(where=where), corpus_tag=corpus_tag, submission_id=submission_id) as rows:
+        return _samples(rows, "gx", index)
+
+def Y0_accumulators(corpus_tag, submission_id=None, chunk_size=10000):
+    """
+    Streams g(x) for the exhaustively annotated documents from a
+    server-side cursor into one RecallAccumulator per submission (under
+    the uniform P0), without materializing Y0.
+    """
+    if submission_id is not None:
+        assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
+        where = "AND s.id = %(submission_id)s"
+    else:
+        where = ""
+
+    with db.stream("""
+            SELECT s.id AS submission_id, COALESCE(s_.correct, FALSE) AS gx
+            FROM submission s
+            JOIN document_sample d ON (true)
+            JOIN document_tag t ON (d.doc_id = t.doc_id AND t.tag = %(corpus_tag)s)
+            JOIN evaluation_relation r ON (d.doc_id = r.doc_id)
+            LEFT JOIN submission_entries s_ ON (s.id = submission_id AND r.doc_id = s_.doc_id AND r.subject = s_.subject AND r.object = s_.object)
+            WHERE s.corpus_tag = %(corpus_tag)s {where}
+            """.format(where=where), itersize=chunk_size, corpus_tag=corpus_tag, submission_id=submission_id) as cur:
+        return consume_grouped(cur, RecallAccumulator, column="gx", chunk_size=chunk_size)
 
 def test_Y0():
     corpus_tag = 'kbp2016'
@@ -272,25 +458,58 @@ def test_Y0_by_id():
     Y = Y0(corpus_tag, submission_id)[submission_id]
     assert len(Y) == 926
 
-def Xh(corpus_tag, distribution_type, submission_id = None):
+def Xh(corpus_tag, distribution_type, submission_id=None, index=None, weights=False):
+    """
+    @returns: the samples [x, f(x)] of every submission (see _samples).
+    With @weights, also returns their importance weights p(x)/r(x),
+    which are 1 unless the samples were drawn from a proposal r other
+    than the submission's distribution p (see sampling).
+    """
     if submission_id is not None:
         assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
         where = "AND b.submission_id = %(submission_id)s"
     else:
         where = ""
 
-    ret = defaultdict(list)
-    rows = db.select("""
-        SELECT b.submission_id, d.doc_id, d.subject, d.object, s.correct AS fx
+    with db.stream("""
+        SELECT b.submission_id, d.doc_id, d.subject, d.object, s.correct AS fx, d.weight
         FROM sample_batch b
         JOIN submission_sample d ON (b.id = d.batch_id)
         JOIN submission_entries s ON (d.doc_id = s.doc_id AND d.subject = s.subject AND d.object = s.object AND b.submission_id = s.submission_id)
         WHERE b.distribution_type = %(distribution_type)s {where}
-        ORDER BY d.doc_id, d.subject, d.object
-          """.format(where=where), submission_id=submission_id, distribution_type=distribution_type)
-    for row in rows:
-        ret[row.submission_id].append(((row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)), row.fx))
-    return ret
+        ORDER BY d.doc_id, d.subject, d.object, b.id
+          """.format(where=where), submission_id=submission_id, distribution_type=distribution_type) as rows:
+        return _weighted_samples(rows, "fx", index) if weights else _samples(rows, "fx", index)
+
+def Xh_accumulators(corpus_tag, distribution_type, submission_id=None, chunk_size=10000):
+    """
+    Streams the (importance weighted) f(x) of the samples of every
+    submission from a server-side cursor into one PrecisionAccumulator
+    per submission, without materializing the samples.
+    """
+    if submission_id is not None:
+        assert get_submission(submission_id).corpus_tag == corpus_tag, "Submission {} is not on corpus {}".format(submission_id, corpus_tag)
+        where = "AND b.submission_id = %(submission_id)s"
+    else:
+        where = ""
+
+    with db.stream("""
+            SELECT b.submission_id, s.correct AS fx, d.weight
+            FROM sample_batch b
+            JOIN submission_sample d ON (b.id = d.batch_id)
+            JOIN submission_entries s ON (d.doc_id = s.doc_id AND d.subject = s.subject AND d.object = s.object AND b.submission_id = s.submission_id)
+            WHERE b.distribution_type = %(distribution_type)s {where}
+            """.format(where=where), itersize=chunk_size, submission_id=submission_id, distribution_type=distribution_type) as cur:
+        return consume_grouped(cur, PrecisionAccumulator, column="fx", chunk_size=chunk_size, weight_column="weight")
+
+def test_Xh_accumulators():
+    corpus_tag = "kbp2016"
+    distribution_type = "relation"
+    Xhs = Xh(corpus_tag, distribution_type)
+    accs = Xh_accumulators(corpus_tag, distribution_type)
+    assert sorted(accs) == sorted(Xhs)
+    for submission_id, Xh_ in Xhs.items():
+        assert accs[submission_id].n == sum(1 for _, fx in Xh_ if fx is not None)
 
 def test_Xhs():
     corpus_tag = 'kbp2016'
@@ -11,28 +11,44 @@ import numpy as np
 from tqdm import trange
 
 from . import counter_utils
+from .accumulators import PrecisionAccumulator, RecallAccumulator
+from . import evaluation_matrix
 from .sample_util import sample_uniformly_with_replacement
 from .schema import Score
 
 logger = logging.getLogger(__name__)
 
 def _avg(it, fn):
-    ret, n = 0., 0.
+    acc = PrecisionAccumulator()
     for x, fx in it:
         if fx is not None:
-            ret += (fn(x, fx) -  ret)/(n+1)
-            n += 1
-    return ret
+            acc.add(fn(x, fx))
+    return acc.value
+
+def _weighted(Xh, Wh=None):
+    """
+    Pairs every sample [x, f(x)] of @Xh with its importance weight in
+    @Wh (see distribution.Xh); samples are unweighted without @Wh.
+    """
+    return zip(Xh, Wh) if Wh is not None else ((sample, 1.) for sample in Xh)
+
+def _resample(Xhs, Whs=None):
+    """
+    Draws a bootstrap sample of every Xh, keeping the weights of @Whs aligned.
+    """
+    if Whs is None:
+        return [sample_uniformly_with_replacement(X, len(X)) for X in Xhs], None
+    XWs = [sample_uniformly_with_replacement(list(zip(X, Wh)), len(X)) for X, Wh in zip(Xhs, Whs)]
+    return [[sample for sample, _ in XW] for XW in XWs], [[w for _, w in XW] for XW in XWs]
 
 def _avg2(it, fn):
-    ret, n = [0., 0.], 0.
+    acc, acc_ = PrecisionAccumulator(), PrecisionAccumulator()
     for x, fx in it:
         if fx is not None:
             ret_ = fn(x, fx)
-            ret[0] += (ret_[0] -  ret[0])/(n+1)
-            ret[1] += (ret_[1] -  ret[1])/(n+1)
-            n += 1
-    return ret
+            acc.add(ret_[0])
+            acc_.add(ret_[1])
+    return [acc.value, acc_.value]
 
 def _sum(it, fn):
     ret = 0.
@@ -86,18 +102,21 @@ def weighted_score(P0, P, Y0, Xs):
     return ps, rs, f1s
 
 # Simple sampling based estimators
-def simple_precision(Xhs):
+def simple_precision(Xhs, Whs=None):
     """
     Compute precision without the complex weighting strategy.
 
     @Xhs - a list of m lists of samples of [x, f(x)] drawn from some distribution; one for every system.
+    @Whs - optional importance weights of the samples (see distribution.Xh).
     @returns: a list of m precisions
     """
     m = len(Xhs)
     pis = []
     for i in range(m):
-        pi_i = _avg(Xhs[i], lambda _, fx: fx)
-        pis.append(pi_i)
+        acc = PrecisionAccumulator()
+        for (_, fx), w in _weighted(Xhs[i], None if Whs is None else Whs[i]):
+            acc.add(fx, w)
+        pis.append(acc.value)
     return pis
 
 def simple_recall(P0, Y0):
@@ -111,28 +130,23 @@ def simple_recall(P0, Y0):
 
     rhos = []
     for Y0i in Y0:
-        rho_i = 0.
-        Z = 0.
-        n = 0.
+        acc = RecallAccumulator()
         for x, gxi in Y0i:
-            if gxi is not None:
-                rho_i += (P0[x]*gxi - rho_i)/(n+1)
-                Z += (P0[x] - Z)/(n+1)
-                n += 1
-        rhos.append(rho_i / Z)
+            acc.add(gxi, P0[x])
+        rhos.append(acc.value)
     return rhos
 
-def simple_score(P0, P, Y0, Xhs):
-    ps = simple_precision(Xhs)
+def simple_score(P0, P, Y0, Xhs, Whs=None):
+    ps = simple_precision(Xhs, Whs)
     rs = simple_recall(P0, Y0)
     f1s = [2 * p * r / (p + r) if p + r > 0. else 0. for p, r in zip(ps, rs)]
     return ps, rs, f1s
 
-def simple_score_with_intervals(P0, Ps, Y0, Xhs, num_epochs=100, interval=90):
+def simple_score_with_intervals(P0, Ps, Y0, Xhs, num_epochs=100, interval=90, Whs=None):
     data = [[] for _ in Ps]
 
     logger.info("Computing base metrics")
-    ps, rs, f1s = simple_score(P0, Ps, Y0, Xhs)
+    ps, rs, f1s = simple_score(P0, Ps, Y0, Xhs, Whs)
     for i, row in enumerate(zip(ps, rs, f1s)):
         data[i].append(row)
 
@@ -142,8 +156,8 @@ def simple_score_with_intervals(P0, Ps, Y0, Xhs, num_epochs=100, interval=90):
         # Create a bootstrap sample of Y0_X by getting a new batch of X
         Y0_ = [x for x, _ in sample_uniformly_with_replacement(Y0[0], len(Y0[0]))]
         Y0_ = [[(x, GX[i][x]) for x in Y0_] for i, Y in enumerate(Y0)]
-        Xhs_ = [sample_uniformly_with_replacement(X, len(X)) for X in Xhs]
-        ps, rs, f1s = simple_score(P0, Ps, Y0_, Xhs_)
+        Xhs_, Whs_ = _resample(Xhs, Whs)
+        ps, rs, f1s = simple_score(P0, Ps, Y0_, Xhs_, Whs_)
         for i, row in enumerate(zip(ps, rs, f1s)):
             data[i].append(row)
     ret = []
@@ -421,11 +435,14 @@ def test_update_proposal_distribution():
             W_, Z_, Q_ = W, Z, Q
 
 
-def joint_precision(P, Xhs, W=None, Q=None, method="heuristic"):
+def joint_precision(P, Xhs, W=None, Q=None, method="heuristic", Whs=None):
     r"""
     Compute precision for a collection of samples, where
         P = [Counter], each element of P is a distribution over instances in $\sX$.
         Xs = [[x, f(x)]], a list of samples drawn from each distribution.
+        Whs = [[w(x)]], optional importance weights $p_j(x)/r_j(x)$ of
+              samples that were drawn from some r_j other than p_j
+              (see distribution.Xh).
     Returns:
     $\pi_i = \sum_{j=1}^{m} w_{ij}/n_j \sum_{x \in \Xh_j} p_i(x)/q_i(x) f(x)$, where
         $q_i(x) = \sum_{j=1}^{m} w_{ij} p_{j}(x)$ and
@@ -446,15 +463,15 @@ def joint_precision(P, Xhs, W=None, Q=None, method="heuristic"):
             if W[i][j] == 0.: continue # just ignore this set.
             pi_ij = 0.
             n_j = 0
-            for x, fx in Xhs[j]:
+            for (x, fx), w in _weighted(Xhs[j], None if Whs is None else Whs[j]):
                 if fx is not None:
-                    pi_ij += (P[i][x]/Q[i][x]*fx - pi_ij)/(n_j+1)
+                    pi_ij += (w*P[i][x]/Q[i][x]*fx - pi_ij)/(n_j+1)
                     n_j += 1
             pi_i += W[i][j] * pi_ij
         pis.append(pi_i)
     return pis
 
-def pooled_recall(P0, P, Xhs, W=None, Q=None, method="heuristic"):
+def pooled_recall(P0, P, Xhs, W=None, Q=None, method="heuristic", Whs=None):
     r"""
     \nu_i =
         \sum_{j} w_{j} \sum_{x \in Y_j} u(x)/q(x) g_i(x)/
@@ -475,10 +492,10 @@ def pooled_recall(P0, P, Xhs, W=None, Q=None, method="heuristic"):
             if W[i][j] == 0.: continue # just ignore this set.
             nu_ij, Z_ij = 0., 0.
             n_j = 0.
-            for x, fx in Xhs[j]:
+            for (x, fx), w in _weighted(Xhs[j], None if Whs is None else Whs[j]):
                 if fx is not None:
-                    gx = 1.0 if fx > 0. else 0.0
-                    gxi = 1.0 if x in P[i] and fx > 0. else 0.0
+                    gx = w if fx > 0. else 0.0
+                    gxi = w if x in P[i] and fx > 0. else 0.0
 
                     nu_ij += (P0[x]/Q[i][x]*gxi - nu_ij)/(n_j+1)
                     Z_ij += (P0[x]/Q[i][x]*gx - Z_ij)/(n_j+1)
@@ -524,30 +541,24 @@ def pool_recall(P0, Y0):
     # A "merged" Y0 which combines gxi from each system.
     Y0_ = _merge_Y0(Y0)
 
-    Z = 0.
-    theta = 0.
-    n = 0.
+    acc = RecallAccumulator()
     for x, gx in Y0_:
-        if gx is not None:
-            theta += (P0[x]*gx - theta)/(n+1)
-            Z += (P0[x] - Z)/(n+1)
-            n += 1
-
-    return theta/Z
+        acc.add(gx, P0[x])
+    return acc.value
 
-def joint_recall(P0, P, Y0, Xhs, W=None, Q=None):
+def joint_recall(P0, P, Y0, Xhs, W=None, Q=None, Whs=None):
     theta = pool_recall(P0, Y0)
-    nus = pooled_recall(P0, P, Xhs, W=W, Q=Q)
+    nus = pooled_recall(P0, P, Xhs, W=W, Q=Q, Whs=Whs)
     rhos = [theta * nu_i for nu_i in nus]
     return rhos
 
-def joint_score(P0, P, Y0, Xhs, W=None, Q=None):
-    ps = joint_precision(P, Xhs, W=W, Q=Q)
-    rs = joint_recall(P0, P, Y0, Xhs, W=W, Q=Q)
+def joint_score(P0, P, Y0, Xhs, W=None, Q=None, Whs=None):
+    ps = joint_precision(P, Xhs, W=W, Q=Q, Whs=Whs)
+    rs = joint_recall(P0, P, Y0, Xhs, W=W, Q=Q, Whs=Whs)
     f1s = [2 * p * r / (p + r) if p + r > 0. else 0. for p, r in zip(ps, rs)]
     return ps, rs, f1s
 
-def joint_score_with_intervals(P0, Ps, Y0, Xhs, W=None, Q=None, num_epochs=100, interval=90):
+def joint_score_with_intervals(P0, Ps, Y0, Xhs, W=None, Q=None, num_epochs=100, interval=90, Whs=None):
     data = [[] for _ in Ps]
 
     logger.info("Precomputing weights")
@@ -557,7 +568,7 @@ def joint_score_with_intervals(P0, Ps, Y0, Xhs, W=None, Q=None, num_epochs=100,
         Q = construct_proposal_distribution(W, Ps)
 
     logger.info("Computing base metrics")
-    ps, rs, f1s = joint_score(P0, Ps, Y0, Xhs, W=W, Q=Q)
+    ps, rs, f1s = joint_score(P0, Ps, Y0, Xhs, W=W, Q=Q, Whs=Whs)
     for i, row in enumerate(zip(ps, rs, f1s)):
         data[i].append(row)
 
@@ -567,9 +578,9 @@ def joint_score_with_intervals(P0, Ps, Y0, Xhs, W=None, Q=None, num_epochs=100,
         # Create a bootstrap sample of Y0_X by getting a new batch of X
         Y0_ = [x for x, _ in sample_uniformly_with_replacement(Y0[0], len(Y0[0]))]
         Y0_ = [[(x, GX[i][x]) for x in Y0_] for i, Y in enumerate(Y0)]
-        Xhs_ = [sample_uniformly_with_replacement(X, len(X)) for X in Xhs]
+        Xhs_, Whs_ = _resample(Xhs, Whs)
 
-        ps, rs, f1s = joint_score(P0, Ps, Y0_, Xhs_, W=W, Q=Q)
+        ps, rs, f1s = joint_score(P0, Ps, Y0_, Xhs_, W=W, Q=Q, Whs=Whs_)
         for i, row in enumerate(zip(ps, rs, f1s)):
             data[i].append(row)
 
@@ -650,10 +661,10 @@ def estimate_variance(Ps, Xhs, Ws=None, Qs=None):
 
     return var
 
-def estimate_n_samples(Ps, Xhs, Ws=None, Zs=None, Qs=None, target=500, eps=5e-4):
+def estimate_n_samples(Ps, Xhs, target=500, eps=5e-4):
     r"""
-    Finds the number of samples to draw to estimate pi_i within eps.
-    @target is the targetted effective samples
+    Finds the smallest number of samples to draw for Ps[-1] whose joint
+    variance is within @eps of that of @target samples (see evaluation_matrix.plan_n_samples).
     """
     m = len(Xhs)
     assert len(Ps) == m + 1
@@ -661,46 +672,5 @@ def estimate_n_samples(Ps, Xhs, Ws=None, Zs=None, Qs=None, target=500, eps=5e-4)
     if len(Xhs) == 0:
         return target
 
-    if Ws is None or Zs is None:
-        # Produce Ws
-        Ws, Zs = compute_weights(Ps[:-1], Xhs, "heuristic")
-    if Qs is None:
-        Qs = construct_proposal_distribution(Ws, Ps[:-1])
-    assert len(Ws) == m
-    assert len(Zs) == m
-    assert len(Qs) == m
-
-    # Adds Xhs
-    Xhs = Xhs[:] + [[(None, 1) for _ in range(target)]]
-
-    # Compute the target variance
-    target_variance = estimate_variance(Ps[m:], Xhs[m:])
-    logger.debug("Target variance is %.3e with %d samples", target_variance, target)
-
-    Ws_new, Zs_new = update_weights(Ps, Xhs, Ws, Zs)
-    Qs_new = update_proposal_distribution(Ws_new, Zs_new, Ps, Qs, Zs)
-
-    min_variance = estimate_variance(Ps, Xhs, Ws=Ws_new, Qs=Qs_new)
-    logger.debug("Min variance is %.3e with %d samples", min_variance, target)
-    assert min_variance <= target_variance
-    if min_variance == target_variance:
-        return target
-
-    # Now do binary search starting from target.
-    lower, upper = 1, target
-    while lower < upper-1:
-        pivot = int((lower + upper)/2)
-        Xhs[-1] = [(None, 1) for _ in range(pivot)]
-        Ws_new, Zs_new = update_weights(Ps, Xhs, Ws, Zs)
-        Qs_new = update_proposal_distribution(Ws_new, Zs_new, Ps, Qs, Zs)
-
-        var = estimate_variance(Ps, Xhs, Ws=Ws_new, Qs=Qs_new)
-        logger.debug("Pivot variance is %.3e with %d samples", var, pivot)
-
-        if var - target_variance < -eps: # lower variance than target
-            upper = pivot
-        elif var - target_variance > eps:
-            lower = pivot
-        else:
-            break
-    return pivot
+    n, _ = evaluation_matrix.plan_n_samples(Ps, Xhs, target=target, eps=eps)
+    return n
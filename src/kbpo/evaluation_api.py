@@ -1,53 +1,224 @@
+import os
+import fcntl
+import hashlib
 import logging
 
 from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
 
 from . import db
 from . import evaluation
+from . import evaluation_matrix
 from . import distribution as PD
 from .schema import Score
+from .scoring_state import ScoringState
+from .snapshot import load_snapshot
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-def get_updated_scores(corpus_tag, mode='joint', interval=90, num_epochs=500):
+ENGINES = {
+    "python": evaluation,
+    "matrix": evaluation_matrix,
+    }
+
+def get_updated_scores(corpus_tag, mode='joint', interval=90, num_epochs=500, engine='python', workers=1, seed=None, cache_dir=None):
     """
     Returns updates scores.
+    @engine chooses between the reference implementation in
+    evaluation ("python") and the array-backed one in
+    evaluation_matrix ("matrix").
+    @workers and @seed control the bootstrap of the "matrix" engine:
+    epochs are spread over @workers processes and are reproducible
+    for a given @seed.
+    @cache_dir, if given, keeps versioned snapshots of the
+    distributions and samples (see snapshot) between runs.
     """
+    if engine not in ENGINES:
+        raise ValueError("Unknown scoring engine {}".format(engine))
+    kwargs = {}
+    if engine == "matrix":
+        kwargs = {"workers": workers, "seed": seed}
+    elif workers != 1 or seed is not None:
+        raise ValueError("workers and seed are only supported by the matrix engine")
+    engine = ENGINES[engine]
+
     systems = []
-    Ps, Xhs, Y0 = [], [], []
+    Ps, Xhs, Y0, Whs = [], [], [], []
 
     #TODO:  Have per relation scores also computed.
-    logger.info("Getting distributions")
-    Ps_ = {
-        #"entity": PD.submission_entity(corpus_tag),
-        #"relation": PD.submission_relation(corpus_tag),
-        "entity_relation": PD.submission_entity_relation(corpus_tag),
-        }
+    if cache_dir is None:
+        logger.info("Getting distributions")
+        Ps_ = {
+            #"entity": PD.submission_entity(corpus_tag),
+            #"relation": PD.submission_relation(corpus_tag),
+            "entity_relation": PD.submission_entity_relation(corpus_tag),
+            }
 
-    logger.info("Getting samples")
-    Y0_ = PD.Y0(corpus_tag)
+        logger.info("Getting samples")
+        Y0_ = PD.Y0(corpus_tag)
 
     #for score_type in ["entity", "relation"]:
     for score_type in ["entity_relation"]:
-        for submission_id, Xh in PD.Xh(corpus_tag, score_type).items():
-            Ps.append(Ps_[score_type][submission_id])
-            Xhs.append(Xh)
-            Y0.append(Y0_[submission_id])
-            systems.append((submission_id, score_type))
+        if cache_dir is None:
+            Xhs_, Whs_ = PD.Xh(corpus_tag, score_type, weights=True)
+            for submission_id, Xh in Xhs_.items():
+                Ps.append(Ps_[score_type][submission_id])
+                Xhs.append(Xh)
+                Whs.append(Whs_[submission_id])
+                Y0.append(Y0_.get(submission_id, []))
+                systems.append((submission_id, score_type))
+        else:
+            logger.info("Getting distributions and samples")
+            snapshot = load_snapshot(corpus_tag, score_type, cache_dir)
+            Ps_, Xhs_, Y0_ = snapshot.counters()
+            Ps.extend(Ps_)
+            Xhs.extend(Xhs_)
+            Y0.extend(Y0_)
+            Whs.extend(snapshot.weights())
+            systems.extend((submission_id, score_type) for submission_id in snapshot.systems)
     P0 = defaultdict(lambda: 1.0) # TODO: maybe this should change?
 
     logger.info("Scoring %s systems", len(Ps))
     if mode == "joint":
-        metrics = evaluation.joint_score_with_intervals(P0, Ps, Y0, Xhs, interval=interval, num_epochs=num_epochs)
+        metrics = engine.joint_score_with_intervals(P0, Ps, Y0, Xhs, interval=interval, num_epochs=num_epochs, Whs=Whs, **kwargs)
     elif mode == "simple":
-        metrics = evaluation.simple_score_with_intervals(P0, Ps, Y0, Xhs, interval=interval, num_epochs=num_epochs)
+        metrics = engine.simple_score_with_intervals(P0, Ps, Y0, Xhs, interval=interval, num_epochs=num_epochs, Whs=Whs, **kwargs)
     else:
         raise ValueError("Unknown scoring mode {}", mode)
     logger.info("Done!")
     return list(zip(systems, metrics))
 
+def _version(rows):
+    return hashlib.md5(repr([tuple(row) for row in rows]).encode("utf-8")).hexdigest()[:12]
+
+def corpus_version(corpus_tag):
+    """
+    @returns: a short hash that changes whenever the data shared by the
+    statistics of every system on @corpus_tag changes: the submissions
+    (and their distributions) or the exhaustive annotations (Y0).
+
+    Y0 is every evaluation_relation row in the exhaustively sampled
+    documents, and the labels g(x) of every system on it depend on all
+    of them, so any new annotation in those documents (including of a
+    submission's samples) changes the version and rebuilds the whole
+    scoring state; annotations elsewhere only update the systems they
+    belong to (see system_versions).
+    """
+    return _version(db.select("""
+        SELECT
+            (SELECT COUNT(*) FROM submission WHERE corpus_tag = %(corpus_tag)s) AS submissions,
+            (SELECT MAX(updated) FROM submission WHERE corpus_tag = %(corpus_tag)s) AS submission_updated,
+            (SELECT md5(string_agg(r.doc_id || r.subject::text || r.object::text || r.relation, ',' ORDER BY r.doc_id, r.subject, r.object, r.relation))
+             FROM document_sample d
+             JOIN document_tag t ON (d.doc_id = t.doc_id AND t.tag = %(corpus_tag)s)
+             JOIN evaluation_relation r ON (d.doc_id = r.doc_id)) AS exhaustive_relations
+        """, corpus_tag=corpus_tag))
+
+def system_versions(corpus_tag, score_type):
+    """
+    @returns: a dictionary of submission id -> a short hash that changes
+    whenever the samples of the submission or their annotations change.
+    """
+    return {row.submission_id: _version([row]) for row in db.select("""
+        SELECT b.submission_id, COUNT(*) AS samples, SUM(d.weight) AS weight, MAX(d.created) AS created,
+               COUNT(s.correct) AS annotated, SUM(s.correct::int) AS correct
+        FROM sample_batch b
+        JOIN submission_sample d ON (b.id = d.batch_id)
+        LEFT JOIN submission_entries s ON (d.doc_id = s.doc_id AND d.subject = s.subject AND d.object = s.object AND b.submission_id = s.submission_id)
+        WHERE b.corpus_tag = %(corpus_tag)s AND b.distribution_type = %(distribution_type)s
+        GROUP BY b.submission_id
+        ORDER BY b.submission_id
+        """, corpus_tag=corpus_tag, distribution_type=score_type)}
+
+_EMPTY = (np.zeros(0, dtype=np.int64), np.zeros(0))
+
+def _build_scoring_state(corpus_tag, score_type, P0):
+    """
+    Builds a ScoringState from scratch for every sampled submission on @corpus_tag.
+    """
+    state = ScoringState(P0)
+    Ps = PD.submission_entity_relation(corpus_tag, index=state.index)
+    Y0 = PD.Y0(corpus_tag, index=state.index)
+    Xhs, Whs = PD.Xh(corpus_tag, score_type, index=state.index, weights=True)
+    for submission_id, Xh in Xhs.items():
+        if submission_id not in Ps: continue
+        state.update_arrays(submission_id, Ps[submission_id], Xh, Y0.get(submission_id, _EMPTY), Whs[submission_id])
+    return state
+
+def _update_scoring_state(state, corpus_tag, score_type, submission_id):
+    """
+    Reloads the distribution, samples and Y0 of @submission_id into @state.
+    """
+    Xhs, Whs = PD.Xh(corpus_tag, score_type, submission_id, index=state.index, weights=True)
+    Xh = Xhs.get(submission_id)
+    if Xh is None or len(Xh[0]) == 0:
+        return
+    P = PD.submission_entity_relation(corpus_tag, submission_id, index=state.index).get(submission_id)
+    if P is None:
+        return
+    logger.info("Updating scoring state for submission %s", submission_id)
+    Y0 = PD.Y0(corpus_tag, submission_id, index=state.index).get(submission_id, _EMPTY)
+    state.update_arrays(submission_id, P, Xh, Y0, Whs[submission_id])
+
+@contextmanager
+def _locked(path):
+    """
+    Holds an exclusive lock on @path (through a companion lock file)
+    so that concurrent updates of the file do not overwrite each other.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def get_incremental_scores(corpus_tag, submission_id, state_path, score_type="entity_relation", interval=90, num_epochs=500, workers=1, seed=None):
+    """
+    Returns updated joint scores after the samples of @submission_id changed.
+
+    The sufficient statistics of every system are kept in @state_path
+    between runs, along with the versions of the data they were
+    computed from (see corpus_version and system_versions). The state
+    is rebuilt when the submissions or Y0 changed; otherwise only the
+    systems whose samples or annotations changed (@submission_id, and
+    any other whose samples were annotated since) are read from the
+    database, and only the statistics that depend on them are
+    recomputed (see scoring_state).
+    """
+    P0 = defaultdict(lambda: 1.0) # TODO: maybe this should change?
+    with _locked(state_path):
+        version, versions = corpus_version(corpus_tag), system_versions(corpus_tag, score_type)
+        state = ScoringState.load(state_path, P0) if os.path.exists(state_path) else None
+        if state is not None and (state.version != version or set(state.versions) - set(versions)):
+            logger.info("The data of %s changed since the scoring state was saved", corpus_tag)
+            state = None
+
+        if state is None:
+            logger.info("Building scoring state for %s", corpus_tag)
+            state = _build_scoring_state(corpus_tag, score_type, P0)
+        else:
+            changed = sorted(system for system, version_ in versions.items() if state.versions.get(system) != version_)
+            if submission_id not in changed:
+                logger.info("Samples of submission %s have not changed", submission_id)
+            # Y0 is unchanged (it is part of the corpus version), so
+            # only the changed systems need to be reloaded.
+            for system in changed:
+                _update_scoring_state(state, corpus_tag, score_type, system)
+        # The versions were read first, so changes made while reading
+        # the data are picked up by the next update.
+        state.version, state.versions = version, versions
+        state.save(state_path)
+
+    logger.info("Scoring %s systems", len(state))
+    metrics = state.scores_with_intervals(num_epochs=num_epochs, interval=interval, seed=seed, workers=workers)
+    return [((system, score_type), metric) for system, metric in zip(state.systems, metrics)]
+
 def update_score(submission_id, score_type, entry, cur=None):
     """
     Actually update the in the table.
@@ -64,10 +235,9 @@ def update_score(submission_id, score_type, entry, cur=None):
 
 def test_update_score():
     try:
-        with db.CONN:
-            with db.CONN.cursor() as cur:
-                update_score(1, "entity", Score(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9), cur=cur)
-                assert False
+        with db.cursor() as cur:
+            update_score(1, "entity", Score(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9), cur=cur)
+            assert False
 
     except AssertionError:
         pass
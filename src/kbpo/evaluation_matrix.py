@@ -0,0 +1,606 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Array-backed versions of the estimators in evaluation.py.
+
+Every instance key (doc_id, subject, object) is interned once into an
+integer index; the submission distributions P are stored as a sparse
+(m x |X|) matrix and the samples Xhs as integer arrays into that index.
+The joint estimators are then a handful of matrix products instead of
+m^2 passes over Python dictionaries.
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from .schema import Score
+
+logger = logging.getLogger(__name__)
+
+def _safe_divide(num, den):
+    """
+    Elementwise num/den, defaulting to 0 wherever den is 0.
+    """
+    ret = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=ret, where=(den != 0))
+    return ret
+
+def _f1(ps, rs):
+    return np.where(ps + rs > 0., 2 * ps * rs / np.where(ps + rs > 0., ps + rs, 1.), 0.)
+
+class ScoringMatrices(object):
+    """
+    Interns the instances of @P and @Xhs and stores them as arrays:
+        P - a (m x n) CSR matrix of submission distributions.
+        samples - for every system, arrays (ixs, fxs, ws) into the
+                  columns of P; fxs is NaN for unannotated samples and
+                  ws holds the importance weights of @Whs (default 1).
+        cols - the (sorted) columns of P that appear in any sample.
+    """
+    def __init__(self, P, Xhs, Whs=None):
+        assert len(P) == len(Xhs)
+        assert Whs is None or len(Whs) == len(Xhs)
+        self.keys = []
+        self.index = {}
+
+        indptr, indices, data = [0], [], []
+        for P_i in P:
+            for x, v in P_i.items():
+                indices.append(self._intern(x))
+                data.append(v)
+            indptr.append(len(indices))
+
+        samples = []
+        for j, Xh in enumerate(Xhs):
+            ixs = np.array([self._intern(x) for x, _ in Xh], dtype=np.int64)
+            fxs = np.array([np.nan if fx is None else fx for _, fx in Xh], dtype=np.float64)
+            ws = np.ones(len(Xh)) if Whs is None else np.array(Whs[j], dtype=np.float64).reshape(len(Xh))
+            samples.append((ixs, fxs, ws))
+
+        self.m, self.n = len(P), len(self.keys)
+        # NOTE: built from raw arrays so that explicit zeros are kept:
+        # pooled_recall treats any key of P[i] as part of the support.
+        self.P = sp.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)), shape=(self.m, self.n))
+        self.S = sp.csr_matrix((np.ones(len(data)), self.P.indices, self.P.indptr), shape=(self.m, self.n))
+
+        self.cols = np.unique(np.concatenate([ixs for ixs, _, _ in samples])) if samples else np.zeros(0, dtype=np.int64)
+        self.samples = [(np.searchsorted(self.cols, ixs), fxs, ws) for ixs, fxs, ws in samples]
+        self.Ns = np.array([np.sum(~np.isnan(fxs)) for _, fxs, _ in self.samples])
+
+    def _intern(self, x):
+        ix = self.index.get(x)
+        if ix is None:
+            ix = self.index[x] = len(self.keys)
+            self.keys.append(x)
+        return ix
+
+    def column_vector(self, P0):
+        """
+        Evaluates the (possibly default) dictionary @P0 on self.cols.
+        """
+        return np.array([P0[self.keys[ix]] for ix in self.cols], dtype=np.float64)
+
+    def sample_matrix(self, fn):
+        """
+        Returns a (m x |cols|) matrix whose j-th row is
+            1/n_j \\sum_{x \\in Xh_j} w(x) fn(f(x)),
+        accumulated by column; unannotated samples are skipped.
+        """
+        ret = np.zeros((self.m, len(self.cols)))
+        for j, (pos, fxs, ws) in enumerate(self.samples):
+            valid = ~np.isnan(fxs)
+            n_j = valid.sum()
+            if n_j == 0: continue
+            ret[j] = np.bincount(pos[valid], weights=ws[valid] * fn(fxs[valid]), minlength=len(self.cols)) / n_j
+        return ret
+
+class Y0Matrices(object):
+    """
+    Stores Y0, a list of m aligned lists of [x, g_i(x)], as an (m x n)
+    matrix G (NaN for unannotated entries) and the weights P0 on x.
+    """
+    def __init__(self, P0, Y0):
+        assert len(Y0) > 0
+        self.keys = [x for x, _ in Y0[0]]
+        self.P0 = np.array([P0[x] for x in self.keys], dtype=np.float64)
+        self.G = np.array([[np.nan if gx is None else gx for _, gx in Y] for Y in Y0], dtype=np.float64).reshape(len(Y0), len(self.keys))
+
+    def arrays(self):
+        return self.P0, self.G
+
+# Weight matrix computation
+def compute_weights(P, Ns, method="heuristic"):
+    r"""
+    Computes $w_{ij} \propto n_j \sum_{x} p_i(x) p_j(x)$ as $n_j (P P^T)_{ij}$
+    from the (m x n) sparse distribution matrix @P and sample sizes @Ns.
+    Returns the same (W, Z) as evaluation.compute_weights.
+    """
+    m = P.shape[0]
+    Ns = np.asarray(Ns, dtype=np.float64)
+
+    if method == "uniform":
+        W = np.ones((m,m))
+    elif method == "heuristic":
+        W = P.dot(P.T).toarray() * Ns
+    elif method == "size":
+        W = np.tile(Ns, (m, 1))
+    else:
+        raise ValueError("Invalid weighting distribution")
+
+    Z = W.sum(1)
+    W = (W.T/Z).T
+    assert np.allclose(W.sum(1), np.ones(m))
+    return W, Z
+
+def update_weights(P, Ns, W, Z, method="heuristic"):
+    """
+    Updates the weights of W using the newly added last row of @P; only
+    the new row and column are computed, as the sparse product P p_m.
+    """
+    assert method == "heuristic"
+    assert P.shape[0] == len(W) + 1
+    m = len(W)
+    if m == 0:
+        return np.array([[1.]]), np.array([1.])
+    Ns = np.asarray(Ns, dtype=np.float64)
+
+    # Copy over W and undo the normalization transform.
+    W_ = np.zeros((m+1, m+1))
+    W_[:m,:m] = (W.T * Z).T
+
+    w = P.dot(P[m].T).toarray().ravel()
+    W_[m, :] = Ns * w
+    W_[:, m] = Ns[m] * w
+
+    Z = W_.sum(1)
+    W_ = (W_.T/Z).T
+    assert np.allclose(W_.sum(1), np.ones(m+1))
+    return W_, Z
+
+# Proposal distribution generator
+def construct_proposal_distribution(W, P):
+    r"""
+    Returns $q_i(x) = \sum_{j=1}^{m} w_{ij} p_{j}(x)$ as the sparse (m x n) matrix W P.
+    """
+    return sp.csr_matrix(sp.csr_matrix(W).dot(P))
+
+def update_proposal_distribution(W, Z, P, Q_, Z_):
+    r"""
+    Updates the sparse proposal distribution Q_ (with normalizers Z_)
+    after the last row of @P was added and the weights updated to W, Z.
+
+    Adding system m only rescales the old rows and adds a rank-one term:
+        $q_i \gets Z'_i/Z_i q'_i + w_{im} p_m$ for $i < m$, and
+        $q_m = \sum_j w_{mj} p_j$.
+    """
+    m = Q_.shape[0]
+    assert len(W) == m + 1
+    assert len(Z) == m + 1
+    assert P.shape[0] == m + 1
+    assert len(Z_) == m
+
+    old = sp.diags(np.asarray(Z_)/Z[:m]).dot(Q_) + sp.csr_matrix(W[:m, m:]).dot(P[m])
+    new = sp.csr_matrix(W[m:]).dot(P)
+    return sp.csr_matrix(sp.vstack([old, new]))
+
+def _weights(data, W=None, method="heuristic"):
+    if W is None:
+        W, _ = compute_weights(data.P, data.Ns, method)
+    return np.asarray(W)
+
+def proposal_ratios(W, P, p0=None):
+    r"""
+    Computes p_i(x)/q_i(x), p0(x)/q_i(x) and I[x \in P_i] p0(x)/q_i(x)
+    from the sparse proposal Q = W P (see construct_proposal_distribution),
+    only on its structural non-zeros (the ratios are 0 wherever q_i is).
+        @P - (m x n) sparse distributions, whose explicit zeros count as support.
+        @p0 - (n) weights of Y0 on the columns of P.
+    Returns sparse (CSC) matrices, so that the columns of a sample can be
+    read off cheaply.
+    """
+    P = sp.csr_matrix(P)
+    Q = construct_proposal_distribution(W, P)
+    rows = np.repeat(np.arange(P.shape[0]), np.diff(P.indptr))
+    q = np.asarray(Q[rows, P.indices]).reshape(-1)
+    R = sp.csc_matrix(sp.csr_matrix((_safe_divide(P.data, q), P.indices, P.indptr), shape=P.shape))
+    if p0 is None:
+        return R, None, None
+    U = sp.csc_matrix(sp.csr_matrix((_safe_divide(p0[Q.indices], Q.data), Q.indices, Q.indptr), shape=Q.shape))
+    SU = sp.csc_matrix(sp.csr_matrix((_safe_divide(p0[P.indices], q), P.indices, P.indptr), shape=P.shape))
+    return R, U, SU
+
+def _ratios(data, W, P0=None):
+    r"""
+    Precomputes p_i(x)/q_i(x), P0(x)/q_i(x) and I[x \in P_i] P0(x)/q_i(x) on data.cols.
+    """
+    return proposal_ratios(W, data.P[:, data.cols], None if P0 is None else data.column_vector(P0))
+
+def joint_precision_(data, W, ratios=None):
+    r"""
+    Computes $\pi_i = \sum_j w_{ij} \pi_{ij}$ for every system at once using
+        $\pi_{ij} = 1/n_j \sum_{x \in \Xh_j} p_i(x)/q_i(x) f(x)$.
+    """
+    R, _, _ = ratios if ratios is not None else _ratios(data, W)
+    A = data.sample_matrix(lambda fx: fx)
+    return (W * R.dot(A.T)).sum(1)
+
+def pooled_recall_(data, W, P0, ratios=None):
+    r"""
+    Computes $\nu_i = \sum_j w_{ij} \nu_{ij} / \sum_j w_{ij} Z_{ij}$ for every system at once.
+    """
+    _, U, SU = ratios if ratios is not None else _ratios(data, W, P0)
+    G = data.sample_matrix(lambda fx: (fx > 0.).astype(np.float64))
+    nu = (W * SU.dot(G.T)).sum(1)
+    Z = (W * U.dot(G.T)).sum(1)
+    return _safe_divide(nu, Z)
+
+def simple_precision_(data):
+    return data.sample_matrix(lambda fx: fx).sum(1)
+
+def pool_recall_(P0, G):
+    """
+    Estimates the recall of the pool from the merged Y0.
+    """
+    gx = np.nan_to_num(G, nan=0.).max(0)
+    return P0.dot(gx) / P0.sum()
+
+def simple_recall_(P0, G):
+    valid = ~np.isnan(G)
+    return np.nan_to_num(G, nan=0.).dot(P0) / valid.dot(P0)
+
+# Sample size planning
+def variance_curve(Ps, Xhs, ns, Whs=None):
+    r"""
+    Predicts the variance of $\pi_m$ (see evaluation.estimate_variance)
+    for a new system m = len(Xhs) if it were given n samples, for every
+    n in @ns at once.
+
+    With $c_j = n_j (P P^T)_{mj}$ for the existing systems and
+    $b = (P P^T)_{mm}$, n samples give
+        $Z(n) = \sum_j c_j + n b$, $w_{mj} = c_j/Z(n)$, $w_{mm} = n b/Z(n)$ and
+        $q_m(x) = (\sum_j c_j p_j(x) + n b p_m(x))/Z(n)$,
+    so every term of the variance is a closed-form function of n; the
+    per-sample terms are precomputed once and evaluated for all n.
+    """
+    m = len(Xhs)
+    assert len(Ps) == m + 1
+    data = ScoringMatrices(Ps, list(Xhs) + [[]], None if Whs is None else list(Whs) + [[]])
+    ns = np.asarray(ns, dtype=np.float64)
+
+    K = data.P.dot(data.P[m].T).toarray().ravel()
+    c, b = data.Ns[:m] * K[:m], K[m]
+    # a(x) = \sum_j c_j p_j(x), for the existing systems.
+    a = sp.csr_matrix(c[None, :]).dot(data.P[:m]) if m > 0 else sp.csr_matrix((1, data.n))
+
+    # Terms for the samples of the existing systems, with their system label.
+    owner, pos, fxs = [], [], []
+    for j, (pos_j, fxs_j, ws_j) in enumerate(data.samples[:m]):
+        valid = ~np.isnan(fxs_j)
+        if c[j] == 0. or not valid.any(): continue # w_mj = 0, or no estimate.
+        owner.append(np.full(valid.sum(), j))
+        pos.append(pos_j[valid])
+        fxs.append(ws_j[valid] * fxs_j[valid])
+    owner = np.concatenate(owner) if owner else np.zeros(0, dtype=np.int64)
+    cols = data.cols[np.concatenate(pos)] if pos else np.zeros(0, dtype=np.int64)
+    fxs = np.concatenate(fxs) if fxs else np.zeros(0)
+    p_s, a_s = data.P[m][:, cols].toarray().ravel(), a[:, cols].toarray().ravel()
+    # (S x m) matrix that averages over the samples of each system.
+    L = np.zeros((len(owner), m))
+    L[np.arange(len(owner)), owner] = 1. / data.Ns[owner]
+    scale = _safe_divide(c**2, np.array([len(fxs_j) for _, fxs_j, _ in data.samples[:m]], dtype=np.float64))
+
+    # Terms for the support of p_m.
+    p_r = data.P[m].data
+    a_r = a[:, data.P[m].indices].toarray().ravel()
+
+    # Evaluate a chunk of ns at a time to bound memory.
+    ret, chunk = np.zeros(len(ns)), 64
+    for start in range(0, len(ns), chunk):
+        n = ns[start:start+chunk, None]
+        Z = a.sum() + n * b
+        rf = _safe_divide(p_s * Z, a_s + n * b * p_s) * fxs
+        pi, pi2 = rf.dot(L), (rf**2).dot(L)
+        var = ((pi2 - pi**2) * scale).sum(1) / Z[:, 0]**2
+        # The residual is bounded by E_m[p_m^2/q_m^2].
+        var += (n[:, 0] * b)**2 / n[:, 0] * (p_r**3 * _safe_divide(Z, a_r + n * b * p_r)**2).sum(1) / Z[:, 0]**2
+        ret[start:start+chunk] = var
+    return ret
+
+def plan_n_samples(Ps, Xhs, target=500, eps=0., Whs=None):
+    r"""
+    Finds the smallest number of samples for the new system m = len(Xhs)
+    whose predicted variance is within @eps of the variance of @target
+    samples drawn from p_m alone, i.e. $\sum_x p_m(x)/target$.
+    @returns the number of samples and the predicted variance for every n in 1..target.
+    """
+    assert len(Ps) == len(Xhs) + 1
+    target_variance = sum(Ps[-1].values()) / target
+    variances = variance_curve(Ps, Xhs, np.arange(1, target+1), Whs)
+    feasible = np.where(variances <= target_variance + eps)[0]
+    n = int(feasible[0]) + 1 if len(feasible) > 0 else target
+    logger.debug("Planned %d samples (target variance %.3e with %d samples)", n, target_variance, target)
+    return n, variances
+
+# Drop-in replacements for the functions in evaluation.
+def joint_precision(P, Xhs, W=None, method="heuristic", Whs=None):
+    data = ScoringMatrices(P, Xhs, Whs)
+    return list(joint_precision_(data, _weights(data, W, method)))
+
+def pooled_recall(P0, P, Xhs, W=None, method="heuristic", Whs=None):
+    data = ScoringMatrices(P, Xhs, Whs)
+    return list(pooled_recall_(data, _weights(data, W, method), P0))
+
+def pool_recall(P0, Y0):
+    return pool_recall_(*Y0Matrices(P0, Y0).arrays())
+
+def joint_recall(P0, P, Y0, Xhs, W=None, Whs=None):
+    data = ScoringMatrices(P, Xhs, Whs)
+    theta = pool_recall_(*Y0Matrices(P0, Y0).arrays())
+    return list(theta * pooled_recall_(data, _weights(data, W), P0))
+
+def joint_score(P0, P, Y0, Xhs, W=None, Whs=None):
+    data = ScoringMatrices(P, Xhs, Whs)
+    W = _weights(data, W)
+    ps = joint_precision_(data, W)
+    rs = pool_recall_(*Y0Matrices(P0, Y0).arrays()) * pooled_recall_(data, W, P0)
+    return list(ps), list(rs), list(_f1(ps, rs))
+
+def simple_score(P0, P, Y0, Xhs, Whs=None):
+    ps = simple_precision_(ScoringMatrices(P, Xhs, Whs))
+    rs = simple_recall_(*Y0Matrices(P0, Y0).arrays())
+    return list(ps), list(rs), list(_f1(ps, rs))
+
+# Epochs are drawn in fixed-size chunks, each with its own child of
+# the root SeedSequence, so that the result for a given seed does not
+# depend on how many workers the chunks are spread over.
+EPOCHS_PER_CHUNK = 50
+
+def bootstrap_counts(n, num_epochs, rng):
+    """
+    Returns a (num_epochs x n) matrix of resample counts, where every
+    row is a uniform multinomial draw of n elements with replacement.
+    @rng is a numpy.random.Generator.
+    """
+    if n == 0:
+        return np.zeros((num_epochs, 0))
+    return rng.multinomial(n, np.ones(n)/n, size=num_epochs).astype(np.float64)
+
+def _epoch_chunks(num_epochs, seed):
+    """
+    Splits @num_epochs into chunks of EPOCHS_PER_CHUNK, pairing each
+    with an independent SeedSequence spawned from @seed.
+    """
+    sizes = [min(EPOCHS_PER_CHUNK, num_epochs - start) for start in range(0, num_epochs, EPOCHS_PER_CHUNK)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+def _run_chunks(fn, payload, num_epochs, seed, workers):
+    """
+    Evaluates fn(payload, counts, y0_counts) on the base sample (all
+    ones) followed by every chunk of bootstrap epochs, in order, over a
+    pool of @workers processes. Returns the stacked (epochs x m) results.
+
+    The payload is sent to every worker once, when it starts (see
+    _init_chunk_worker); the chunks themselves only carry their size and
+    seed.
+    """
+    samples, y0_n = payload[0], payload[-1].shape[-1]
+    base = fn(payload, [np.ones((1, len(fxs))) for _, fxs, _ in samples], np.ones((1, y0_n)))
+    chunks = _epoch_chunks(num_epochs, seed)
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_chunk_worker, initargs=(fn, payload)) as executor:
+            rest = list(executor.map(_run_chunk, chunks))
+    else:
+        rest = [_bootstrap_chunk(fn, payload, size, seed_) for size, seed_ in chunks]
+    return [np.vstack(parts) for parts in zip(base, *rest)]
+
+# The (fn, payload) of the bootstrap a worker process was started for.
+_CHUNK_TASK = None
+
+def _init_chunk_worker(fn, payload):
+    global _CHUNK_TASK
+    _CHUNK_TASK = (fn, payload)
+
+def _run_chunk(chunk):
+    fn, payload = _CHUNK_TASK
+    size, seed = chunk
+    return _bootstrap_chunk(fn, payload, size, seed)
+
+def _bootstrap_chunk(fn, payload, size, seed):
+    rng = np.random.default_rng(seed)
+    samples, y0_n = payload[0], payload[-1].shape[-1]
+    counts = [bootstrap_counts(len(fxs), size, rng) for _, fxs, _ in samples]
+    y0_counts = bootstrap_counts(y0_n, size, rng)
+    return fn(payload, counts, y0_counts)
+
+def _sample_averages(counts, values, valid):
+    """
+    Computes the per-epoch average of @values over the valid samples,
+    weighting every sample by @counts: returns an (epochs x m) matrix.
+        @counts - (epochs x n_j) resample counts.
+        @values - (m x n_j) values of every sample for every system.
+        @valid - (n_j) mask of annotated samples.
+    """
+    counts = counts * valid
+    return _safe_divide(counts.dot(values.T), counts.sum(1)[:, None])
+
+def _bootstrap_precision(samples, W, ratios, counts):
+    r"""
+    Computes $\pi_i$ for every epoch of @counts: returns an (epochs x m) matrix.
+    """
+    R, _, _ = ratios
+    ret = 0.
+    for j, ((pos, fxs, ws), C) in enumerate(zip(samples, counts)):
+        valid = ~np.isnan(fxs)
+        ret = ret + W[:, j] * _sample_averages(C, R[:, pos].toarray() * ws * np.nan_to_num(fxs, nan=0.), valid)
+    return ret
+
+def _bootstrap_pooled_recall(samples, W, ratios, counts):
+    r"""
+    Computes $\nu_i$ for every epoch of @counts: returns an (epochs x m) matrix.
+    """
+    _, U, SU = ratios
+    nu, Z = 0., 0.
+    for j, ((pos, fxs, ws), C) in enumerate(zip(samples, counts)):
+        valid = ~np.isnan(fxs)
+        gx = ws * (np.nan_to_num(fxs, nan=0.) > 0.)
+        nu = nu + W[:, j] * _sample_averages(C, SU[:, pos].toarray() * gx, valid)
+        Z = Z + W[:, j] * _sample_averages(C, U[:, pos].toarray() * gx, valid)
+    return _safe_divide(nu, Z)
+
+def _bootstrap_simple_precision(samples, counts):
+    ret = np.zeros((len(counts[0]) if counts else 0, len(samples)))
+    for j, ((_, fxs, ws), C) in enumerate(zip(samples, counts)):
+        valid = ~np.isnan(fxs)
+        ret[:, j] = _sample_averages(C, (ws * np.nan_to_num(fxs, nan=0.))[None, :], valid)[:, 0]
+    return ret
+
+def _bootstrap_pool_recall(P0, G, counts):
+    gx = np.nan_to_num(G, nan=0.).max(0)
+    return counts.dot(P0 * gx) / counts.dot(P0)
+
+def _bootstrap_simple_recall(P0, G, counts):
+    valid = ~np.isnan(G)
+    return _safe_divide(counts.dot((P0 * np.nan_to_num(G, nan=0.)).T), counts.dot((P0 * valid).T))
+
+def _with_intervals(ps, rs, interval):
+    """
+    Converts (epochs x m) precisions and recalls, whose first row holds
+    the base metric, into Scores.
+    """
+    dat = np.array([ps, rs, _f1(ps, rs)])
+    ret = []
+    for dat in dat.transpose(2, 1, 0):
+        p, r, f1 = dat[0]
+        p_l, r_l, f1_l = np.percentile(dat[1:], 100-interval, 0)
+        p_r, r_r, f1_r = np.percentile(dat[1:], interval, 0)
+
+        ret.append(Score(
+            p, r, f1,
+            p_l, r_l, f1_l,
+            p_r, r_r, f1_r,))
+    return ret
+
+def _joint_chunk(payload, counts, y0_counts):
+    samples, W, ratios, P0, G = payload
+    ps = _bootstrap_precision(samples, W, ratios, counts)
+    rs = _bootstrap_pool_recall(P0, G, y0_counts)[:, None] * _bootstrap_pooled_recall(samples, W, ratios, counts)
+    return ps, rs
+
+def _simple_chunk(payload, counts, y0_counts):
+    samples, P0, G = payload
+    return _bootstrap_simple_precision(samples, counts), _bootstrap_simple_recall(P0, G, y0_counts)
+
+def joint_bootstrap(samples, W, ratios, P0, G, num_epochs=100, interval=90, seed=None, workers=1):
+    """
+    Bootstraps the joint scores from precomputed arrays:
+        @samples - for every system, (positions into the sampled columns, f(x), importance weights).
+        @W - (m x m) normalized weights.
+        @ratios - p_i/q_i, P0/q_i and I[x \\in P_i] P0/q_i on the sampled columns (see _ratios).
+        @P0, @G - the weights and (m x n) labels of Y0.
+    """
+    ps, rs = _run_chunks(_joint_chunk, (samples, W, ratios, P0, G), num_epochs, seed, workers)
+    return _with_intervals(ps, rs, interval)
+
+def joint_score_with_intervals(P0, Ps, Y0, Xhs, W=None, num_epochs=100, interval=90, seed=None, workers=1, Whs=None):
+    """
+    Bootstraps every epoch at once: the resamples are drawn as
+    multinomial count matrices and every estimator is computed as a
+    count-weighted reduction over the samples.
+    @seed - seeds the SeedSequence that every chunk of epochs draws from.
+    @workers - number of processes to spread the chunks over.
+    """
+    logger.info("Precomputing weights")
+    data, y0 = ScoringMatrices(Ps, Xhs, Whs), Y0Matrices(P0, Y0)
+    W = _weights(data, W)
+    ratios = _ratios(data, W, P0)
+
+    logger.info("Bootstrapping")
+    return joint_bootstrap(data.samples, W, ratios, y0.P0, y0.G, num_epochs, interval, seed, workers)
+
+def simple_score_with_intervals(P0, Ps, Y0, Xhs, num_epochs=100, interval=90, seed=None, workers=1, Whs=None):
+    data, y0 = ScoringMatrices(Ps, Xhs, Whs), Y0Matrices(P0, Y0)
+
+    logger.info("Bootstrapping")
+    ps, rs = _run_chunks(_simple_chunk, (data.samples, y0.P0, y0.G), num_epochs, seed, workers)
+    return _with_intervals(ps, rs, interval)
+
+def test_safe_divide():
+    assert np.allclose(_safe_divide(np.array([1., 2., 0.]), np.array([2., 0., 0.])), [0.5, 0., 0.])
+
+def test_scoring_matrices():
+    P = [
+        {'a': 0.5, 'b': 0.5},
+        {'b': 0.2, 'c': 0.8},
+        ]
+    Xhs = [
+        [('a', 1.), ('a', 0.), ('b', None)],
+        [('c', 1.)],
+        ]
+    data = ScoringMatrices(P, Xhs)
+    assert data.keys == ['a', 'b', 'c']
+    assert np.allclose(data.P.toarray(), [[0.5, 0.5, 0.], [0., 0.2, 0.8]])
+    assert list(data.cols) == [0, 1, 2]
+    assert list(data.Ns) == [2, 1]
+    assert np.allclose(data.sample_matrix(lambda fx: fx), [[0.5, 0., 0.], [0., 0., 1.]])
+
+def test_epoch_chunks():
+    chunks = _epoch_chunks(2 * EPOCHS_PER_CHUNK + 1, 42)
+    assert [size for size, _ in chunks] == [EPOCHS_PER_CHUNK, EPOCHS_PER_CHUNK, 1]
+    chunks_ = _epoch_chunks(2 * EPOCHS_PER_CHUNK + 1, 42)
+    assert all(s.generate_state(1) == s_.generate_state(1) for (_, s), (_, s_) in zip(chunks, chunks_))
+
+def test_proposal_ratios():
+    # Row 2 has an explicit zero at column 3 and does not overlap row 0.
+    P = sp.csr_matrix((np.array([0.5, 0.5, 1., 1., 0.]), np.array([0, 1, 1, 2, 3]), np.array([0, 2, 3, 5])), shape=(3, 4))
+    W = np.array([[0.5, 0.5, 0.], [0.5, 0.5, 0.], [0., 0., 1.]])
+    p0 = np.array([0.1, 0.2, 0.3, 0.4])
+    R, U, SU = proposal_ratios(W, P, p0)
+
+    Q = W.dot(P.toarray())
+    U_ = _safe_divide(p0, Q)
+    assert np.allclose(R.toarray(), _safe_divide(P.toarray(), Q))
+    assert np.allclose(U.toarray(), U_)
+    assert np.allclose(SU.toarray(), [[1., 1., 0., 0.], [0., 1., 0., 0.], [0., 0., 1., 1.]] * U_)
+
+def test_update_weights():
+    P = [
+        {'a': 0.3, 'b': 0.5, 'c': 0.2},
+        {'a': 0.2, 'b': 0.2, 'c': 0.6},
+        {'a': 0.1, 'b': 0.6, 'd': 0.3},
+        ]
+    Xhs = [
+        [('a',0.) for _ in range(10)],
+        [('b',0.) for _ in range(50)],
+        [('c',0.) for _ in range(100)],
+        ]
+    data = ScoringMatrices(P, Xhs)
+    W, Z = compute_weights(data.P[:1], data.Ns[:1])
+    for i in range(2, 4):
+        W, Z = update_weights(data.P[:i], data.Ns[:i], W, Z)
+        W_, Z_ = compute_weights(data.P[:i], data.Ns[:i])
+        assert np.allclose(W, W_)
+        assert np.allclose(Z, Z_)
+
+def test_update_proposal_distribution():
+    P = [
+        {'a': 0.3, 'b': 0.5, 'c': 0.2},
+        {'a': 0.2, 'b': 0.2, 'c': 0.6},
+        {'a': 0.1, 'b': 0.6, 'd': 0.3},
+        ]
+    Xhs = [
+        [('a',0.) for _ in range(10)],
+        [('b',0.) for _ in range(50)],
+        [('c',0.) for _ in range(100)],
+        ]
+    data = ScoringMatrices(P, Xhs)
+    W_, Z_ = compute_weights(data.P[:1], data.Ns[:1])
+    Q_ = construct_proposal_distribution(W_, data.P[:1])
+    for i in range(2, 4):
+        W, Z = update_weights(data.P[:i], data.Ns[:i], W_, Z_)
+        Q_ = update_proposal_distribution(W, Z, data.P[:i], Q_, Z_)
+        Q = construct_proposal_distribution(W, data.P[:i])
+        assert np.allclose(Q.toarray(), Q_.toarray())
+        W_, Z_ = W, Z
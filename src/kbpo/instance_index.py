@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Interning of relation instance keys.
+
+A relation instance is identified by (doc_id, (s_lo, s_hi), (o_lo, o_hi)).
+InstanceIndex maps every such key to a dense int32 id, and keeps the
+keys themselves as a compact structured array, so that distributions
+and samples can be stored as (ids, values) arrays instead of
+dictionaries keyed by nested tuples.
+"""
+
+import numpy as np
+
+KEY_DTYPE = np.dtype([
+    ("doc_idx", np.int32),
+    ("s_lo", np.int32),
+    ("s_hi", np.int32),
+    ("o_lo", np.int32),
+    ("o_hi", np.int32),
+    ])
+
+# Keys are looked up as packed scalars: a void view of their KEY_DTYPE
+# bytes, which sorts (bytewise) and compares with np.searchsorted.
+_PACKED = np.dtype((np.void, KEY_DTYPE.itemsize))
+
+def _packed(rows):
+    return np.ascontiguousarray(rows, dtype=KEY_DTYPE).view(_PACKED)
+
+class InstanceIndex(object):
+    """
+    Interns instance keys into int32 ids.
+        doc_ids - the documents, indexed by doc_idx.
+        arrays - a structured array (KEY_DTYPE) of the keys, indexed by id.
+
+    Keys are found by binary search in a sorted array of packed keys, so
+    that the index costs a few dozen bytes per instance; only the keys
+    added since the array was last sorted are kept in a dictionary,
+    which is merged once it grows to a fraction of the array (see
+    _merge).
+    """
+    MIN_PENDING = 1 << 12
+
+    def __init__(self):
+        self.doc_ids = []
+        self._doc_index = {}
+        self._arrays = np.zeros(0, dtype=KEY_DTYPE)
+        self._sorted = np.zeros(0, dtype=_PACKED)
+        self._order = np.zeros(0, dtype=np.int32)
+        # Keys added since the last merge, and their ids.
+        self._pending = {}
+        self._rows = []
+
+    def __len__(self):
+        return len(self._arrays) + len(self._rows)
+
+    def __contains__(self, x):
+        return self.lookup([x])[0] >= 0
+
+    def _row(self, x, add=True):
+        doc_id, (s_lo, s_hi), (o_lo, o_hi) = x
+        doc_idx = self._doc_index.get(doc_id)
+        if doc_idx is None:
+            if not add:
+                return None
+            doc_idx = self._doc_index[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+        return (doc_idx, s_lo, s_hi, o_lo, o_hi)
+
+    def _search(self, packed):
+        """
+        @returns: the ids of the @packed keys among the sorted keys, or -1.
+        """
+        ret = np.full(len(packed), -1, dtype=np.int32)
+        if len(self._sorted) > 0:
+            pos = np.minimum(np.searchsorted(self._sorted, packed), len(self._sorted) - 1)
+            found = self._sorted[pos] == packed
+            ret[found] = self._order[pos[found]]
+        return ret
+
+    def _add(self, row):
+        ix = self._pending.get(row)
+        if ix is None:
+            ix = self._pending[row] = len(self)
+            self._rows.append(row)
+        return ix
+
+    def _merge(self, force=False):
+        """
+        Merges the pending keys into the sorted keys once there are
+        enough of them (or if @force).
+        """
+        if not self._rows or (not force and len(self._rows) < max(self.MIN_PENDING, len(self._arrays) // 4)):
+            return
+        self._arrays = np.concatenate([self._arrays, np.array(self._rows, dtype=KEY_DTYPE)])
+        self._index_arrays()
+        self._pending, self._rows = {}, []
+
+    def _index_arrays(self):
+        packed = _packed(self._arrays)
+        self._order = np.argsort(packed, kind="stable").astype(np.int32)
+        self._sorted = packed[self._order]
+
+    def intern(self, x):
+        """
+        @returns: the id of the key @x, adding it if necessary.
+        """
+        row = self._row(x)
+        ix = self._pending.get(row)
+        if ix is None:
+            ix = int(self._search(_packed(np.array([row], dtype=KEY_DTYPE)))[0])
+            if ix < 0:
+                ix = self._add(row)
+                self._merge()
+        return ix
+
+    def intern_many(self, xs):
+        """
+        @returns: an int32 array with the ids of the keys @xs, adding them if necessary.
+        """
+        rows = [self._row(x) for x in xs]
+        ret = self._search(_packed(np.array(rows, dtype=KEY_DTYPE).reshape(len(rows))))
+        for i in np.flatnonzero(ret < 0).tolist():
+            ret[i] = self._add(rows[i])
+        self._merge()
+        return ret
+
+    def lookup(self, xs):
+        """
+        @returns: an int32 array with the ids of the keys @xs, or -1 for unknown keys.
+        """
+        rows = [self._row(x, add=False) for x in xs]
+        known = [i for i, row in enumerate(rows) if row is not None]
+        ret = np.full(len(xs), -1, dtype=np.int32)
+        ret[known] = self._search(_packed(np.array([rows[i] for i in known], dtype=KEY_DTYPE).reshape(len(known))))
+        for i in known:
+            if ret[i] < 0:
+                ret[i] = self._pending.get(rows[i], -1)
+        return ret
+
+    @property
+    def arrays(self):
+        self._merge(force=True)
+        return self._arrays
+
+    def key(self, ix):
+        row = self.arrays[ix]
+        return (self.doc_ids[row["doc_idx"]], (int(row["s_lo"]), int(row["s_hi"])), (int(row["o_lo"]), int(row["o_hi"])))
+
+    def keys(self, ids=None):
+        """
+        @returns: the keys with @ids (or every key) as (doc_id, (s_lo, s_hi), (o_lo, o_hi)) tuples.
+        """
+        rows = self.arrays if ids is None else self.arrays[ids]
+        doc_ids = self.doc_ids
+        return [(doc_ids[doc_idx], (s_lo, s_hi), (o_lo, o_hi)) for doc_idx, s_lo, s_hi, o_lo, o_hi in rows.tolist()]
+
+    def to_arrays(self):
+        """
+        @returns: a dictionary of arrays (suitable for np.savez) to rebuild the index with from_arrays.
+        """
+        return {"doc_ids": np.array(self.doc_ids, dtype=np.str_), "instances": self.arrays}
+
+    @classmethod
+    def from_arrays(cls, doc_ids, instances):
+        index = cls()
+        index.doc_ids = list(doc_ids.tolist())
+        index._doc_index = {doc_id: i for i, doc_id in enumerate(index.doc_ids)}
+        index._arrays = np.array(instances, dtype=KEY_DTYPE)
+        index._index_arrays()
+        return index
+
+def test_instance_index():
+    index = InstanceIndex()
+    xs = [("doc1", (0, 1), (2, 3)), ("doc2", (0, 1), (2, 3)), ("doc1", (0, 1), (2, 3)), ("doc1", (4, 5), (6, 7))]
+    ids = index.intern_many(xs)
+    assert ids.dtype == np.int32
+    assert ids.tolist() == [0, 1, 0, 2]
+    assert len(index) == 3
+    assert index.doc_ids == ["doc1", "doc2"]
+    assert index.keys() == [xs[0], xs[1], xs[3]]
+    assert index.key(1) == xs[1]
+    assert index.arrays["doc_idx"].tolist() == [0, 1, 0]
+    assert xs[3] in index and ("doc3", (0, 1), (2, 3)) not in index
+    assert index.lookup([xs[3], ("doc3", (0, 1), (2, 3))]).tolist() == [2, -1]
+
+    # Keys are found both before and after they are merged.
+    index_ = InstanceIndex()
+    index_.MIN_PENDING = 2
+    xs_ = [("doc{}".format(i % 7), (i, i+1), (i+2, i+3)) for i in range(50)]
+    assert index_.intern_many(xs_).tolist() == list(range(50))
+    assert len(index_._rows) < 50
+    assert [index_.intern(x) for x in reversed(xs_)] == list(reversed(range(50)))
+    assert index_.lookup(xs_).tolist() == list(range(50))
+    assert index_.keys() == xs_
+
+    index_ = InstanceIndex.from_arrays(**index.to_arrays())
+    assert index_.keys() == index.keys()
+    assert index_.intern(xs[1]) == 1
+    assert index_.intern(("doc3", (0, 1), (2, 3))) == 3
@@ -7,16 +7,21 @@ mention_id link link_name * weight
 subject_id reln object_id prov weight
 """
 
+import io
 import sys
 import csv
+import json
+import time
 import logging
+from array import array
 from enum import Enum
 from collections import namedtuple, defaultdict
+from tempfile import TemporaryFile, NamedTemporaryFile
+from concurrent.futures import ProcessPoolExecutor
 
 # For tests
 import os
 import gzip
-from tempfile import TemporaryFile
 
 from tqdm import tqdm
 
@@ -115,6 +120,17 @@ class MFile(namedtuple('_MFile', ['types', 'links', 'canonical_mentions', 'relat
         result = super(MFile, cls)._make(iterable, new, len)
         return cls.__new__(cls, *result)
 
+    @classmethod
+    def concatenate(cls, mfiles):
+        """
+        Concatenates MFiles over disjoint sets of documents.
+        """
+        mfiles = list(mfiles)
+        return cls([row for mfile in mfiles for row in mfile.types],
+                   [row for mfile in mfiles for row in mfile.links],
+                   [row for mfile in mfiles for row in mfile.canonical_mentions],
+                   [row for mfile in mfiles for row in mfile.relations])
+
     def get_gloss(self, m_id):
         return self._gloss_map.get(m_id)
     def get_type(self, m_id):
@@ -147,6 +163,18 @@ class MFileReader(object):
         self._provenances = None
         self._weights = None
 
+        # Only used when validating in parallel: the (stage, stamp) of
+        # the row or table entry being validated (see _MessageRecorder).
+        self._stamps = None
+        self._position = None
+
+        # Parsing throughput of the last file read.
+        self.rows_per_second = None
+
+    def _at(self, stage, table, key):
+        if self._stamps is not None:
+            self._position = (stage, self._stamps[table].get(key, float("inf")))
+
     def _add_mention(self, row):
         """
         Adds a mention to the type and gloss dictionaries.
@@ -220,6 +248,7 @@ class MFileReader(object):
     def _verify_mentions_defined(self):
         nil_count = 0
         for m in self._types:
+            self._at(1, "types", m)
             assert m in self._glosses
             if m not in self._cmentions:
                 self.logger.info(Messages.MISSING_PROVENANCE_CANONICAL, prov=m)
@@ -233,6 +262,7 @@ class MFileReader(object):
 
         purge = set()
         for m, n in self._cmentions.items():
+            self._at(2, "cmentions", m)
             if m not in self._types:
                 self.logger.info(Messages.MISSING_PROVENANCE_DEFINITION, prov=m)
                 purge.add(m)
@@ -245,6 +275,7 @@ class MFileReader(object):
 
         purge = set()
         for m, n in self._links.items():
+            self._at(3, "links", m)
             if m not in self._types:
                 self.logger.info(Messages.MISSING_PROVENANCE_DEFINITION, prov=m)
                 purge.add(m)
@@ -254,6 +285,7 @@ class MFileReader(object):
 
         purge = set()
         for (m, n), _ in self._relations.items():
+            self._at(4, "relations", (m, n))
             if m not in self._types:
                 self.logger.info(Messages.MISSING_PROVENANCE_DEFINITION, prov=m)
                 purge.add((m,n))
@@ -268,6 +300,7 @@ class MFileReader(object):
     def _verify_relation_types(self):
         purge = set()
         for (m, n), r in self._relations.items():
+            self._at(5, "relations", (m, n))
             # canonicalize ther relation
             if r not in CANONICAL_RELATIONS and r in INVERTED_RELATIONS:
                 m_, r_, n_ = n, get_inverted_relation(r, self._types[n]), m
@@ -287,6 +320,7 @@ class MFileReader(object):
     def _verify_symmetrized_relations(self):
         add, add_prov, add_weights = dict(), dict(), dict()
         for (m, n), r in self._relations.items():
+            self._at(6, "relations", (m, n))
             if (m, n) in add: continue # You'll be taken care of in due time.
 
             if r in INVERTED_RELATIONS:
@@ -337,13 +371,10 @@ class MFileReader(object):
                 self._links[subj] = 'date:'+self._links[subj]
 
 
-    def parse(self, fstream, doc_ids=None, logger=_logger, do_validate=True):
-        """
-        Parses (and validates) an m-file in the file stream @fstream.
-        """
-        reader = csv.reader(fstream, delimiter="\t")
-
+    def _reset(self, doc_ids=None, logger=_logger):
         self.logger = MessageAdapter(logger, {})
+        self._stamps = None
+        self._position = None
         self._doc_ids = doc_ids
         self._types = dict()
         self._links = dict()
@@ -353,35 +384,52 @@ class MFileReader(object):
         self._provenances = dict()
         self._weights = dict()
 
-        # First pass of the data that builds the above tables.
-        for lineno, row in enumerate(tqdm(reader, desc="reading file")):
-            if len(row) == 0: continue # Skip empty lines
-            if len(row) > 5:
-                self.logger.info(Messages.INVALID_LINE, lineno=lineno, original=len(row), expected=5)
-                continue
-            row = row + [None] * (5-len(row)) + [lineno,]
-            row = Entry(*row)
-            row = row._replace(subj = Provenance.from_str(row.subj), weight = float(row.weight) if row.weight else 0.0)
-
-            if row.reln in TYPES:
-                if self._check_doc_ids(row):
-                    self._add_mention(row)
-            elif row.reln == "link":
-                if self._check_doc_ids(row):
-                    self._add_link(row)
-            elif row.reln == "canonical_mention":
-                row = row._replace(obj = Provenance.from_str(row.obj))
-                if self._check_doc_ids(row):
-                    self._add_cmention(row)
-            elif row.reln in RELATION_MAP:
-                provs = tuple(Provenance.from_str(p.strip()) for p in row.prov.split(',') if p)
-                row = row._replace(reln=RELATION_MAP[row.reln], obj = Provenance.from_str(row.obj), prov=provs)
-                if self._check_doc_ids(row):
-                    self._add_relation(row)
-            else:
-                self.logger.info(Messages.IGNORE_RELATION_UNSUPPORTED, lineno=row.lineno, reln=row.reln)
-
+    def _read_row(self, lineno, row):
+        """
+        Adds a single (unparsed) @row of the file to the tables above.
+        """
+        if len(row) == 0: return # Skip empty lines
+        self._position = (0, lineno)
+        if self._stamps is not None:
+            sizes = {table: len(self._tables()[table]) for table in self._stamps}
+            self._read_row_(lineno, row)
+            # Entries are stamped with the line that first defined them.
+            for table, size in sizes.items():
+                if len(self._tables()[table]) > size:
+                    self._stamps[table][next(reversed(self._tables()[table]))] = lineno
+        else:
+            self._read_row_(lineno, row)
+
+    def _tables(self):
+        return {"types": self._types, "cmentions": self._cmentions, "links": self._links, "relations": self._relations}
+
+    def _read_row_(self, lineno, row):
+        if len(row) > 5:
+            self.logger.info(Messages.INVALID_LINE, lineno=lineno, original=len(row), expected=5)
+            return
+        row = row + [None] * (5-len(row)) + [lineno,]
+        row = Entry(*row)
+        row = row._replace(subj = Provenance.from_str(row.subj), weight = float(row.weight) if row.weight else 0.0)
+
+        if row.reln in TYPES:
+            if self._check_doc_ids(row):
+                self._add_mention(row)
+        elif row.reln == "link":
+            if self._check_doc_ids(row):
+                self._add_link(row)
+        elif row.reln == "canonical_mention":
+            row = row._replace(obj = Provenance.from_str(row.obj))
+            if self._check_doc_ids(row):
+                self._add_cmention(row)
+        elif row.reln in RELATION_MAP:
+            provs = tuple(Provenance.from_str(p.strip()) for p in row.prov.split(',') if p)
+            row = row._replace(reln=RELATION_MAP[row.reln], obj = Provenance.from_str(row.obj), prov=provs)
+            if self._check_doc_ids(row):
+                self._add_relation(row)
+        else:
+            self.logger.info(Messages.IGNORE_RELATION_UNSUPPORTED, lineno=row.lineno, reln=row.reln)
 
+    def _finish(self, do_validate=True):
         if do_validate:
             self._validate()
 
@@ -389,6 +437,192 @@ class MFileReader(object):
 
         return self._build()
 
+    def parse(self, fstream, doc_ids=None, logger=_logger, do_validate=True, workers=1):
+        """
+        Parses (and validates) an m-file in the file stream @fstream.
+        With @workers > 1, documents are parsed and validated in a pool
+        of processes (see _parse_parallel); the result and the logged
+        messages are the same as with a single worker.
+        """
+        if workers > 1:
+            return self._parse_parallel(fstream, doc_ids, logger, do_validate, workers)
+
+        reader = csv.reader(fstream, delimiter="\t")
+        self._reset(doc_ids, logger)
+
+        # First pass of the data that builds the above tables.
+        start = time.time()
+        for lineno, row in enumerate(tqdm(reader, desc="reading file")):
+            self._read_row(lineno, row)
+        self._report_throughput(start, reader.line_num)
+
+        return self._finish(do_validate)
+
+    def _report_throughput(self, start, n_rows):
+        """
+        Records (and logs) the number of rows parsed per second since @start.
+        """
+        elapsed = time.time() - start
+        self.rows_per_second = n_rows / elapsed if elapsed > 0 else float("inf")
+        _logger.info("Parsed %d rows in %.2fs (%.0f rows/s)", n_rows, elapsed, self.rows_per_second)
+
+    def iter_documents(self, fstream, doc_ids=None, logger=_logger, do_validate=True):
+        """
+        Parses (and validates) an m-file in the file stream @fstream one
+        document at a time, yielding (doc_id, MFile) in order of doc_id.
+
+        Every row only refers to mentions in the document of its first
+        column (see _check_doc_ids), so documents can be validated
+        independently: the rows are read once and spilled to disk by
+        document (see DocumentPartition), and only one document's tables
+        are held in memory at a time. Concatenating the yielded MFiles
+        gives the same MFile as parse.
+        """
+        with DocumentPartition() as partition:
+            for lineno, row in enumerate(tqdm(csv.reader(fstream, delimiter="\t"), desc="reading file")):
+                partition.add(lineno, row)
+
+            for doc_id in tqdm(partition.doc_ids(), desc="validating documents"):
+                self._reset(doc_ids, logger)
+                for lineno, row in partition.rows(doc_id):
+                    self._read_row(lineno, row)
+                yield doc_id, self._finish(do_validate)
+
+    def _parse_parallel(self, fstream, doc_ids, logger, do_validate, workers):
+        """
+        Buckets the rows by document and parses and validates every
+        bucket in a separate process. Workers are only sent the path of
+        the spill file and the offsets of their bucket's rows, which they
+        read themselves. They record their messages with the position
+        they would have had in the serial path (see _MessageRecorder)
+        and the messages are logged in that order.
+        """
+        with DocumentPartition() as partition:
+            for lineno, row in enumerate(tqdm(csv.reader(fstream, delimiter="\t"), desc="reading file")):
+                partition.add(lineno, row)
+
+            buckets = _buckets(partition.doc_ids(), workers)
+            payloads = [(partition.path, partition.offsets(bucket),
+                         None if doc_ids is None else {doc_id for doc_id in bucket if doc_id in doc_ids},
+                         do_validate) for bucket in buckets]
+            with ProcessPoolExecutor(workers) as executor:
+                results = list(tqdm(executor.map(_parse_bucket, payloads), total=len(payloads), desc="validating documents"))
+
+        _replay(logger, [records for _, records in results])
+        return MFile.concatenate(mfile for mfile, _ in results)
+
+class _MessageRecorder(object):
+    """
+    Stands in for the logger in worker processes: records every message
+    with the position of the row or table entry @reader was handling.
+    Positions are (0, lineno) while reading rows and (stage, stamp)
+    while validating, where stage is the validation loop and stamp the
+    position of the entry in the serial path's tables.
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        self.records = []
+
+    def log(self, lvl, msg, *args, **kwargs):
+        self.records.append((self.reader._position, len(self.records), lvl, msg % args if args else msg))
+
+def _replay(logger, records):
+    """
+    Logs the messages recorded by every bucket in serial order.
+    """
+    for _, _, _, lvl, msg in sorted((position, i, seq, lvl, msg) for i, records_ in enumerate(records) for position, seq, lvl, msg in records_):
+        logger.log(lvl, msg)
+
+def _buckets(doc_ids, workers):
+    """
+    Splits the sorted @doc_ids into contiguous buckets, a few per worker.
+    """
+    n = max(1, min(len(doc_ids), 4 * workers))
+    size = (len(doc_ids) + n - 1) // n
+    return [doc_ids[i:i+size] for i in range(0, len(doc_ids), size)]
+
+def _parse_bucket(args):
+    path, offsets, doc_ids, do_validate = args
+    reader = MFileReader()
+    recorder = _MessageRecorder(reader)
+    reader._reset(doc_ids, recorder)
+    reader._stamps = {table: {} for table in reader._tables()}
+    with open(path, "rb") as f:
+        for lineno, row in _spilled_rows(f, offsets):
+            reader._read_row(lineno, row)
+    return reader._finish(do_validate), recorder.records
+
+def _validate_bucket(args):
+    tables, stamps = args
+    reader = MFileReader()
+    recorder = _MessageRecorder(reader)
+    reader._reset(None, recorder)
+    for name, table in tables.items():
+        setattr(reader, name, table)
+    reader._stamps = stamps
+    MFileReader._validate(reader)
+    return MFileReader._build(reader), recorder.records
+
+def _spilled_rows(f, offsets):
+    """
+    Yields the (lineno, row) spilled at every offset of @offsets in @f.
+    """
+    for offset in offsets:
+        f.seek(offset)
+        lineno, row = json.loads(f.readline().decode("utf-8"))
+        yield lineno, row
+
+class DocumentPartition(object):
+    """
+    Spills the rows of an m-file to a temporary file, keeping only the
+    offsets of every document's rows in memory. The file can be read by
+    other processes through @path (see offsets).
+    """
+    def __init__(self):
+        self._file = None
+        self.path = None
+        self._offsets = defaultdict(lambda: array("q"))
+
+    def __enter__(self):
+        self._file = NamedTemporaryFile()
+        self.path = self._file.name
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+        self._file = None
+        self.path = None
+
+    def add(self, lineno, row):
+        if len(row) == 0: return # Skip empty lines
+        doc_id = row[0].split(":", 1)[0]
+        self._offsets[doc_id].append(self._file.tell())
+        self._file.write(json.dumps([lineno, row]).encode("utf-8"))
+        self._file.write(b"\n")
+
+    def doc_ids(self):
+        return sorted(self._offsets)
+
+    def rows(self, doc_id):
+        """
+        Yields the (lineno, row) of @doc_id, in line order.
+        """
+        end = self._file.seek(0, io.SEEK_END)
+        yield from _spilled_rows(self._file, self._offsets[doc_id])
+        self._file.seek(end)
+
+    def offsets(self, doc_ids):
+        """
+        Returns the offsets of the rows of @doc_ids (in that order, and
+        in line order within every document), after flushing the file
+        so that they can be read back through self.path.
+        """
+        self._file.flush()
+        ret = array("q")
+        for doc_id in doc_ids:
+            ret.extend(self._offsets[doc_id])
+        return ret
+
 class TacKbReader(MFileReader):
     def __init__(self):
         MFileReader.__init__(self)
@@ -586,18 +820,61 @@ class TacKbReader(MFileReader):
         self._verify_cmentions()
         self._resolve_relations()
 
-    def _build(self, do_validate=True):
+    def _build(self, do_validate=True, workers=1):
         # Add mentions
         for (entity, _), mentions in self._entity_mentions.items():
             entity_type = self._entity_types[entity]
             for m in mentions:
                 self._add_mention(m, gloss=self._glosses[m], type_=entity_type, cmention=self._entity_cmentions[entity, m.doc_id], link=entity)
 
+        if do_validate and workers > 1:
+            return self._validate_parallel(workers)
         if do_validate:
             MFileReader._validate(self)
         return MFileReader._build(self)
 
-    def parse(self, fstream, doc_ids=None, logger=_logger, do_validate=True):
+    def _validate_parallel(self, workers):
+        """
+        Entities span documents, but once they are resolved to mentions
+        every table is document-local: splits the tables by document and
+        runs MFileReader's validation on every bucket in a separate
+        process, logging the messages in serial order (see _MessageRecorder).
+        """
+        def _doc_id(key):
+            return key.doc_id if isinstance(key, Provenance) else key[0].doc_id
+
+        names = ["_types", "_glosses", "_cmentions", "_links", "_relations", "_provenances", "_weights"]
+        buckets = _buckets(sorted({_doc_id(key) for name in names for key in getattr(self, name)}), workers)
+        bucket_of = {doc_id: i for i, bucket in enumerate(buckets) for doc_id in bucket}
+
+        tables = [{name: dict() for name in names} for _ in buckets]
+        for name in names:
+            for key, value in getattr(self, name).items():
+                tables[bucket_of[_doc_id(key)]][name][key] = value
+        stamps = [{table: dict() for table in self._tables()} for _ in buckets]
+        for table, entries in self._tables().items():
+            for i, key in enumerate(entries):
+                stamps[bucket_of[_doc_id(key)]][table][key] = i
+
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(tqdm(executor.map(_validate_bucket, zip(tables, stamps)), total=len(buckets), desc="validating documents"))
+
+        _replay(self.logger.logger, [records for _, records in results])
+        return MFile.concatenate(mfile for mfile, _ in results)
+
+    def iter_documents(self, fstream, doc_ids=None, logger=_logger, do_validate=True):
+        """
+        TAC KB entities span documents, so a KB can not be validated one
+        document at a time: use parse instead.
+        """
+        raise TypeError("TAC KBs can not be read one document at a time; use TacKbReader.parse instead")
+
+    def parse(self, fstream, doc_ids=None, logger=_logger, do_validate=True, workers=1):
+        """
+        Parses (and validates) a TAC KB in the file stream @fstream.
+        With @workers > 1, the document-local validation runs in a pool
+        of processes (see _validate_parallel).
+        """
         reader = csv.reader(fstream, delimiter="\t")
 
         self.logger = MessageAdapter(logger, {})
@@ -618,6 +895,7 @@ class TacKbReader(MFileReader):
         self._weights = dict()
 
         # First pass of the data that builds the above tables.
+        start = time.time()
         for lineno, row in enumerate(tqdm(reader, desc="reading file")):
             if lineno == 0: continue # skip system header
             if len(row) == 0: continue # skip empty lines
@@ -648,10 +926,11 @@ class TacKbReader(MFileReader):
                 self._add_entity_relation(row)
             else:
                 self.logger.info(Messages.IGNORE_RELATION_UNSUPPORTED, lineno=lineno, reln=row.reln)
+        self._report_throughput(start, reader.line_num)
 
         if do_validate:
             self._validate()
-        return self._build()
+        return self._build(workers=workers)
 
 def test_validate_mfile():
     _logger.addHandler(logging.StreamHandler(sys.stderr))
@@ -691,5 +970,131 @@ def test_validate_tackb():
     with TemporaryFile() as f, gzip.open(f, "wt") as g:
         mfile.write(g)
 
+_TEST_MFILE = """\
+doc2:0-4\tPER\tJohn\t\t1.0
+doc1:0-4\tPER\tMary\t\t1.0
+doc1:10-14\tORG\tAcme\t\t1.0
+doc2:10-14\tORG\tInitech\t\t1.0
+doc1:0-4\tcanonical_mention\tdoc1:0-4\t\t1.0
+doc1:0-4\tlink\tE1\t\t1.0
+doc2:0-4\tcanonical_mention\tdoc1:0-4\t\t1.0
+doc2:0-4\tper:employee_or_member_of\tdoc2:10-14\tdoc2:0-14\t0.5
+doc1:0-4\tper:employee_or_member_of\tdoc1:10-14\t\t0.7
+doc1:0-4\tPER\tMary\t\t1.0
+doc1:10-14\tper:spouse\tdoc1:0-4\t\t0.3
+doc2:0-4\tper:unknown\tdoc2:10-14\t\t0.3
+doc2:20-24\tlink\tE2\t\t1.0
+"""
+
+def _messages(fn):
+    stream = io.StringIO()
+    logger = logging.Logger("test")
+    logger.addHandler(logging.StreamHandler(stream))
+    ret = fn(logger)
+    return ret, stream.getvalue()
+
+def test_iter_documents():
+    mfile, log = _messages(lambda logger: MFileReader().parse(io.StringIO(_TEST_MFILE), logger=logger))
+    parts, log_ = _messages(lambda logger: list(MFileReader().iter_documents(io.StringIO(_TEST_MFILE), logger=logger)))
+    assert [doc_id for doc_id, _ in parts] == ["doc1", "doc2"]
+
+    mfile_ = MFile.concatenate(part for _, part in parts)
+    assert mfile_ == mfile
+    assert len(mfile.types) == 4
+    assert len(mfile.relations) == 4
+    assert sorted(log.splitlines()) == sorted(log_.splitlines())
+
+def _test_mfile(n_docs=20, seed=0):
+    """
+    A shuffled m-file over @n_docs documents with a sprinkling of errors.
+    """
+    import random
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n_docs):
+        doc = "doc{}".format(i)
+        lines += [
+            "{}:0-4\tPER\tJohn\t\t1.0".format(doc),
+            "{}:10-14\tORG\tAcme\t\t1.0".format(doc),
+            "{}:20-24\tPER\tMary\t\t1.0".format(doc),
+            "{}:0-4\tcanonical_mention\t{}:20-24\t\t1.0".format(doc, doc),
+            "{}:0-4\tlink\tE{}\t\t1.0".format(doc, i),
+            "{}:0-4\tper:employee_or_member_of\t{}:10-14\t\t0.5".format(doc, doc),
+            "{}:20-24\tper:spouse\t{}:0-4\t{}:0-24\t0.5".format(doc, doc, doc),
+            "{}:10-14\tper:spouse\t{}:0-4\t\t0.5".format(doc, doc),
+            "{}:30-34\tlink\tE{}\t\t1.0".format(doc, i),
+            "{}:0-4\tcanonical_mention\tdoc{}:0-4\t\t1.0".format(doc, (i + 1) % n_docs),
+            "{}:0-4\tPER\tJohnny\t\t1.0".format(doc),
+            ]
+    rng.shuffle(lines)
+    return "\n".join(lines) + "\n"
+
+def test_parse_parallel():
+    text = _test_mfile()
+    mfile, log = _messages(lambda logger: MFileReader().parse(io.StringIO(text), logger=logger))
+    mfile_, log_ = _messages(lambda logger: MFileReader().parse(io.StringIO(text), logger=logger, workers=2))
+    assert mfile_ == mfile
+    assert len(log) > 0 and log_ == log
+
+def test_parse_parallel_log():
+    text = _test_mfile(n_docs=50, seed=1)
+    doc_ids = sorted(set(line.split(":", 1)[0] for line in text.splitlines()))
+    assert len(_buckets(doc_ids, 3)) > 1
+
+    mfile, log = _messages(lambda logger: MFileReader().parse(io.StringIO(text), logger=logger))
+    mfile_, log_ = _messages(lambda logger: MFileReader().parse(io.StringIO(text), logger=logger, workers=3))
+    assert mfile_ == mfile
+    # The messages of every bucket are replayed in serial order.
+    assert len(log) > 0 and log_.encode("utf-8") == log.encode("utf-8")
+
+def _written(mfile):
+    stream = io.StringIO()
+    mfile.write(stream)
+    return stream.getvalue()
+
+def test_partition_matches_parse():
+    # The rows of _test_mfile are shuffled, so every document's rows are
+    # spread across the file and out of doc_id order.
+    text = _test_mfile()
+    doc_ids = [line.split(":", 1)[0] for line in text.splitlines()]
+    assert doc_ids != sorted(doc_ids)
+
+    mfile, log = _messages(lambda logger: MFileReader().parse(io.StringIO(text), logger=logger))
+    parts, log_ = _messages(lambda logger: list(MFileReader().iter_documents(io.StringIO(text), logger=logger)))
+    mfile_, log__ = _messages(lambda logger: MFileReader().parse(io.StringIO(text), logger=logger, workers=2))
+    assert [doc_id for doc_id, _ in parts] == sorted(set(doc_ids))
+
+    expected = _written(mfile)
+    assert len(expected) > 0
+    assert _written(MFile.concatenate(part for _, part in parts)) == expected
+    assert _written(mfile_) == expected
+    assert sorted(log_.splitlines()) == sorted(log.splitlines()) and log__ == log
+
+def test_iter_documents_tackb():
+    try:
+        next(TacKbReader().iter_documents(io.StringIO("system\n")))
+        assert False, "Expected iter_documents to be rejected"
+    except TypeError as e:
+        assert "TacKbReader.parse" in str(e)
+
+def test_parse_parallel_tackb():
+    lines = ["system"]
+    for i in range(10):
+        doc = "doc{}".format(i)
+        lines += [
+            ":E{}\ttype\tPER".format(i),
+            ":E{}\tmention\t\"John\"\t{}:0-3\t1.0".format(i, doc),
+            ":E{}\tcanonical_mention\t\"John\"\t{}:0-3\t1.0".format(i, doc),
+            ":F{}\ttype\tORG".format(i),
+            ":F{}\tmention\t\"Acme\"\t{}:10-13\t1.0".format(i, doc),
+            ":E{}\tper:employee_or_member_of\t:F{}\t{}:0-13\t0.5".format(i, i, doc),
+            ":E{}\tper:spouse\t:F{}\t{}:0-13\t0.5".format(i, i, doc),
+            ]
+    text = "\n".join(lines) + "\n"
+    mfile, log = _messages(lambda logger: TacKbReader().parse(io.StringIO(text), logger=logger))
+    mfile_, log_ = _messages(lambda logger: TacKbReader().parse(io.StringIO(text), logger=logger, workers=2))
+    assert mfile_ == mfile
+    assert len(log) > 0 and log_ == log
+
 if __name__ == '__main__':
     test_validate_mfile()
@@ -23,63 +23,50 @@ def create_questions_for_submission_sample(submission_id, sample_batch_id):
     Produces questions for a submission, based on what's in the
     database.
     """
-    # Group by doc_id, subject, object
-    question_groups = {}
-    for q in db.select("""
-        SELECT DISTINCT ON (s.doc_id, LEAST(s.subject, s.object), GREATEST(s.subject, s.object)) 
-               s.doc_id, s.subject, s.object, 
-               r.subject_type, r.object_type,
-               r.subject_gloss, r.object_gloss,
-               r.subject_canonical_gloss, r.object_canonical_gloss,
-               r.subject_canonical, r.object_canonical,
-               r.subject_entity, r.object_entity
-        FROM submission_sample s
-        JOIN submission_entity_relation r ON (
-            r.submission_id = s.submission_id
-            AND s.doc_id = r.doc_id AND s.subject = r.subject AND s.object = r.object)
-        WHERE s.submission_id = %(submission_id)s
-          AND s.batch_id = %(sample_batch_id)s
-        ;
-        """, submission_id=submission_id, sample_batch_id=sample_batch_id):
-        question_groups[q.doc_id, stuple(q.subject), stuple(q.object)] = q
-
-    # Go through and remove any of these from possible_questions
-    for q in db.select("""
-        SELECT doc_id, subject, object, subject_canonical_gloss, object_canonical_gloss, subject_entity, object_entity
-            FROM evaluation_relation_question r
-            WHERE (state <> 'error' OR state <> 'revoked')
-            """):
-        key = (q.doc_id, stuple(q.subject), stuple(q.object))
-        if key not in question_groups: continue
-
-        q_ = question_groups[key]
-        # Purge any questions that have already been asked.
-        if (q.subject_canonical_gloss in q_.subject_canonical_gloss or q.subject_entity == q_.subject_entity) and \
-                (q.object_canonical_gloss == q_.object_canonical_gloss or q.object_entity == q_.object_entity):
-            del question_groups[key]
-        # Flip the entity order
-        if (q.object_canonical_gloss in q_.subject_canonical_gloss or q.object_entity == q_.subject_entity) and \
-                (q.suobject_canonical_gloss == q_.object_canonical_gloss or q.subject_entity == q_.object_entity):
-            del question_groups[key]
-
-    for q in db.select("""
-        SELECT doc_id, subject, object,
-            subject_entity AS subject_canonical_gloss, object_entity AS object_canonical_gloss,
-            subject_entity AS subject_entity, object_entity AS object_entity
-            FROM evaluation_entity_relation r
-            """):
-        key = (q.doc_id, stuple(q.subject), stuple(q.object))
-        if key not in question_groups: continue
-
-        q_ = question_groups[key]
-        # If you find a match, then break out of this loop
-        if (q.subject_canonical_gloss == q_.subject_canonical_gloss or q.subject_entity == q_.subject_entity) and \
-                (q.object_canonical_gloss == q_.object_canonical_gloss or q.object_entity == q_.object_entity):
-            del question_groups[key]
-        # Flip the entity order
-        if (q.object_canonical_gloss in q_.subject_canonical_gloss or q.object_entity == q_.subject_entity) and \
-                (q.subject_canonical_gloss == q_.object_canonical_gloss or q.subject_entity == q_.object_entity):
-            del question_groups[key]
+    # Group by doc_id, subject, object and drop the groups that have
+    # already been asked or annotated: the candidates are matched
+    # against evaluation_relation_question and evaluation_entity_relation
+    # with (indexed) joins on (doc_id, subject, object).
+    with db.cursor() as cur:
+        db.execute("""
+            CREATE TEMPORARY TABLE question_candidate ON COMMIT DROP AS
+            SELECT DISTINCT ON (s.doc_id, LEAST(s.subject, s.object), GREATEST(s.subject, s.object)) 
+                   s.doc_id, s.subject, s.object, 
+                   r.subject_type, r.object_type,
+                   r.subject_gloss, r.object_gloss,
+                   r.subject_canonical_gloss, r.object_canonical_gloss,
+                   r.subject_canonical, r.object_canonical,
+                   r.subject_entity, r.object_entity
+            FROM submission_sample s
+            JOIN submission_entity_relation r ON (
+                r.submission_id = s.submission_id
+                AND s.doc_id = r.doc_id AND s.subject = r.subject AND s.object = r.object)
+            WHERE s.submission_id = %(submission_id)s
+              AND s.batch_id = %(sample_batch_id)s
+            """, cur=cur, submission_id=submission_id, sample_batch_id=sample_batch_id)
+        db.execute("""ANALYZE question_candidate""", cur=cur)
+        # Either entity order counts as a match; a subject's canonical
+        # gloss matches any that it contains.
+        question_groups = {(q.doc_id, stuple(q.subject), stuple(q.object)): q for q in db.select("""
+            SELECT c.*
+            FROM question_candidate c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM evaluation_relation_question q
+                WHERE q.doc_id = c.doc_id AND q.subject = c.subject AND q.object = c.object
+                  AND q.state NOT IN ('error', 'revoked')
+                  AND (((strpos(c.subject_canonical_gloss, q.subject_canonical_gloss) > 0 OR q.subject_entity IS NOT DISTINCT FROM c.subject_entity)
+                        AND (q.object_canonical_gloss = c.object_canonical_gloss OR q.object_entity IS NOT DISTINCT FROM c.object_entity))
+                    OR ((strpos(c.subject_canonical_gloss, q.object_canonical_gloss) > 0 OR q.object_entity IS NOT DISTINCT FROM c.subject_entity)
+                        AND (q.subject_canonical_gloss = c.object_canonical_gloss OR q.subject_entity IS NOT DISTINCT FROM c.object_entity))))
+              AND NOT EXISTS (
+                SELECT 1 FROM evaluation_entity_relation e
+                WHERE e.doc_id = c.doc_id AND e.subject = c.subject AND e.object = c.object
+                  AND (((e.subject_entity = c.subject_canonical_gloss OR e.subject_entity IS NOT DISTINCT FROM c.subject_entity)
+                        AND (e.object_entity = c.object_canonical_gloss OR e.object_entity IS NOT DISTINCT FROM c.object_entity))
+                    OR ((strpos(c.subject_canonical_gloss, e.object_entity) > 0 OR e.object_entity IS NOT DISTINCT FROM c.subject_entity)
+                        AND (e.subject_entity = c.object_canonical_gloss OR e.subject_entity IS NOT DISTINCT FROM c.object_entity))))
+            """, cur=cur)}
+    logger.info("%d question groups remain after removing those already asked or annotated", len(question_groups))
 
     questions = []
     for row in question_groups.values():
@@ -182,9 +169,8 @@ def insert_evaluation_question(batch_id, params, cur=None):
     validate_question_params(params)
 
     if cur is None:
-        with db.CONN:
-            with db.CONN.cursor() as cur:
-                return insert_evaluation_question(batch_id, params, cur)
+        with db.cursor() as cur:
+            return insert_evaluation_question(batch_id, params, cur)
     else:
         params_str = json.dumps(params)
         id_ = sha1(params_str.encode("utf-8")).hexdigest()
@@ -205,9 +191,8 @@ def insert_evaluation_batch(corpus_tag, batch_type, description, questions, samp
     for params in questions: validate_question_params(params)
 
     if cur is None:
-        with db.CONN:
-            with db.CONN.cursor() as cur:
-                return insert_evaluation_batch(corpus_tag, batch_type, description, questions, sample_batch_id, cur)
+        with db.cursor() as cur:
+            return insert_evaluation_batch(corpus_tag, batch_type, description, questions, sample_batch_id, cur)
     else:
         # Create new batch.
         cur.execute("""
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Coordinates refreshes of the evaluation materialized views.
+
+Writers call request_refresh() after their changes are committed;
+refresh_views() then refreshes every view that has been requested since
+its last refresh started, in dependency order, with REFRESH MATERIALIZED
+VIEW CONCURRENTLY so that readers (e.g. of submission_entries) never
+block. A per-view advisory lock ensures that only one process refreshes
+a view at a time: requests that arrive while a refresh is running are
+collapsed into (at most) one more refresh. Refresh durations are
+recorded in view_refresh_log.
+"""
+
+import time
+import logging
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# Materialized views, in dependency order: each view depends on the
+# ones before it.
+VIEWS = [
+    "evaluation_mention_link",
+    "evaluation_entity_relation",
+    "submission_entries_list",
+    "submission_entries",
+    ]
+
+def _with_dependents(views):
+    """
+    @returns: @views and every view that depends on them, in dependency order.
+    """
+    for view in views:
+        if view not in VIEWS:
+            raise ValueError("Unknown materialized view {}".format(view))
+    first = min(VIEWS.index(view) for view in views)
+    return VIEWS[first:]
+
+def request_refresh(*views):
+    """
+    Marks @views (and their dependents) as needing a refresh.
+    """
+    views = _with_dependents(views)
+    with db.cursor() as cur:
+        for view in views:
+            db.execute("""
+                INSERT INTO view_refresh (view_name, requested) VALUES (%(view)s, clock_timestamp())
+                ON CONFLICT (view_name) DO UPDATE SET requested = EXCLUDED.requested
+                """, cur=cur, view=view)
+    return views
+
+def _is_pending(view, cur):
+    row = db.get("""
+        SELECT requested, refreshed FROM view_refresh WHERE view_name = %(view)s
+        """, cur=cur, view=view)
+    return row is not None and row.requested is not None and (row.refreshed is None or row.requested > row.refreshed)
+
+def _refresh(view, cur):
+    started = db.get("""SELECT clock_timestamp() AS started""", cur=cur).started
+    start = time.time()
+    cur.execute("""REFRESH MATERIALIZED VIEW CONCURRENTLY {}""".format(view))
+    duration = time.time() - start
+    db.execute("""
+        UPDATE view_refresh SET refreshed = %(started)s, duration = %(duration)s WHERE view_name = %(view)s
+        """, cur=cur, view=view, started=started, duration=duration)
+    db.execute("""
+        INSERT INTO view_refresh_log (view_name, started, duration) VALUES (%(view)s, %(started)s, %(duration)s)
+        """, cur=cur, view=view, started=started, duration=duration)
+    logger.info("Refreshed %s in %.2fs", view, duration)
+    return duration
+
+def refresh_views(views=None, wait=True):
+    """
+    Refreshes those of @views (default: all) that have pending requests.
+    If another process is already refreshing a view, waits for it to
+    finish when @wait (and then refreshes the view again only if it
+    has been requested since), or skips the view otherwise. The views
+    that depend on a skipped view are skipped too, and left pending:
+    refreshing them before it would leave them stale.
+
+    @returns: a dictionary with the duration of every refresh performed.
+    """
+    views = VIEWS if views is None else _with_dependents(views)
+    durations = {}
+    skipped = set()
+    # Advisory locks belong to a session, so the same connection is
+    # used throughout; each refresh is committed as soon as it is done.
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            for view in views:
+                if view in skipped:
+                    logger.info("Skipping %s, which depends on a view being refreshed elsewhere", view)
+                    continue
+                while _is_pending(view, cur):
+                    locked = db.get("""SELECT pg_try_advisory_lock(hashtext(%(view)s)) AS locked""", cur=cur, view=view).locked
+                    conn.commit()
+                    if not locked:
+                        if not wait:
+                            logger.info("Skipping %s, which is being refreshed elsewhere", view)
+                            skipped.update(_with_dependents([view]))
+                            break
+                        db.get("""SELECT pg_advisory_lock(hashtext(%(view)s)) AS locked""", cur=cur, view=view)
+                        conn.commit()
+                    try:
+                        if _is_pending(view, cur):
+                            durations[view] = _refresh(view, cur)
+                        conn.commit()
+                    except:
+                        conn.rollback()
+                        raise
+                    finally:
+                        db.get("""SELECT pg_advisory_unlock(hashtext(%(view)s)) AS unlocked""", cur=cur, view=view)
+                        conn.commit()
+    return durations
+
+def test_with_dependents():
+    assert _with_dependents(["submission_entries_list"]) == ["submission_entries_list", "submission_entries"]
+    assert _with_dependents(["submission_entries", "evaluation_entity_relation"]) == VIEWS[1:]
+    try:
+        _with_dependents(["submission_statistics"])
+        assert False, "Expected an unknown view"
+    except ValueError:
+        pass
+
+
+def test_refresh_views_skips_dependents():
+    request_refresh("evaluation_entity_relation")
+    # Hold the lock of evaluation_entity_relation as another process would.
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            db.get("""SELECT pg_advisory_lock(hashtext(%(view)s)) AS locked""", cur=cur, view="evaluation_entity_relation")
+            try:
+                durations = refresh_views(["evaluation_entity_relation"], wait=False)
+                assert durations == {}
+                with db.cursor() as cur_:
+                    assert all(_is_pending(view, cur_) for view in VIEWS[1:])
+            finally:
+                db.get("""SELECT pg_advisory_unlock(hashtext(%(view)s)) AS unlocked""", cur=cur, view="evaluation_entity_relation")
+    assert sorted(refresh_views(["evaluation_entity_relation"], wait=False)) == sorted(VIEWS[1:])
@@ -17,11 +17,143 @@ def kl(p, q):
     p, q : array-like, dtype=float, shape=n
     Discrete probability distributions.
     """
-    p = np.asarray(p, dtype=np.float)
-    q = np.asarray(q, dtype=np.float)
+    p = np.asarray(p, dtype=np.float64)
+    q = np.asarray(q, dtype=np.float64)
 
     return np.sum(np.where(p != 0, p * np.log(p / q), 0))
 
+class Sampler(object):
+    """
+    Draws indices from a fixed discrete distribution @probs (an array
+    of non-negative weights, normalized on construction). A Sampler is
+    meant to be built once per distribution and reused:
+        - sample() draws with replacement by binary search on a
+          cumulative table, or, for draws at least as large as the
+          distribution, in O(1) per draw using Walker's alias method
+          (the alias table is built once, in O(n)).
+        - sample_without_replacement() draws in O(n) using
+          Efraimidis-Spirakis exponential keys.
+    Both return arrays of indices into @probs.
+    """
+    def __init__(self, probs, rng=None):
+        # @rng is np.random (the default), a np.random.RandomState or a
+        # np.random.Generator.
+        probs = np.asarray(probs, dtype=np.float64)
+        assert probs.ndim == 1 and len(probs) > 0, "Expected a non-empty distribution"
+        assert (probs >= 0).all(), "Expected non-negative probabilities"
+        self.probs = probs / probs.sum()
+        self.rng = rng if rng is not None else np.random
+        self._cdf = None
+        self._prob = None
+        self._alias = None
+
+    def __len__(self):
+        return len(self.probs)
+
+    @classmethod
+    def from_counter(cls, P, X=None, rng=None):
+        """
+        @returns: a sampler over the keys of @P (or the x of each (x, label(x)) in @X).
+        """
+        if X is None:
+            X = list(P.keys())
+            return cls(np.fromiter(P.values(), dtype=np.float64, count=len(P)), rng), X
+        else:
+            return cls(np.array([P[x] for x, _ in X], dtype=np.float64), rng), X
+
+    def _random(self, size):
+        # Generators spell random_sample and randint random and integers.
+        if isinstance(self.rng, np.random.Generator):
+            return self.rng.random(size)
+        return self.rng.random_sample(size)
+
+    def _randint(self, high, size):
+        if isinstance(self.rng, np.random.Generator):
+            return self.rng.integers(0, high, size=size)
+        return self.rng.randint(0, high, size=size)
+
+    def _build_alias(self):
+        # Vose's construction of Walker's alias table.
+        n = len(self.probs)
+        scaled = (self.probs * n).tolist()
+        prob, alias = [1.] * n, list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.]
+        large = [i for i, p in enumerate(scaled) if p >= 1.]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.
+            (small if scaled[l] < 1. else large).append(l)
+        # Anything left over has probability 1 up to rounding error.
+        self._prob = np.array(prob, dtype=np.float64)
+        self._alias = np.array(alias, dtype=np.int64)
+
+    def sample(self, num_samples):
+        """
+        @returns: @num_samples indices drawn with replacement.
+        """
+        n = len(self.probs)
+        if self._alias is None and num_samples < n:
+            if self._cdf is None:
+                self._cdf = np.cumsum(self.probs)
+            ixs = np.searchsorted(self._cdf, self._random(num_samples) * self._cdf[-1], side="right")
+            return np.minimum(ixs, n - 1)
+        if self._alias is None:
+            self._build_alias()
+        ixs = self._randint(n, num_samples)
+        coins = self._random(num_samples)
+        return np.where(coins < self._prob[ixs], ixs, self._alias[ixs])
+
+    def sample_without_replacement(self, num_samples):
+        """
+        @returns: min(@num_samples, n) distinct indices drawn without
+        replacement, in the order they would be drawn sequentially.
+        """
+        n = len(self.probs)
+        if num_samples >= n:
+            num_samples = n
+        # The smallest E/p (E ~ Exp(1)) is the first draw, and so on;
+        # zero-probability elements are only chosen once all others are.
+        with np.errstate(divide="ignore"):
+            keys = self.rng.exponential(size=n) / self.probs
+        ixs = np.argpartition(keys, num_samples - 1)[:num_samples] if num_samples < n else np.arange(n)
+        return ixs[np.argsort(keys[ixs], kind="mergesort")]
+
+def test_sampler():
+    np.random.seed(42)
+    probs = np.array([0.4, 0.3, 0.2, 0.1, 0.])
+    sampler = Sampler(probs)
+
+    ixs = sampler.sample(3)
+    assert len(ixs) == 3 and sampler._alias is None and 4 not in ixs
+
+    ixs = sampler.sample(100000)
+    assert ixs.dtype.kind == "i" and len(ixs) == 100000
+    assert np.allclose(np.bincount(ixs, minlength=5) / 100000, probs, atol=1e-2)
+
+    ixs = sampler.sample_without_replacement(3)
+    assert len(ixs) == 3 and len(set(ixs.tolist())) == 3 and 4 not in ixs
+    assert sorted(sampler.sample_without_replacement(10).tolist()) == list(range(5))
+
+    # The first draw without replacement follows probs.
+    firsts = np.bincount([sampler.sample_without_replacement(2)[0] for _ in range(20000)], minlength=5) / 20000
+    assert np.allclose(firsts, probs, atol=2e-2)
+
+    sampler, X = Sampler.from_counter(Counter({'a': 1., 'b': 3.}))
+    assert X == ['a', 'b'] and np.allclose(sampler.probs, [0.25, 0.75])
+
+def test_sampler_rngs():
+    probs = np.array([0.4, 0.3, 0.2, 0.1, 0.])
+    for rng in [np.random.RandomState(42), np.random.default_rng(42)]:
+        sampler = Sampler(probs, rng)
+        assert 4 not in sampler.sample(3)
+        ixs = sampler.sample(100000)
+        assert np.allclose(np.bincount(ixs, minlength=5) / 100000, probs, atol=1e-2)
+        assert sorted(sampler.sample_without_replacement(4).tolist()) == [0, 1, 2, 3]
+
+    # The same seed gives the same draws.
+    assert (Sampler(probs, np.random.default_rng(7)).sample(10) == Sampler(probs, np.random.default_rng(7)).sample(10)).all()
+
 def sample_uniformly_with_replacement(X, num_samples):
     """
     Draw num_samples from X using the uniform distribution.
@@ -46,15 +178,10 @@ def sample_with_replacement(P, num_samples, X=None):
     if X is not None:
         assert len(X) == len(P), "Distribution does not match X"
 
-    if X is None:
-        X, P_ = zip(*P.items())
-        P_ = P_
-    else:
-        P_ = [P[x] for x, _ in X]
-    assert abs(sum(P_) - 1.) < 1e-6
+    assert abs(sum(P.values()) - 1.) < 1e-6
+    sampler, X = Sampler.from_counter(P, X)
 
-    ixs = list(range(len(X)))
-    Xh = [X[i] for i in np.random.choice(ixs, num_samples, replace=True, p=P_)]
+    Xh = [X[i] for i in sampler.sample(num_samples).tolist()]
     assert len(Xh) == num_samples
     return Xh
 
@@ -93,15 +220,11 @@ def sample_without_replacement(P, num_samples, X=None):
         else:
             return list(P.keys())
 
-    if X is None:
-        X, P_ = zip(*P.items())
-    else:
-        P_ = [P[x] for x,_ in X]
-    assert abs(sum(P_) - 1.) < 1e-6
+    assert abs(sum(P.values()) - 1.) < 1e-6
+    sampler, X = Sampler.from_counter(P, X)
 
-    # Sample from P_
-    ixs = list(range(len(X)))
-    Xh = [X[i] for i in np.random.choice(ixs, num_samples, replace=False, p=P_)]
+    # Sample from P
+    Xh = [X[i] for i in sampler.sample_without_replacement(num_samples).tolist()]
     assert len(Xh) == num_samples
     return Xh
 
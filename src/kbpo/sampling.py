@@ -3,13 +3,17 @@ Generate samples for a corpus tag and for a submission.
 """
 
 import json
+import math
+import heapq
 import logging
+from collections import defaultdict
 
 import numpy as np
 
 from . import db
 from . import distribution
-from .sample_util import sample_without_replacement
+from .sample_util import Sampler, sample_without_replacement
+from .evaluation_matrix import plan_n_samples
 from .counter_utils import normalize
 
 logger = logging.getLogger(__name__)
@@ -21,15 +25,14 @@ def sample_document_uniform(corpus_tag, n_samples):
     # Get samples
     doc_ids = sample_without_replacement(P, n_samples)
 
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("""
-                INSERT INTO sample_batch(distribution_type, corpus_tag, params) VALUES %s RETURNING id
-                """, [('uniform', corpus_tag, json.dumps({'type':'uniform', 'with_replacement': False}),)])
-            batch_id, = next(cur)
-            db.execute_values(cur, """
-                INSERT INTO document_sample(batch_id, doc_id) VALUES %s
-                """, [(batch_id, doc_id) for doc_id in doc_ids])
+    with db.cursor() as cur:
+        cur.execute("""
+            INSERT INTO sample_batch(distribution_type, corpus_tag, params) VALUES %s RETURNING id
+            """, [('uniform', corpus_tag, json.dumps({'type':'uniform', 'with_replacement': False}),)])
+        batch_id, = next(cur)
+        db.execute_values(cur, """
+            INSERT INTO document_sample(batch_id, doc_id) VALUES %s
+            """, [(batch_id, doc_id) for doc_id in doc_ids])
 
 def test_sample_document_uniform():
     np.random.seed(42)
@@ -70,15 +73,14 @@ def sample_document_entity(corpus_tag, n_samples, mention_table='evaluation_ment
     # Get samples
     doc_ids = sample_without_replacement(P, n_samples)
 
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("""
-                INSERT INTO sample_batch(distribution_type, corpus_tag, params) VALUES %s RETURNING id
-                """, [('entity', corpus_tag, json.dumps({'type':'entity', 'with_replacement': False}),)])
-            batch_id, = next(cur)
-            db.execute_values(cur, """
-                INSERT INTO document_sample(batch_id, doc_id) VALUES %s
-                """, [(batch_id, doc_id) for doc_id in doc_ids])
+    with db.cursor() as cur:
+        cur.execute("""
+            INSERT INTO sample_batch(distribution_type, corpus_tag, params) VALUES %s RETURNING id
+            """, [('entity', corpus_tag, json.dumps({'type':'entity', 'with_replacement': False}),)])
+        batch_id, = next(cur)
+        db.execute_values(cur, """
+            INSERT INTO document_sample(batch_id, doc_id) VALUES %s
+            """, [(batch_id, doc_id) for doc_id in doc_ids])
 
 def test_sample_document_entity():
     tag = 'kbp2016'
@@ -101,37 +103,448 @@ def test_sample_document_entity():
     docs = db.select("""SELECT doc_id FROM document_sample WHERE batch_id=%(batch_id)s""", batch_id=batch.id)
     assert len(docs) == 20
 
-# TODO: compute sample size
-def sample_submission(corpus_tag, submission_id, type_, n_samples):
-    # Get distribution
-    logger.info("Computing distributions")
+def submission_distribution(corpus_tag, type_, submission_id=None):
+    """
+    Returns the submission distributions of type @type_ on @corpus_tag.
+    """
     if type_ == "instance":
-        P = distribution.submission_instance(corpus_tag, submission_id)
+        return distribution.submission_instance(corpus_tag, submission_id)
     elif type_ == "relation":
-        P = distribution.submission_relation(corpus_tag, submission_id)
+        return distribution.submission_relation(corpus_tag, submission_id)
     elif type_ == "entity":
-        P = distribution.submission_entity(corpus_tag, submission_id)
+        return distribution.submission_entity(corpus_tag, submission_id)
     elif type_ == "entity_relation":
-        P = distribution.submission_entity_relation(corpus_tag, submission_id)
+        return distribution.submission_entity_relation(corpus_tag, submission_id)
     else:
         raise ValueError("Invalid submission sampling distribution type: {}".format(type_))
 
+def estimate_submission_n_samples(corpus_tag, submission_id, type_, target=500):
+    """
+    Plans how many samples to draw from @submission_id so that its joint
+    precision estimate is as good as @target samples drawn from it alone,
+    given the samples already collected for the other submissions.
+
+    Only the parts of the other distributions and samples that overlap
+    with @submission_id are loaded (see overlapping_distributions): the
+    rest only enters the plan through its mass and number of samples.
+    """
+    P = submission_distribution(corpus_tag, type_, submission_id)[submission_id]
+    Ps = distribution.overlapping_distributions(corpus_tag, type_, submission_id)
+    Xhs, Whs = distribution.overlapping_samples(corpus_tag, type_, submission_id)
+    systems = sorted(system for system in Xhs if system in Ps)
+
+    n_samples, _ = plan_n_samples([Ps[system] for system in systems] + [P], [Xhs[system] for system in systems], target=target, Whs=[Whs[system] for system in systems])
+    logger.info("Planned %d samples for submission %s using %d other submissions", n_samples, submission_id, len(systems))
+    return n_samples
+
+def sample_submission(corpus_tag, submission_id, type_, n_samples, in_database=False):
+    """
+    Draws @n_samples relation instances without replacement from the
+    distribution @type_ of @submission_id into a new sample batch.
+    With @in_database, the samples are drawn (and inserted) by the
+    database without ever loading the distribution.
+
+    @returns: the id of the sample batch.
+    """
+    if in_database:
+        return _sample_submission_in_database(corpus_tag, submission_id, type_, n_samples)
+
+    # Get distribution
+    logger.info("Computing distributions")
+    P = submission_distribution(corpus_tag, type_, submission_id)
+
     # Get samples
     logger.info("Drawing samples")
     relation_mentions = sample_without_replacement(P[submission_id], n_samples)
 
     logger.info("Loading samples into batch")
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("""
-                INSERT INTO sample_batch(submission_id, distribution_type, corpus_tag, params) VALUES %s RETURNING id
-                """, [(submission_id, type_, corpus_tag, json.dumps({'submission_id':submission_id, 'type':type_, 'with_replacement': False}),)])
-            batch_id, = next(cur)
-            db.execute_values(cur, """
-                INSERT INTO submission_sample(batch_id, submission_id, doc_id, subject, object) VALUES %s
-                """, [(batch_id, submission_id, doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_)) for doc_id, subject, object_ in relation_mentions])
+    with db.cursor() as cur:
+        batch_id = _create_submission_batch(cur, corpus_tag, submission_id, type_)
+        db.execute_values(cur, """
+            INSERT INTO submission_sample(batch_id, submission_id, doc_id, subject, object) VALUES %s
+            """, [(batch_id, submission_id, doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_)) for doc_id, subject, object_ in relation_mentions])
+    return batch_id
+
+def _create_submission_batch(cur, corpus_tag, submission_id, type_):
+    cur.execute("""
+        INSERT INTO sample_batch(submission_id, distribution_type, corpus_tag, params) VALUES %s RETURNING id
+        """, [(submission_id, type_, corpus_tag, json.dumps({'submission_id':submission_id, 'type':type_, 'with_replacement': False}),)])
+    batch_id, = next(cur)
     return batch_id
 
+def _sample_submission_in_database(corpus_tag, submission_id, type_, n_samples):
+    # Weighted sampling without replacement (Efraimidis-Spirakis): the
+    # instances with the smallest E/p, E ~ Exp(1), are drawn. E/p is
+    # scale-invariant, so the distribution need not be normalized.
+    sql, column = distribution.submission_distribution_sql(type_, submission_id)
+    logger.info("Drawing samples in the database")
+    with db.cursor() as cur:
+        batch_id = _create_submission_batch(cur, corpus_tag, submission_id, type_)
+        cur.execute("""
+            INSERT INTO submission_sample(batch_id, submission_id, doc_id, subject, object)
+            SELECT %(batch_id)s, p.submission_id, p.doc_id, p.subject, p.object
+            FROM ({sql}) p
+            WHERE p.{column} > 0
+            ORDER BY -ln(1. - random())/p.{column}
+            LIMIT %(n_samples)s
+            """.format(sql=sql, column=column), {"batch_id": batch_id, "corpus_tag": corpus_tag, "submission_id": submission_id, "n_samples": n_samples})
+        if cur.rowcount < n_samples:
+            logger.warning("Not enough elements to meaningfully sample without replacement")
+    return batch_id
+
+## Stratified sampling
+# Stratified batches are stored with the flat batches of their
+# distribution type (with params design "stratified"). Because a
+# stratum h of mass P(h) that holds N_h of the N stratified samples of a
+# submission is over- or under-sampled by N_h / (N P(h)), every
+# stratified sample carries the importance weight N P(h) / N_h, which the
+# joint estimators multiply f(x) by. The weights depend on every
+# stratified batch of the submission, so they are recomputed whenever a
+# batch is added.
+def _entity_bin(count):
+    # Subject entities are binned by the order of magnitude (base 2) of
+    # their number of relations; @count is a NUMERIC (Decimal).
+    return "entity:{}".format(max(int(count), 1).bit_length() - 1)
+
+def submission_strata(corpus_tag, submission_id, type_, by="relation", merged=()):
+    """
+    Partitions the distribution @type_ of @submission_id by relation
+    type (@by="relation") or by subject entity frequency (@by="entity").
+    The strata in @merged are folded into the "other" stratum.
+
+    @returns: a dictionary of stratum -> (keys, probabilities).
+    """
+    if by not in ("relation", "entity"):
+        raise ValueError("Invalid stratification {}".format(by))
+    P = submission_distribution(corpus_tag, type_, submission_id)[submission_id]
+    merged = set(merged)
+
+    labels = {}
+    for row in db.select("""
+        SELECT s.doc_id, s.subject, s.object, s.relation, ec.count AS entity_count
+        FROM submission_entity_relation s
+        JOIN submission_entity_counts ec ON (s.submission_id = ec.submission_id AND ec.subject_entity IS NOT DISTINCT FROM s.subject_entity)
+        WHERE s.submission_id = %(submission_id)s
+        """, submission_id=submission_id):
+        x = (row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper))
+        labels[x] = row.relation if by == "relation" else _entity_bin(row.entity_count)
+
+    strata = defaultdict(lambda: ([], []))
+    for x, p in P.items():
+        if p > 0:
+            h = labels.get(x, "other")
+            xs, ps = strata["other" if h in merged else h]
+            xs.append(x)
+            ps.append(p)
+    return {h: (xs, np.array(ps)) for h, (xs, ps) in strata.items()}
+
+def merge_strata(masses, n_samples):
+    """
+    Every stratum needs at least one sample for the stratified weights
+    to be defined: @returns the lightest strata to fold into "other" so
+    that no more than @n_samples strata are left.
+    """
+    candidates = sorted((h for h in masses if h != "other"), key=lambda h: masses[h])
+    merged = []
+    def _n_strata():
+        return len(masses) - len(merged) + (1 if merged and "other" not in masses else 0)
+    while candidates and _n_strata() > max(n_samples, 1):
+        merged.append(candidates.pop(0))
+    return merged
+
+def allocate_proportional(masses, sizes, n_samples, min_samples=2):
+    """
+    Allocates @n_samples across strata in proportion to their @masses,
+    giving each stratum at least @min_samples (if @n_samples allows it,
+    one sample at a time, largest strata first) and at most its size. The allocation never
+    adds up to more than @n_samples.
+    """
+    Z = sum(masses.values())
+    quotas = {h: n_samples * mass / Z for h, mass in masses.items()}
+    floors = {h: min(sizes[h], min_samples) for h in masses}
+    by_mass = sorted(masses, key=lambda h: -masses[h])
+
+    if sum(floors.values()) > n_samples:
+        # Deal the minimums out one at a time, so that every stratum gets
+        # a sample before any gets its second.
+        allocation, left = {h: 0 for h in masses}, n_samples
+        for _ in range(min_samples):
+            for h in by_mass:
+                if left > 0 and allocation[h] < floors[h]:
+                    allocation[h] += 1
+                    left -= 1
+        return allocation
+
+    allocation = {h: min(sizes[h], max(floors[h], int(quota))) for h, quota in quotas.items()}
+    # The minimums may overshoot: take the excess from the largest strata...
+    while sum(allocation.values()) > n_samples:
+        h = max((h for h in by_mass if allocation[h] > floors[h]), key=lambda h: allocation[h])
+        allocation[h] -= 1
+    # ... and hand out what is left by largest remainder.
+    for _ in range(n_samples - sum(allocation.values())):
+        open_ = [h for h in by_mass if allocation[h] < sizes[h]]
+        if not open_:
+            break
+        allocation[min(open_, key=lambda h: allocation[h] - quotas[h])] += 1
+    return allocation
+
+def _variance(n, k):
+    # Variance of a Bernoulli with a (Laplace) smoothed mean, so that
+    # unanimous strata still attract samples.
+    p = (k + 1.) / (n + 2.)
+    return p * (1. - p)
+
+def allocate_adaptive(masses, sizes, stats, n_samples):
+    """
+    Greedily allocates @n_samples more samples to the strata whose
+    contribution to the variance of the stratified precision estimate
+    would drop the most (Neyman allocation), given the @stats (n, number
+    correct) of the samples annotated so far in each stratum. Strata
+    without any sample yet come first.
+    """
+    Z = sum(masses.values())
+    def _gain(h, n):
+        n_, k = stats.get(h, (0, 0))
+        if n_ + n == 0:
+            return float("inf")
+        return (masses[h] / Z) ** 2 * _variance(n_, k) * (1. / (n_ + n) - 1. / (n_ + n + 1))
+
+    allocation = {h: 0 for h in masses}
+    heap = [(-_gain(h, 0), h) for h in masses if sizes[h] > 0]
+    heapq.heapify(heap)
+    for _ in range(n_samples):
+        if not heap:
+            break
+        _, h = heapq.heappop(heap)
+        allocation[h] += 1
+        if allocation[h] < sizes[h]:
+            heapq.heappush(heap, (-_gain(h, allocation[h]), h))
+    return allocation
+
+def stratified_weights(masses, counts):
+    """
+    @returns: the importance weight N P(h) / N_h of the samples of each
+    stratum h, given its @masses P(h) and the @counts N_h of samples
+    drawn from it.
+    """
+    Z, N = sum(masses.values()), sum(counts.values())
+    return {h: N * masses[h] / (Z * n) for h, n in counts.items() if n > 0}
+
+def _stratified_batches(submission_id, type_):
+    return db.select("""
+        SELECT id, params
+        FROM sample_batch
+        WHERE submission_id = %(submission_id)s AND distribution_type = %(distribution_type)s AND params->>'design' = 'stratified'
+        ORDER BY id
+        """, submission_id=submission_id, distribution_type=type_)
+
+def _stratified_samples(submission_id, type_):
+    """
+    @returns: the keys of the samples in the stratified batches of @submission_id.
+    """
+    return [(row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)) for row in db.select("""
+        SELECT d.doc_id, d.subject, d.object
+        FROM sample_batch b
+        JOIN submission_sample d ON (b.id = d.batch_id)
+        WHERE b.submission_id = %(submission_id)s AND b.distribution_type = %(distribution_type)s AND b.params->>'design' = 'stratified'
+        """, submission_id=submission_id, distribution_type=type_)]
+
+def sample_submission_stratified(corpus_tag, submission_id, type_, n_samples, by="relation", adaptive=False):
+    """
+    Draws @n_samples relation instances from the distribution @type_ of
+    @submission_id, stratified @by relation or entity frequency (see
+    submission_strata). Within each stratum, instances are drawn without
+    replacement in proportion to P.
+
+    Without @adaptive, samples are allocated in proportion to the mass
+    of each stratum. With @adaptive, they top up earlier stratified
+    batches in the strata with the most variance (see allocate_adaptive),
+    never redrawing an instance. Either way, the samples are weighted
+    (see stratified_weights) so that the joint estimators remain
+    unbiased.
+
+    @returns: the id of the sample batch.
+    """
+    batches = _stratified_batches(submission_id, type_)
+    if batches:
+        if batches[0].params['stratified_by'] != by:
+            raise ValueError("Submission {} is already stratified by {}".format(submission_id, batches[0].params['stratified_by']))
+        merged = batches[0].params['merged']
+        strata = submission_strata(corpus_tag, submission_id, type_, by, merged)
+    else:
+        strata = submission_strata(corpus_tag, submission_id, type_, by)
+        merged = merge_strata({h: probs.sum() for h, (_, probs) in strata.items()}, n_samples)
+        if merged:
+            logger.info("Merging %d strata into other", len(merged))
+            strata = submission_strata(corpus_tag, submission_id, type_, by, merged)
+    masses = {h: probs.sum() for h, (_, probs) in strata.items()}
+    stratum = {x: h for h, (xs, _) in strata.items() for x in xs}
+
+    if adaptive:
+        sampled = set(_stratified_samples(submission_id, type_))
+        stats = defaultdict(lambda: (0, 0))
+        for x, fx in distribution.Xh(corpus_tag, type_, submission_id).get(submission_id, []):
+            if x in stratum and fx is not None:
+                n, k = stats[stratum[x]]
+                stats[stratum[x]] = (n + 1, k + fx)
+        strata = {h: ([x for x in xs if x not in sampled], np.array([p for x, p in zip(xs, probs) if x not in sampled])) for h, (xs, probs) in strata.items()}
+        allocation = allocate_adaptive(masses, {h: len(xs) for h, (xs, _) in strata.items()}, stats, n_samples)
+    else:
+        allocation = allocate_proportional(masses, {h: len(xs) for h, (xs, _) in strata.items()}, n_samples, min_samples=2 if not batches else 0)
+
+    relation_mentions = []
+    for h, n in allocation.items():
+        xs, probs = strata[h]
+        if n > 0:
+            relation_mentions.extend(xs[i] for i in Sampler(probs).sample_without_replacement(n).tolist())
+    logger.info("Drew %d stratified samples from %d strata", len(relation_mentions), sum(1 for n in allocation.values() if n > 0))
+
+    with db.cursor() as cur:
+        cur.execute("""
+            INSERT INTO sample_batch(submission_id, distribution_type, corpus_tag, params) VALUES %s RETURNING id
+            """, [(submission_id, type_, corpus_tag, json.dumps({
+                'submission_id':submission_id, 'type':type_, 'with_replacement': False, 'design': 'stratified',
+                'stratified_by': by, 'merged': merged, 'adaptive': adaptive, 'allocation': allocation}),)])
+        batch_id, = next(cur)
+        db.execute_values(cur, """
+            INSERT INTO submission_sample(batch_id, submission_id, doc_id, subject, object) VALUES %s
+            """, [(batch_id, submission_id, doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_)) for doc_id, subject, object_ in relation_mentions])
+    _update_stratified_weights(submission_id, type_, masses, stratum)
+    return batch_id
+
+def _update_stratified_weights(submission_id, type_, masses, stratum):
+    # Reweights every stratified sample of the submission, including
+    # those of earlier batches, whose N_h and N have changed.
+    batch_ids = [row.id for row in _stratified_batches(submission_id, type_)]
+    samples = _stratified_samples(submission_id, type_)
+    counts = defaultdict(int)
+    for x in samples:
+        counts[stratum.get(x)] += 1
+    weights = stratified_weights(masses, {h: n for h, n in counts.items() if h is not None})
+    with db.cursor() as cur:
+        db.execute_values(cur, """
+            UPDATE submission_sample d SET weight = v.weight
+            FROM (VALUES %s) AS v(submission_id, doc_id, subject, object, weight)
+            WHERE d.submission_id = v.submission_id AND d.doc_id = v.doc_id AND d.subject = v.subject AND d.object = v.object
+              AND d.batch_id IN ({batch_ids})
+            """.format(batch_ids=", ".join(str(id_) for id_ in batch_ids)),
+            [(submission_id, doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_), weights.get(stratum.get((doc_id, subject, object_)), 1.)) for doc_id, subject, object_ in set(samples)])
+
+## Reuse-aware sampling
+# Instances of a submission that have already been annotated are used as
+# a census: they are all added to the batch, and fresh samples are only
+# drawn from the rest of the distribution. With n = |K| + m samples in
+# the batch, a census instance x carries the importance weight n p(x),
+# and each of the m fresh samples n (1 - P(K)) / m, so that the batch is
+# scored by the joint estimators like any other (see reuse_weights).
+def submission_annotations(submission_id):
+    """
+    @returns: a dictionary of (doc_id, subject, object) -> f(x) for every
+    instance of @submission_id that already has a merged annotation in
+    evaluation_relation.
+    """
+    return {(row.doc_id, (row.subject.lower, row.subject.upper), (row.object.lower, row.object.upper)): float(row.correct) for row in db.select("""
+        SELECT s.doc_id, s.subject, s.object, s.correct
+        FROM submission_entries s
+        JOIN evaluation_relation r ON (s.doc_id = r.doc_id AND s.subject = r.subject AND s.object = r.object)
+        WHERE s.submission_id = %(submission_id)s AND s.correct IS NOT NULL
+        """, submission_id=submission_id)}
+
+def plan_fresh_samples(n_samples, annotated_mass):
+    """
+    @returns: the number of fresh samples that give the same variance as
+    @n_samples samples from P, when the instances holding
+    @annotated_mass of P are already annotated.
+    """
+    return int(math.ceil(n_samples * (1. - annotated_mass) ** 2))
+
+def reuse_weights(annotated_probs, n_fresh):
+    """
+    @returns: the importance weights of the census instances with
+    (normalized) probabilities @annotated_probs, and that of each of
+    @n_fresh samples drawn from the rest of P.
+    """
+    annotated_probs = np.asarray(annotated_probs, dtype=np.float64)
+    n = len(annotated_probs) + n_fresh
+    return n * annotated_probs, (n * (1. - annotated_probs.sum()) / n_fresh if n_fresh > 0 else 0.)
+
+def sample_submission_reuse(corpus_tag, submission_id, type_, n_samples):
+    """
+    Draws fresh samples from the distribution @type_ of @submission_id,
+    excluding the instances that are already annotated (see
+    submission_annotations), with as many samples as needed to match
+    the variance of @n_samples samples (see plan_fresh_samples). The
+    annotated instances are added to the batch as a census; the samples
+    are weighted so that the joint estimators remain unbiased.
+
+    @returns: the id of the sample batch.
+    """
+    P = submission_distribution(corpus_tag, type_, submission_id)[submission_id]
+    annotations = submission_annotations(submission_id)
+
+    Z = sum(P.values())
+    census = [x for x, p in P.items() if p > 0 and x in annotations]
+    annotated_mass = sum(P[x] for x in census) / Z
+
+    xs = [x for x, p in P.items() if p > 0 and x not in annotations]
+    n_fresh = min(len(xs), plan_fresh_samples(n_samples, annotated_mass))
+    logger.info("Reusing %d annotations (%.2f of P); drawing %d fresh samples instead of %d", len(census), annotated_mass, n_fresh, n_samples)
+    relation_mentions = [xs[i] for i in Sampler(np.array([P[x] for x in xs])).sample_without_replacement(n_fresh).tolist()] if n_fresh > 0 else []
+    census_weights, fresh_weight = reuse_weights([P[x] / Z for x in census], len(relation_mentions))
+
+    with db.cursor() as cur:
+        cur.execute("""
+            INSERT INTO sample_batch(submission_id, distribution_type, corpus_tag, params) VALUES %s RETURNING id
+            """, [(submission_id, type_, corpus_tag, json.dumps({
+                'submission_id':submission_id, 'type':type_, 'with_replacement': False, 'design': 'reuse',
+                'n_annotated': len(census), 'annotated_mass': annotated_mass}),)])
+        batch_id, = next(cur)
+        db.execute_values(cur, """
+            INSERT INTO submission_sample(batch_id, submission_id, doc_id, subject, object, weight) VALUES %s
+            """, [(batch_id, submission_id, doc_id, db.Int4NumericRange(*subject), db.Int4NumericRange(*object_), float(weight))
+                  for (doc_id, subject, object_), weight in list(zip(census, census_weights)) + [(x, fresh_weight) for x in relation_mentions]])
+    return batch_id
+
+def test_entity_bin():
+    from decimal import Decimal
+    assert [_entity_bin(Decimal(c)) for c in [0, 1, 2, 3, 4, 1000]] == ["entity:0", "entity:0", "entity:1", "entity:1", "entity:2", "entity:9"]
+    assert _entity_bin(5) == "entity:2"
+
+def test_allocate_proportional():
+    masses = {"a": 0.6, "b": 0.3, "c": 0.1}
+    assert allocate_proportional(masses, {"a": 100, "b": 100, "c": 100}, 10) == {"a": 5, "b": 3, "c": 2}
+    assert allocate_proportional(masses, {"a": 100, "b": 100, "c": 100}, 10, min_samples=0) == {"a": 6, "b": 3, "c": 1}
+    assert allocate_proportional(masses, {"a": 100, "b": 100, "c": 100}, 5, min_samples=2) == {"a": 2, "b": 2, "c": 1}
+    assert allocate_proportional(masses, {"a": 100, "b": 100, "c": 100}, 4, min_samples=2) == {"a": 2, "b": 1, "c": 1}
+    assert allocate_proportional(masses, {"a": 3, "b": 100, "c": 100}, 10) == {"a": 3, "b": 5, "c": 2}
+    assert allocate_proportional(masses, {"a": 1, "b": 1, "c": 1}, 10) == {"a": 1, "b": 1, "c": 1}
+    assert allocate_proportional(masses, {"a": 100, "b": 100, "c": 1}, 10, min_samples=0) == {"a": 6, "b": 3, "c": 1}
+    assert sum(allocate_proportional({"a": 1., "b": 1., "c": 1.}, {"a": 10, "b": 10, "c": 10}, 10, min_samples=0).values()) == 10
+
+def test_allocate_adaptive():
+    masses = {"a": 0.5, "b": 0.5}
+    # "a" is unanimous so far while "b" is split.
+    stats = {"a": (20, 20), "b": (20, 10)}
+    allocation = allocate_adaptive(masses, {"a": 100, "b": 100}, stats, 10)
+    assert sum(allocation.values()) == 10 and allocation["b"] > allocation["a"]
+    assert allocate_adaptive(masses, {"a": 100, "b": 2}, stats, 10) == {"a": 8, "b": 2}
+
+def test_merge_strata():
+    masses = {"a": 0.6, "b": 0.3, "c": 0.06, "d": 0.04}
+    assert merge_strata(masses, 10) == []
+    assert merge_strata(masses, 3) == ["d", "c"]
+    assert merge_strata(dict(masses, other=0.1), 3) == ["d", "c"]
+    assert merge_strata(masses, 1) == ["d", "c", "b", "a"]
+
+def test_stratified_weights():
+    # "a" is undersampled and "b" oversampled relative to their masses.
+    weights = stratified_weights({"a": 0.75, "b": 0.25, "c": 0.}, {"a": 4, "b": 4, "c": 0})
+    assert weights == {"a": 1.5, "b": 0.5}
+    # Weighted by these, the strata average to the stratified estimate.
+    fxs = {"a": [1., 1., 0., 0.], "b": [1., 1., 1., 1.]}
+    p = sum(weights[h] * fx for h in fxs for fx in fxs[h]) / 8
+    assert abs(p - (0.75 * 0.5 + 0.25 * 1.)) < 1e-9
+
 def test_sample_submission_instance():
     tag = 'kbp2016'
     submission_id = 1 # patterns
@@ -194,3 +607,34 @@ def test_sample_submission_entity():
 
     relation_mentions = db.select("""SELECT doc_id, subject, object FROM submission_sample WHERE batch_id=%(batch_id)s AND submission_id=%(submission_id)s""", batch_id=batch.id, submission_id=submission_id)
     assert len(relation_mentions) == 20
+
+def test_sample_submission_in_database():
+    tag = 'kbp2016'
+    submission_id = 1 # patterns
+
+    db.execute("""TRUNCATE sample_batch CASCADE;
+                   ALTER SEQUENCE sample_batch_id_seq RESTART;
+                   """)
+    batch_id = sample_submission(tag, submission_id, 'entity_relation', 20, in_database=True)
+
+    batch = db.get("""SELECT id, submission_id, distribution_type, corpus_tag, params FROM sample_batch""")
+    assert batch.id == batch_id
+    assert batch.params == {"submission_id": submission_id, "type":"entity_relation", "with_replacement": False}
+
+    relation_mentions = db.select("""SELECT doc_id, subject, object FROM submission_sample WHERE batch_id=%(batch_id)s AND submission_id=%(submission_id)s""", batch_id=batch.id, submission_id=submission_id)
+    assert len(relation_mentions) == 20
+
+def test_plan_fresh_samples():
+    assert plan_fresh_samples(500, 0.) == 500
+    assert plan_fresh_samples(500, 0.5) == 125
+    assert plan_fresh_samples(500, 1.) == 0
+
+def test_reuse_weights():
+    census_weights, fresh_weight = reuse_weights([0.3, 0.2], 3)
+    assert np.allclose(census_weights, [1.5, 1.]) and abs(fresh_weight - 5 * 0.5 / 3) < 1e-9
+    # The weighted mean of f(x) over the batch is the census precision
+    # plus the fresh estimate of the rest.
+    fxs = [1., 0.] + [1., 0., 0.]
+    p = (sum(w * fx for w, fx in zip(census_weights, fxs)) + fresh_weight * sum(fxs[2:])) / 5
+    assert abs(p - (0.3 + 0.5 / 3)) < 1e-9
+    assert reuse_weights([0.6, 0.4], 0)[1] == 0.
@@ -4,10 +4,16 @@
 Database schema as namedtuples
 """
 import re
+import sys
+from functools import lru_cache
 from collections import namedtuple
 
+_PROVENANCE_RE = re.compile(r"([A-Za-z0-9_.]+):([0-9]+)-([0-9]+)")
+
 _Provenance = namedtuple("Provenance", ["doc_id", "begin", "end"])
 class Provenance(_Provenance):
+    __slots__ = ()
+
     def __new__(cls, doc_id, begin, end):
         assert begin <= end, "Invalid span, expected begin {} <= end {} for provenance {}:{}-{}".format(begin, end, doc_id, begin, end)
         return super(Provenance, cls).__new__(cls, doc_id, begin, end)
@@ -19,11 +25,52 @@ class Provenance(_Provenance):
     def from_str(cls, prov, inclusive=False):
         if len(prov) == 0:
             return None
-        doc_id, beg, end =  re.match(r"([A-Za-z0-9_.]+):([0-9]+)-([0-9]+)", prov).groups()
-        beg, end = int(beg), int(end)
-        if inclusive:
-            end += 1
-        return cls(doc_id, beg, end)
+        return _parse_provenance(prov, inclusive)
+
+# Mention ids repeat across the types, canonical_mention, link and
+# relation rows of a file, so recently parsed strings are cached;
+# Provenances are immutable and safe to share.
+@lru_cache(maxsize=1 << 16)
+def _parse_provenance(prov, inclusive):
+    doc_id, beg, end = _PROVENANCE_RE.match(prov).groups()
+    beg, end = int(beg), int(end)
+    if inclusive:
+        end += 1
+    assert beg <= end, "Invalid span, expected begin {} <= end {} for provenance {}:{}-{}".format(beg, end, doc_id, beg, end)
+    return tuple.__new__(Provenance, (sys.intern(doc_id), beg, end))
+
+class ProvenanceIndex(object):
+    """
+    Decodes provenance strings into compact (doc_idx, begin, end)
+    integer triples, interning doc_ids into doc_idx; this is how the
+    tables read by MFileReader and TacKbReader are stored as columns
+    (see columns.ColumnWriter).
+    """
+    def __init__(self):
+        self.doc_ids = []
+        self._index = {}
+
+    def doc_idx(self, doc_id):
+        ix = self._index.get(doc_id)
+        if ix is None:
+            ix = self._index[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+        return ix
+
+    def decode(self, prov, inclusive=False):
+        if len(prov) == 0:
+            return None
+        return self.encode(_parse_provenance(prov, inclusive))
+
+    def encode(self, prov):
+        """
+        Converts an already parsed Provenance into a triple.
+        """
+        return (self.doc_idx(prov.doc_id), prov.begin, prov.end)
+
+    def provenance(self, triple):
+        doc_idx, begin, end = triple
+        return Provenance(self.doc_ids[doc_idx], begin, end)
 
 MentionInstance = namedtuple("MentionInstance", ["doc_id", "span", "canonical_span", "mention_type", "gloss", "weight"])
 LinkInstance = namedtuple("LinkInstance", ["doc_id", "span", "link_name", "correct", "weight"])
@@ -68,3 +115,25 @@ Score = namedtuple('Score', [
     'p_left', 'r_left', 'f1_left',
     'p_right', 'r_right', 'f1_right',
     ])
+
+def test_provenance_from_str():
+    prov = Provenance.from_str("NYT_ENG_20131231.0001:10-20")
+    assert prov == Provenance("NYT_ENG_20131231.0001", 10, 20)
+    assert isinstance(prov, Provenance) and str(prov) == "NYT_ENG_20131231.0001:10-20"
+    assert Provenance.from_str("doc:10-20", inclusive=True) == Provenance("doc", 10, 21)
+    assert Provenance.from_str("") is None
+    assert Provenance.from_str("doc:10-20") is Provenance.from_str("doc:10-20")
+    try:
+        Provenance.from_str("doc:20-10")
+        assert False, "Expected an invalid span"
+    except AssertionError as e:
+        assert "Invalid span" in str(e)
+
+def test_provenance_index():
+    index = ProvenanceIndex()
+    assert index.decode("doc1:10-20") == (0, 10, 20)
+    assert index.decode("doc2:0-4", inclusive=True) == (1, 0, 5)
+    assert index.decode("doc1:1-2") == (0, 1, 2)
+    assert index.doc_ids == ["doc1", "doc2"]
+    assert index.provenance((1, 0, 5)) == Provenance("doc2", 0, 5)
+    assert index.encode(Provenance("doc3", 1, 2)) == (2, 1, 2)
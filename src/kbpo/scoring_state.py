@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+r"""
+Sufficient statistics for joint scoring that can be updated one
+submission at a time and persisted between scoring runs.
+
+With the unnormalized weights $c_{ij} = n_j (P P^T)_{ij}$ and proposals
+$\tilde{q}_i(x) = \sum_j c_{ij} p_j(x)$, the normalizers cancel out of
+the joint estimators:
+    $\pi_i = \sum_j K_{ij} S_{ij}$, with $S_{ij} = \sum_{x \in \Xh_j} p_i(x) f(x)/\tilde{q}_i(x)$,
+    $\nu_i = \sum_j K_{ij} N_{ij} / \sum_j K_{ij} D_{ij}$, with
+        $N_{ij} = \sum_{x \in \Xh_j} P_0(x) g_i(x)/\tilde{q}_i(x)$ and
+        $D_{ij} = \sum_{x \in \Xh_j} P_0(x) g(x)/\tilde{q}_i(x)$.
+When the samples of submission k change, S, N and D only change in
+column k, and in the rows i whose proposal uses k (K_{ik} > 0) if
+n_k or p_k changed; only those entries are recomputed.
+"""
+
+import os
+import logging
+from collections import defaultdict
+
+import numpy as np
+import scipy.sparse as sp
+
+from . import evaluation_matrix
+from .evaluation_matrix import _safe_divide, _f1
+from .instance_index import InstanceIndex
+
+logger = logging.getLogger(__name__)
+
+class ScoringState(object):
+    """
+    Per-system sufficient statistics of the joint estimators.
+        systems - the identifiers of the systems, in row order.
+        index - the InstanceIndex of the keys.
+        P - (m x n) CSR matrix of submission distributions over the interned keys.
+        samples - for every system, (key indices, f(x), importance weights)
+                  with NaN for unannotated samples.
+        K - (m x m) overlaps P P^T.
+        S, N, D - (m x m) partial sums for pi_ij, nu_ij and Z_ij.
+        y0, G - key indices of Y0 and the (m x |Y0|) labels g_i(x).
+        version, versions - the versions of the data the statistics were
+                  computed from, for the corpus and for every system.
+    """
+    def __init__(self, P0=None):
+        # P0 defaults to the uniform (unnormalized) distribution.
+        self.P0 = P0
+        self.systems = []
+        self.index = InstanceIndex()
+        self.p0 = np.zeros(0)
+        self.P = sp.csr_matrix((0, 0))
+        self.samples = []
+        self.Ns = np.zeros(0)
+        self.K = np.zeros((0, 0))
+        self.S, self.N, self.D = np.zeros((0, 0)), np.zeros((0, 0)), np.zeros((0, 0))
+        self.y0 = np.zeros(0, dtype=np.int64)
+        self.G = np.zeros((0, 0))
+        self.version = None
+        self.versions = {}
+
+    def __len__(self):
+        return len(self.systems)
+
+    @property
+    def keys(self):
+        return self.index.keys()
+
+    def _intern(self, xs):
+        return self.index.intern_many(xs).astype(np.int64)
+
+    def _sync_p0(self):
+        """
+        Extends p0 to keys interned since the last call.
+        """
+        n = len(self.p0)
+        if len(self.index) > n:
+            new = np.ones(len(self.index) - n) if self.P0 is None else [self.P0[x] for x in self.index.keys(np.arange(n, len(self.index)))]
+            self.p0 = np.concatenate([self.p0, new])
+
+    def _set_row(self, k, indices, data):
+        """
+        Sets row k of P (appending a row if k == m), resizing to all interned keys.
+        """
+        rows = [(self.P.indices[self.P.indptr[i]:self.P.indptr[i+1]], self.P.data[self.P.indptr[i]:self.P.indptr[i+1]]) for i in range(self.P.shape[0])]
+        if k == len(rows):
+            rows.append(None)
+        rows[k] = (indices, data)
+        indptr = np.cumsum([0] + [len(ixs) for ixs, _ in rows])
+        self.P = sp.csr_matrix((
+            np.concatenate([vs for _, vs in rows]).astype(np.float64),
+            np.concatenate([ixs for ixs, _ in rows]).astype(np.int64),
+            indptr), shape=(len(rows), len(self.index)))
+
+    def _grow(self):
+        """
+        Adds an empty row and column to every (m x m) statistic.
+        """
+        m = len(self.systems)
+        for name in ["K", "S", "N", "D"]:
+            X = np.zeros((m + 1, m + 1))
+            X[:m, :m] = getattr(self, name)
+            setattr(self, name, X)
+        self.Ns = np.append(self.Ns, 0.)
+        self.samples.append((np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)))
+        if len(self.y0) > 0:
+            self.G = np.vstack([self.G, np.full((1, len(self.y0)), np.nan)])
+
+    def _compute(self, rows, systems):
+        """
+        Recomputes S, N and D for @rows and the samples of @systems.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0 or len(systems) == 0:
+            return
+        ixs = np.unique(np.concatenate([self.samples[j][0] for j in systems]))
+        P = self.P[:, ixs].toarray()
+        Q = (self.K[rows] * self.Ns).dot(P)
+        R = _safe_divide(P[rows], Q)
+        U = _safe_divide(self.p0[ixs], Q)
+        SU = _support(self.P[rows], ixs) * U
+        for j in systems:
+            ixs_j, fxs, ws = self.samples[j]
+            valid = ~np.isnan(fxs)
+            pos, fx, w = np.searchsorted(ixs, ixs_j[valid]), fxs[valid], ws[valid]
+            gx = w * (fx > 0.)
+            self.S[rows, j] = R[:, pos].dot(w * fx)
+            self.N[rows, j] = SU[:, pos].dot(gx)
+            self.D[rows, j] = U[:, pos].dot(gx)
+
+    def update(self, system, P, Xh, Y0=None, Wh=None):
+        """
+        Adds or replaces @system with distribution @P (a Counter),
+        samples @Xh (a list of [x, f(x)]) and optionally @Y0 (a list of
+        [x, g(x)] aligned with the Y0 of the other systems) and the
+        importance weights @Wh of the samples (see distribution.Xh).
+        Only the statistics that depend on @system are recomputed.
+        """
+        P = (self._intern(list(P.keys())), np.array(list(P.values()), dtype=np.float64))
+        Xh = (self._intern([x for x, _ in Xh]), np.array([np.nan if fx is None else fx for _, fx in Xh], dtype=np.float64))
+        if Y0 is not None:
+            Y0 = (self._intern([x for x, _ in Y0]), np.array([np.nan if gx is None else gx for _, gx in Y0], dtype=np.float64))
+        self.update_arrays(system, P, Xh, Y0, Wh)
+
+    def update_arrays(self, system, P, Xh, Y0=None, Wh=None):
+        """
+        Like update, but @P, @Xh and @Y0 are (ids, values) arrays over
+        self.index, e.g. from the distribution loaders with index=self.index,
+        and @Wh an array aligned with @Xh.
+        """
+        self._sync_p0()
+        indices, data = np.asarray(P[0], dtype=np.int64), np.asarray(P[1], dtype=np.float64)
+        ixs, fxs = np.asarray(Xh[0], dtype=np.int64), np.asarray(Xh[1], dtype=np.float64)
+        ws = np.ones(len(fxs)) if Wh is None else np.asarray(Wh, dtype=np.float64)
+
+        if system in self.systems:
+            k = self.systems.index(system)
+            old_row = self.P[k]
+            old_K, old_n = self.K[k].copy(), self.Ns[k]
+        else:
+            k = len(self.systems)
+            self._grow()
+            self.systems.append(system)
+            old_row, old_K, old_n = None, np.zeros(k + 1), 0.
+        self._set_row(k, indices, data)
+        self.samples[k] = (ixs, fxs, ws)
+        self.Ns[k] = np.sum(~np.isnan(fxs))
+
+        w = self.P.dot(self.P[k].T).toarray().ravel()
+        self.K[k, :] = w
+        self.K[:, k] = w
+
+        # The proposal of i uses k iff K_ik > 0: those rows change if
+        # the weight n_k or the distribution p_k did.
+        changed = old_row is None or old_n != self.Ns[k] or (old_row != self.P[k]).nnz > 0
+        if changed:
+            rows = np.union1d(np.nonzero(w)[0], np.nonzero(old_K)[0])
+            rows = np.union1d(rows, [k])
+        else:
+            rows = np.array([k])
+        logger.debug("Recomputing %d rows and 1 column for system %s", len(rows), system)
+        self._compute(rows, list(range(len(self.systems))))
+        self._compute(np.setdiff1d(np.arange(len(self.systems)), rows), [k])
+
+        if Y0 is not None:
+            self.update_y0_arrays(k, Y0)
+
+    def update_y0(self, k, Y0):
+        """
+        Sets the Y0 labels of system k; if Y0 covers different instances
+        than before, every other system's labels are reset and have to
+        be provided again.
+        """
+        self.update_y0_arrays(k, (self._intern([x for x, _ in Y0]), [np.nan if gx is None else gx for _, gx in Y0]))
+
+    def update_y0_arrays(self, k, Y0):
+        """
+        Like update_y0, but @Y0 is an (ids, g(x)) pair of arrays over self.index.
+        """
+        self._sync_p0()
+        y0 = np.asarray(Y0[0], dtype=np.int64)
+        if not np.array_equal(y0, self.y0):
+            if len(self.y0) > 0:
+                logger.warning("Y0 has changed; resetting the Y0 of every system")
+            self.y0 = y0
+            self.G = np.full((len(self.systems), len(y0)), np.nan)
+        self.G[k] = np.asarray(Y0[1], dtype=np.float64)
+
+    def _weights(self):
+        C = self.K * self.Ns
+        return _safe_divide(C, C.sum(1)[:, None])
+
+    def scores(self):
+        """
+        @returns: the joint precision, recall and F1 of every system.
+        """
+        ps = (self.K * self.S).sum(1)
+        nus = _safe_divide((self.K * self.N).sum(1), (self.K * self.D).sum(1))
+        theta = evaluation_matrix.pool_recall_(self.p0[self.y0], self.G) if len(self.y0) > 0 else 0.
+        rs = theta * nus
+        return ps, rs, _f1(ps, rs)
+
+    def scores_with_intervals(self, num_epochs=100, interval=90, seed=None, workers=1):
+        """
+        Bootstraps the joint scores from the cached arrays (see evaluation_matrix.joint_bootstrap).
+        """
+        W = self._weights()
+        cols = np.unique(np.concatenate([ixs for ixs, _, _ in self.samples]))
+        samples = [(np.searchsorted(cols, ixs), fxs, ws) for ixs, fxs, ws in self.samples]
+        ratios = evaluation_matrix.proposal_ratios(W, self.P[:, cols], self.p0[cols])
+        return evaluation_matrix.joint_bootstrap(samples, W, ratios, self.p0[self.y0], self.G, num_epochs, interval, seed, workers)
+
+    def save(self, path):
+        """
+        Saves the state to @path (a .npz file).
+        """
+        offsets = np.cumsum([0] + [len(ixs) for ixs, _, _ in self.samples])
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp,
+            systems=np.array(self.systems),
+            **self.index.to_arrays(),
+            p0=self.p0,
+            P_data=self.P.data, P_indices=self.P.indices, P_indptr=self.P.indptr,
+            sample_ixs=np.concatenate([ixs for ixs, _, _ in self.samples]) if self.samples else np.zeros(0, dtype=np.int64),
+            sample_fxs=np.concatenate([fxs for _, fxs, _ in self.samples]) if self.samples else np.zeros(0),
+            sample_ws=np.concatenate([ws for _, _, ws in self.samples]) if self.samples else np.zeros(0),
+            sample_offsets=offsets,
+            Ns=self.Ns, K=self.K, S=self.S, N=self.N, D=self.D,
+            y0=self.y0, G=self.G,
+            version=np.array(self.version or ""),
+            version_systems=np.array(list(self.versions)), version_values=np.array(list(self.versions.values())))
+        # Replace atomically so that readers never see a partial file.
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, P0=None):
+        state = cls(P0)
+        with np.load(path) as data:
+            state.systems = data["systems"].tolist()
+            state.index = InstanceIndex.from_arrays(data["doc_ids"], data["instances"])
+            state.p0 = data["p0"]
+            state.P = sp.csr_matrix((data["P_data"], data["P_indices"], data["P_indptr"]), shape=(len(state.systems), len(state.index)))
+            offsets = data["sample_offsets"]
+            # States saved before samples were weighted are unweighted.
+            ws = data["sample_ws"] if "sample_ws" in data.files else np.ones(len(data["sample_fxs"]))
+            state.samples = [(data["sample_ixs"][offsets[i]:offsets[i+1]], data["sample_fxs"][offsets[i]:offsets[i+1]], ws[offsets[i]:offsets[i+1]]) for i in range(len(state.systems))]
+            for name in ["Ns", "K", "S", "N", "D", "y0", "G"]:
+                setattr(state, name, data[name])
+            # States saved without versions are never current.
+            if "version" in data.files:
+                state.version = str(data["version"]) or None
+                state.versions = dict(zip(data["version_systems"].tolist(), data["version_values"].tolist()))
+        return state
+
+def _support(P, cols):
+    """
+    Returns the dense indicator of the (structural) support of P on @cols.
+    """
+    S = sp.csr_matrix((np.ones(len(P.data)), P.indices, P.indptr), shape=P.shape)
+    return S[:, cols].toarray()
+
+def _test_data():
+    def key(x):
+        return ("doc{}".format(x // 10), (x, x+1), (x+2, x+3))
+    P = [
+        {key(0): 0.5, key(1): 0.5},
+        {key(1): 0.2, key(2): 0.8},
+        {key(3): 1.0},
+        ]
+    Xhs = [
+        [(key(0), 1.), (key(0), 0.), (key(1), None)],
+        [(key(2), 1.), (key(1), 1.)],
+        [(key(3), 0.)],
+        ]
+    Y0 = [
+        [(key(1), 1.), (key(4), 0.)],
+        [(key(1), 1.), (key(4), 0.)],
+        [(key(1), 0.), (key(4), 1.)],
+        ]
+    return P, Xhs, Y0
+
+def test_scoring_state():
+    P, Xhs, Y0 = _test_data()
+    P0 = defaultdict(lambda: 1.0)
+    state = ScoringState()
+    for i in range(3):
+        state.update(i, P[i], Xhs[i], Y0[i])
+    ps, rs, f1s = evaluation_matrix.joint_score(P0, P, Y0, Xhs)
+    ps_, rs_, f1s_ = state.scores()
+    assert np.allclose(ps, ps_)
+    assert np.allclose(rs, rs_)
+    assert np.allclose(f1s, f1s_)
+
+    # Update the samples of system 1.
+    Xhs[1] = Xhs[1] + [(Xhs[1][0][0], 0.)]
+    state.update(1, P[1], Xhs[1], Y0[1])
+    assert np.allclose(evaluation_matrix.joint_score(P0, P, Y0, Xhs), state.scores())
+
+def test_scoring_state_weights():
+    P, Xhs, Y0 = _test_data()
+    Whs = [[2., 0.5, 1.], [1., 3.], [1.]]
+    state = ScoringState()
+    for i in range(3):
+        state.update(i, P[i], Xhs[i], Y0[i], Whs[i])
+    assert np.allclose(evaluation_matrix.joint_score(defaultdict(lambda: 1.0), P, Y0, Xhs, Whs=Whs), state.scores())
+
+def test_scoring_state_save(tmpdir):
+    P, Xhs, Y0 = _test_data()
+    state = ScoringState()
+    for i in range(3):
+        state.update(i, P[i], Xhs[i], Y0[i])
+    path = str(tmpdir.join("state.npz"))
+    state.save(path)
+    assert ScoringState.load(path).version is None and ScoringState.load(path).versions == {}
+    state.version, state.versions = "v1", {0: "a", 1: "b", 2: "c"}
+    state.save(path)
+    state_ = ScoringState.load(path)
+    assert state_.systems == state.systems
+    assert state_.keys == state.keys
+    assert state_.version == "v1" and state_.versions == {0: "a", 1: "b", 2: "c"}
+    assert np.allclose(state_.scores(), state.scores())
+
+def test_scoring_state_update_arrays():
+    P, Xhs, Y0 = _test_data()
+    state = ScoringState()
+    for i in range(3):
+        state.update(i, P[i], Xhs[i], Y0[i])
+
+    state_ = ScoringState()
+    index = state_.index
+    for i in range(3):
+        P_ = (index.intern_many(list(P[i].keys())), np.array(list(P[i].values())))
+        Xh_ = (index.intern_many([x for x, _ in Xhs[i]]), np.array([np.nan if fx is None else fx for _, fx in Xhs[i]]))
+        Y0_ = (index.intern_many([x for x, _ in Y0[i]]), np.array([gx for _, gx in Y0[i]]))
+        state_.update_arrays(i, P_, Xh_, Y0_)
+    assert len(state_.p0) == len(index)
+    assert np.allclose(state_.scores(), state.scores())
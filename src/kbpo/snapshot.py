@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Versioned on-disk snapshots of the distributions and samples used to score a corpus.
+
+A snapshot holds, for every sampled submission, its distribution P,
+its samples Xh and its Y0 labels as (ids, values) arrays over an
+InstanceIndex. Snapshots are stored as uncompressed .npz files named
+after the corpus tag, the score type and a content version computed
+from the database, so that repeated scoring runs (and notebooks) only
+hit the database for that version check while nothing has changed.
+"""
+
+import os
+import logging
+import hashlib
+from collections import Counter
+
+import numpy as np
+
+from . import db
+from . import distribution as PD
+from .instance_index import InstanceIndex
+
+logger = logging.getLogger(__name__)
+
+DISTRIBUTIONS = {
+    "instance": PD.submission_instance,
+    "relation": PD.submission_relation,
+    "entity": PD.submission_entity,
+    "entity_relation": PD.submission_entity_relation,
+    }
+
+def snapshot_version(corpus_tag):
+    """
+    @returns: a short hash that changes whenever a submission on
+    @corpus_tag, its samples or the annotations change.
+
+    Annotations reach the distributions and samples through the
+    materialized views (see refresh), so the view refresh stamps catch
+    changes to existing annotations as well as new ones; the counts and
+    latest timestamps of the annotation tables catch changes whose
+    refresh is still pending.
+    """
+    row = db.get("""
+        SELECT
+            (SELECT COUNT(*) FROM submission WHERE corpus_tag = %(corpus_tag)s) AS submissions,
+            (SELECT MAX(updated) FROM submission WHERE corpus_tag = %(corpus_tag)s) AS submission_updated,
+            (SELECT MAX(id) FROM sample_batch WHERE corpus_tag = %(corpus_tag)s) AS sample_batch_id,
+            (SELECT COUNT(*) FROM submission_sample) AS submission_samples,
+            (SELECT MAX(created) FROM submission_sample) AS submission_sample_created,
+            (SELECT SUM(weight) FROM submission_sample) AS submission_sample_weight,
+            (SELECT COUNT(*) FROM evaluation_mention) AS evaluation_mentions,
+            (SELECT MAX(created) FROM evaluation_mention) AS evaluation_mention_created,
+            (SELECT COUNT(*) FROM evaluation_link) AS evaluation_links,
+            (SELECT MAX(created) FROM evaluation_link) AS evaluation_link_created,
+            (SELECT COUNT(*) FROM evaluation_relation) AS evaluation_relations,
+            (SELECT MAX(created) FROM evaluation_relation) AS evaluation_relation_created,
+            (SELECT string_agg(view_name || ':' || COALESCE(requested::text, '') || ':' || COALESCE(refreshed::text, ''), ',' ORDER BY view_name) FROM view_refresh) AS view_refreshes
+        """, corpus_tag=corpus_tag)
+    return hashlib.md5(repr(tuple(row)).encode("utf-8")).hexdigest()[:12]
+
+def _pack(pairs):
+    ids = np.concatenate([ids for ids, _ in pairs]) if pairs else np.zeros(0, dtype=np.int32)
+    values = np.concatenate([values for _, values in pairs]) if pairs else np.zeros(0)
+    offsets = np.cumsum([0] + [len(ids_) for ids_, _ in pairs])
+    return ids.astype(np.int32), values.astype(np.float64), offsets
+
+def _unpack(ids, values, offsets):
+    return [(ids[offsets[i]:offsets[i+1]], values[offsets[i]:offsets[i+1]]) for i in range(len(offsets)-1)]
+
+class Snapshot(object):
+    """
+    The distributions and samples of every sampled submission on a corpus.
+        systems - submission ids, in order.
+        Ps, Xhs, Y0 - lists of (ids, values) arrays over index, one per system;
+                      values are NaN for unannotated samples.
+        Whs - the importance weights of Xhs, one array per system.
+    """
+    def __init__(self, corpus_tag, score_type, version, index, systems, Ps, Xhs, Y0, Whs=None):
+        self.corpus_tag = corpus_tag
+        self.score_type = score_type
+        self.version = version
+        self.index = index
+        self.systems = systems
+        self.Ps = Ps
+        self.Xhs = Xhs
+        self.Y0 = Y0
+        self.Whs = Whs if Whs is not None else [np.ones(len(ids)) for ids, _ in Xhs]
+
+    def __len__(self):
+        return len(self.systems)
+
+    @classmethod
+    def build(cls, corpus_tag, score_type="entity_relation", version=None):
+        """
+        Reads the snapshot from the database.
+        """
+        if score_type not in DISTRIBUTIONS:
+            raise ValueError("Invalid distribution type {}".format(score_type))
+        index = InstanceIndex()
+        empty = (np.zeros(0, dtype=np.int32), np.zeros(0))
+        Ps_ = DISTRIBUTIONS[score_type](corpus_tag, index=index)
+        Y0_ = PD.Y0(corpus_tag, index=index)
+        Xhs_, Whs_ = PD.Xh(corpus_tag, score_type, index=index, weights=True)
+        systems, Ps, Xhs, Y0, Whs = [], [], [], [], []
+        for submission_id, Xh in sorted(Xhs_.items()):
+            systems.append(submission_id)
+            Ps.append(Ps_.get(submission_id, empty))
+            Xhs.append(Xh)
+            Y0.append(Y0_.get(submission_id, empty))
+            Whs.append(Whs_[submission_id])
+        return cls(corpus_tag, score_type, version, index, systems, Ps, Xhs, Y0, Whs)
+
+    def counters(self):
+        """
+        @returns: P, Xhs and Y0 as Counters and lists of [x, f(x)], as
+        expected by the estimators in evaluation and evaluation_matrix.
+        """
+        def _value(v):
+            return None if np.isnan(v) else v
+        keys = self.index.keys()
+        Ps = [Counter(dict(zip((keys[ix] for ix in ids.tolist()), probs.tolist()))) for ids, probs in self.Ps]
+        Xhs = [[(keys[ix], _value(fx)) for ix, fx in zip(ids.tolist(), fxs.tolist())] for ids, fxs in self.Xhs]
+        Y0 = [[(keys[ix], _value(gx)) for ix, gx in zip(ids.tolist(), gxs.tolist())] for ids, gxs in self.Y0]
+        return Ps, Xhs, Y0
+
+    def weights(self):
+        """
+        @returns: the importance weights of the samples, aligned with the Xhs of counters().
+        """
+        return [ws.tolist() for ws in self.Whs]
+
+    def save(self, path):
+        arrays = self.index.to_arrays()
+        for name in ["Ps", "Xhs", "Y0"]:
+            ids, values, offsets = _pack(getattr(self, name))
+            arrays[name + "_ids"], arrays[name + "_values"], arrays[name + "_offsets"] = ids, values, offsets
+        arrays["Whs_values"] = np.concatenate(self.Whs) if self.Whs else np.zeros(0)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp,
+                 corpus_tag=np.array(self.corpus_tag),
+                 score_type=np.array(self.score_type),
+                 version=np.array(self.version or ""),
+                 systems=np.array(self.systems, dtype=np.int64),
+                 **arrays)
+        # Replace atomically so that concurrent readers never see a partial file.
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = InstanceIndex.from_arrays(data["doc_ids"], data["instances"])
+            pairs = {name: _unpack(data[name + "_ids"], data[name + "_values"], data[name + "_offsets"]) for name in ["Ps", "Xhs", "Y0"]}
+            Whs = [ws for _, ws in _unpack(data["Xhs_ids"], data["Whs_values"], data["Xhs_offsets"])] if "Whs_values" in data.files else None
+            return cls(str(data["corpus_tag"]), str(data["score_type"]), str(data["version"]) or None, index,
+                       data["systems"].tolist(), pairs["Ps"], pairs["Xhs"], pairs["Y0"], Whs)
+
+def snapshot_path(cache_dir, corpus_tag, score_type, version):
+    return os.path.join(cache_dir, "{}-{}-{}.npz".format(corpus_tag, score_type, version))
+
+def load_snapshot(corpus_tag, score_type="entity_relation", cache_dir=None):
+    """
+    Returns the current Snapshot of @corpus_tag, reusing the copy in
+    @cache_dir if its version is still current. Without a @cache_dir,
+    the snapshot is always read from the database.
+    """
+    if cache_dir is None:
+        return Snapshot.build(corpus_tag, score_type)
+
+    version = snapshot_version(corpus_tag)
+    path = snapshot_path(cache_dir, corpus_tag, score_type, version)
+    if os.path.exists(path):
+        logger.info("Using snapshot %s", path)
+        return Snapshot.load(path)
+
+    logger.info("Building snapshot %s", path)
+    snapshot = Snapshot.build(corpus_tag, score_type, version)
+    os.makedirs(cache_dir, exist_ok=True)
+    snapshot.save(path)
+    # Older versions will never be read again.
+    prefix = "{}-{}-".format(corpus_tag, score_type)
+    for fname in os.listdir(cache_dir):
+        if fname.startswith(prefix) and fname.endswith(".npz") and os.path.join(cache_dir, fname) != path:
+            os.remove(os.path.join(cache_dir, fname))
+    return snapshot
+
+def test_snapshot_save(tmpdir):
+    index = InstanceIndex()
+    xs = [("doc1", (0, 1), (2, 3)), ("doc1", (4, 5), (6, 7)), ("doc2", (0, 1), (2, 3))]
+    ids = index.intern_many(xs)
+    Ps = [(ids[:2], np.array([0.5, 0.5])), (ids[1:], np.array([0.2, 0.8]))]
+    Xhs = [(ids[[0, 0]], np.array([1., np.nan])), (ids[[2]], np.array([0.]))]
+    Y0 = [(ids[[1]], np.array([1.])), (ids[[1]], np.array([0.]))]
+    Whs = [np.array([1., 2.]), np.array([0.5])]
+    snapshot = Snapshot("kbp2016", "entity_relation", "v1", index, [3, 7], Ps, Xhs, Y0, Whs)
+
+    path = str(tmpdir.join("snapshot.npz"))
+    snapshot.save(path)
+    snapshot_ = Snapshot.load(path)
+    assert (snapshot_.corpus_tag, snapshot_.score_type, snapshot_.version, snapshot_.systems) == ("kbp2016", "entity_relation", "v1", [3, 7])
+    assert snapshot_.index.keys() == xs
+
+    Ps_, Xhs_, Y0_ = snapshot_.counters()
+    assert Ps_ == [{xs[0]: 0.5, xs[1]: 0.5}, {xs[1]: 0.2, xs[2]: 0.8}]
+    assert Xhs_ == [[(xs[0], 1.), (xs[0], None)], [(xs[2], 0.)]]
+    assert Y0_ == [[(xs[1], 1.)], [(xs[1], 0.)]]
+    assert snapshot_.weights() == [[1., 2.], [0.5]]
@@ -9,10 +9,14 @@ import logging
 import numpy as np
 
 from . import counter_utils
-from .evaluation import simple_precision, simple_recall,\
-        joint_precision, pooled_recall, pool_recall, joint_recall,\
+from . import evaluation_matrix
+from .evaluation import simple_precision, simple_recall, simple_score,\
+        joint_precision, pooled_recall, pool_recall, joint_recall, joint_score,\
+        compute_weights, update_weights,\
+        construct_proposal_distribution, update_proposal_distribution,\
         compute_variance, estimate_variance, estimate_n_samples
 from .sample_util import sample_with_replacement, sample_without_replacement
+from .scoring_state import ScoringState
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -111,6 +115,17 @@ def test_simple_recall():
     recall_ = simple_recall(U, [Y0])[0]
     assert np.allclose(recall, recall_, atol=5e-2)
 
+def test_recall_without_annotations():
+    # As before the accumulators, recall is undefined without annotations.
+    U = Counter({"a": 1., "b": 1.})
+    for recall, P0 in [(simple_recall, U), (pool_recall, Counter())]:
+        try:
+            recall(P0, [[("a", None), ("b", None)]])
+            assert False, "Expected a ZeroDivisionError"
+        except ZeroDivisionError:
+            pass
+    assert simple_precision([[("a", None)]]) == [0.]
+
 def test_joint_precision_wr():
     np.random.seed(42)
     n_samples = 10000
@@ -288,3 +303,200 @@ def test_estimate_n():
             Xhs_ = Xhs_i[:l]
             n = estimate_n_samples(Ps_, Xhs_)
             logger.info("%d %d %d", i, l, n)
+
+def test_matrix_joint_score():
+    np.random.seed(42)
+    n_samples = 500
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    U = true_sample_distribution(population_size)
+    Xhs = [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps, Xs)]
+    # Leave some samples unannotated.
+    Xhs = [[(x, None) if k % 7 == 0 else (x, fx) for k, (x, fx) in enumerate(Xh)] for Xh in Xhs]
+    Y0 = [[(x, 1.0 if x in P and P[x] > 0 else 0.) for x, _ in generate_true_sample(n_samples, population_size)] for P in Ps]
+
+    assert np.allclose(joint_precision(Ps, Xhs), evaluation_matrix.joint_precision(Ps, Xhs))
+    assert np.allclose(pooled_recall(U, Ps, Xhs), evaluation_matrix.pooled_recall(U, Ps, Xhs))
+    assert np.allclose(pool_recall(U, Y0), evaluation_matrix.pool_recall(U, Y0))
+    assert np.allclose(joint_score(U, Ps, Y0, Xhs), evaluation_matrix.joint_score(U, Ps, Y0, Xhs))
+    assert np.allclose(simple_score(U, Ps, Y0, Xhs), evaluation_matrix.simple_score(U, Ps, Y0, Xhs))
+
+def test_weighted_samples():
+    np.random.seed(42)
+    n_samples = 2000
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    U = true_sample_distribution(population_size)
+    Y0 = [[(x, 1.0 if x in P and P[x] > 0 else 0.) for x, _ in generate_true_sample(n_samples, population_size)] for P in Ps]
+
+    # Draw system 0 from a proposal that favors correct instances and
+    # correct for it with the importance weights p(x)/r(x).
+    fx = dict(Xs[0])
+    R = counter_utils.normalize(Counter({x: p * (4. if fx[x] > 0 else 1.) for x, p in Ps[0].items()}))
+    Xhs = [sample_with_replacement(R, n_samples, X=Xs[0])] + [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps[1:], Xs[1:])]
+    Whs = [[Ps[0][x]/R[x] for x, _ in Xhs[0]]] + [[1.] * len(Xh) for Xh in Xhs[1:]]
+
+    assert simple_precision(Xhs)[0] > 0.7
+    assert np.allclose(simple_precision(Xhs, Whs)[0], precisions[0], atol=5e-2)
+    assert np.allclose(joint_precision(Ps, Xhs, Whs=Whs), precisions, atol=5e-2)
+
+    assert np.allclose(joint_score(U, Ps, Y0, Xhs, Whs=Whs), evaluation_matrix.joint_score(U, Ps, Y0, Xhs, Whs=Whs))
+    assert np.allclose(simple_score(U, Ps, Y0, Xhs, Whs), evaluation_matrix.simple_score(U, Ps, Y0, Xhs, Whs))
+    scores = evaluation_matrix.joint_score_with_intervals(U, Ps, Y0, Xhs, num_epochs=100, seed=7, Whs=Whs)
+    assert np.allclose([s.p for s in scores], joint_precision(Ps, Xhs, Whs=Whs))
+
+def test_matrix_score_with_intervals():
+    np.random.seed(42)
+    n_samples = 500
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    U = true_sample_distribution(population_size)
+    Xhs = [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps, Xs)]
+    Y = generate_true_sample(n_samples, population_size)
+    Y0 = [[(x, 1.0 if x in P and P[x] > 0 else 0.) for x, _ in Y] for P in Ps]
+
+    for score_fn, score_with_intervals_fn in [
+            (joint_score, evaluation_matrix.joint_score_with_intervals),
+            (simple_score, evaluation_matrix.simple_score_with_intervals),]:
+        scores = score_with_intervals_fn(U, Ps, Y0, Xhs, num_epochs=200)
+        ps, rs, f1s = score_fn(U, Ps, Y0, Xhs)
+        assert np.allclose([s.p for s in scores], ps)
+        assert np.allclose([s.r for s in scores], rs)
+        assert np.allclose([s.f1 for s in scores], f1s)
+        for s in scores:
+            assert s.p_left <= s.p <= s.p_right
+            assert s.r_left <= s.r <= s.r_right
+            assert s.p_right - s.p_left < 0.1
+
+def test_matrix_score_with_intervals_workers():
+    np.random.seed(42)
+    n_samples = 200
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    U = true_sample_distribution(population_size)
+    Xhs = [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps, Xs)]
+    Y = generate_true_sample(n_samples, population_size)
+    Y0 = [[(x, 1.0 if x in P and P[x] > 0 else 0.) for x, _ in Y] for P in Ps]
+
+    # Intervals are reproducible for a seed, regardless of the number of workers.
+    scores = evaluation_matrix.joint_score_with_intervals(U, Ps, Y0, Xhs, num_epochs=120, seed=7)
+    scores_ = evaluation_matrix.joint_score_with_intervals(U, Ps, Y0, Xhs, num_epochs=120, seed=7, workers=3)
+    assert np.array_equal(np.array(scores), np.array(scores_))
+
+    scores = evaluation_matrix.simple_score_with_intervals(U, Ps, Y0, Xhs, num_epochs=120, seed=7)
+    scores_ = evaluation_matrix.simple_score_with_intervals(U, Ps, Y0, Xhs, num_epochs=120, seed=7, workers=2)
+    assert np.array_equal(np.array(scores), np.array(scores_))
+
+def test_matrix_compute_weights():
+    cases = [[
+        {'a': 1.0, 'b': 0.0, 'c': 0.0},
+        {'a': 0.0, 'b': 1.0, 'c': 0.0},
+        {'a': 0.0, 'b': 0.0, 'c': 1.0},
+        ], [
+        {'a': 0.3, 'b': 0.5, 'c': 0.2},
+        {'a': 0.2, 'b': 0.2, 'c': 0.6},
+        {'a': 0.1, 'b': 0.6, 'c': 0.3},
+        ]]
+    Xhs = [
+        [('a',0.) for _ in range(10)],
+        [('b',0.) for _ in range(50)],
+        [('c',0.) for _ in range(100)],
+        ]
+    for P in cases:
+        data = evaluation_matrix.ScoringMatrices(P, Xhs)
+        for method in ["uniform", "heuristic", "size"]:
+            W, Z = evaluation_matrix.compute_weights(data.P, data.Ns, method)
+            W_, Z_ = compute_weights(P, Xhs, method)
+            assert np.allclose(W, W_)
+            assert np.allclose(Z, Z_)
+
+def test_matrix_construct_proposal_distribution():
+    np.random.seed(42)
+    population_size, precisions, recalls = 1000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    Xhs = [sample_with_replacement(P, 100, X=X) for P, X in zip(Ps, Xs)]
+
+    W, _ = compute_weights(Ps, Xhs)
+    Q = construct_proposal_distribution(W, Ps)
+    data = evaluation_matrix.ScoringMatrices(Ps, Xhs)
+    Q_ = evaluation_matrix.construct_proposal_distribution(W, data.P).toarray()
+    for i, q in enumerate(Q):
+        assert np.allclose([q[x] for x in data.keys], Q_[i])
+
+def test_matrix_variance_curve():
+    np.random.seed(42)
+    n_samples = 500
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    Xhs = [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps, Xs)]
+
+    # The closed form matches estimate_variance with the updated weights.
+    Xhs_ = Xhs[:2]
+    W, Z = compute_weights(Ps[:2], Xhs_)
+    Q = construct_proposal_distribution(W, Ps[:2])
+    ns = [1, 50, 300]
+    variances = evaluation_matrix.variance_curve(Ps, Xhs_, ns)
+    for n, variance_ in zip(ns, variances):
+        Xhs_n = Xhs_ + [[(None, 1) for _ in range(n)]]
+        W_, Z_ = update_weights(Ps, Xhs_n, W, Z)
+        Q_ = update_proposal_distribution(W_, Z_, Ps, Q, Z)
+        variance = estimate_variance(Ps, Xhs_n, Ws=W_, Qs=Q_)
+        assert np.allclose(variance, variance_)
+
+    n, variances = evaluation_matrix.plan_n_samples(Ps, Xhs_, target=n_samples)
+    assert 0 < n <= n_samples
+    assert variances[n-1] <= 1./n_samples
+    assert n == 1 or variances[n-2] > 1./n_samples
+
+def test_matrix_variance_curve_overlap():
+    np.random.seed(42)
+    n_samples = 200
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7], [0.2, 0.1, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    Xhs = [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps[:2], Xs[:2])]
+    Xhs[0][:10] = [(x, None) for x, _ in Xhs[0][:10]]
+
+    # Keeping only the overlap with the new system, and putting the
+    # rest of the mass and samples on None, leaves the curve unchanged
+    # (see distribution.overlapping_distributions).
+    support = set(x for x, p in Ps[2].items() if p > 0)
+    Ps_ = [Counter({x: p for x, p in P.items() if x in support}) for P in Ps[:2]]
+    for P, P_ in zip(Ps[:2], Ps_):
+        P_[None] = sum(P.values()) - sum(P_.values())
+    Xhs_ = [[(x if x in support else None, fx) for x, fx in Xh] for Xh in Xhs]
+    ns = [1, 50, 300]
+    assert np.allclose(evaluation_matrix.variance_curve(Ps, Xhs, ns), evaluation_matrix.variance_curve(Ps_ + [Ps[2]], Xhs_, ns))
+
+def test_scoring_state_incremental():
+    # ScoringState interns relation instance keys.
+    def key(x):
+        return ("doc{}".format(x // 100), (x, x+1), (x+2, x+3))
+
+    np.random.seed(42)
+    n_samples = 200
+    population_size, precisions, recalls = 10000, [0.5, 0.3, 0.7, 0.6], [0.2, 0.1, 0.3, 0.3]
+    Ps, Xs = generate_submission_set(precisions, recalls, population_size)
+    Ps = [Counter({key(x): v for x, v in P.items()}) for P in Ps]
+    Xs = [[(key(x), fx) for x, fx in X] for X in Xs]
+    U = Counter({key(x): v for x, v in true_sample_distribution(population_size).items()})
+    Xhs = [sample_with_replacement(P, n_samples, X=X) for P, X in zip(Ps, Xs)]
+    Y = [(key(x), fx) for x, fx in generate_true_sample(n_samples, population_size)]
+    Y0 = [[(x, 1.0 if x in P and P[x] > 0 else 0.) for x, _ in Y] for P in Ps]
+
+    state = ScoringState(U)
+    for i in range(len(Ps)):
+        state.update(i, Ps[i], Xhs[i], Y0[i])
+        assert np.allclose(evaluation_matrix.joint_score(U, Ps[:i+1], Y0[:i+1], Xhs[:i+1]), state.scores())
+
+    # New annotations for one system only touch its column.
+    Xhs[1] = sample_with_replacement(Ps[1], n_samples, X=Xs[1])
+    state.update(1, Ps[1], Xhs[1], Y0[1])
+    assert np.allclose(evaluation_matrix.joint_score(U, Ps, Y0, Xhs), state.scores())
+
+    # More samples for one system change every overlapping proposal.
+    Xhs[2] = Xhs[2] + sample_with_replacement(Ps[2], n_samples, X=Xs[2])
+    state.update(2, Ps[2], Xhs[2], Y0[2])
+    assert np.allclose(evaluation_matrix.joint_score(U, Ps, Y0, Xhs), state.scores())
+
+    scores = state.scores_with_intervals(num_epochs=50, seed=1)
+    assert np.allclose([s.p for s in scores], state.scores()[0])
@@ -262,50 +262,49 @@ def create_batch(conn, question_batch_id, batch_type, questions):
     assert batch_type in _MTURK_PARAMS, "Invalid batch type {}".format(batch_type)
     params = _MTURK_PARAMS[batch_type]
 
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            db.execute("""
-                INSERT INTO mturk_batch (params, description)
-                VALUES (%(params)s, %(description)s) RETURNING id
-                """, cur=cur, params=db.Json(params), description="")
-            mturk_batch_id = cur.fetchone()[0]
-            logger.debug("Creating new mturk_batch with id: %s", mturk_batch_id)
-
-            for question in tqdm(questions, desc="Uploading HITs"):
-                # TODO: Push these into question creation time.
-                hit_params = dict(params)
-                hit_params['reward'] = compute_reward(params, question.params)
-                hit_params['units'] = compute_units(params, question.params)
-
-                try:
-                    hit_type_id, hit_id = create_hit(conn, **hit_params)
-                    db.execute("""
-                        INSERT INTO mturk_hit (id, batch_id, question_batch_id, question_id, type_id, price, units, state)
-                        VALUES (%(hit_id)s, %(batch_id)s, %(question_batch_id)s,
-                            %(question_id)s, %(hit_type_id)s, %(price)s, %(units)s, %(state)s)""",
-                               cur=cur,
-                               hit_id=hit_id,
-                               batch_id=mturk_batch_id,
-                               question_batch_id=question_batch_id,
-                               question_id=question.id,
-                               hit_type_id=hit_type_id,
-                               price=hit_params['reward'],
-                               units=hit_params['units'],
-                               state="pending-annotation")
-                    logger.debug("Added HIT %s", hit_id)
-                    db.execute("""
-                        UPDATE evaluation_question
-                        SET state = %(state)s, message = %(message)s
-                        WHERE id=%(question_id)s
-                        """, cur=cur, state="pending-annotation", message="", question_id=question.id)
-
-                except ClientError as e:
-                    logger.exception(e)
-                    db.execute("""
-                        UPDATE evaluation_question
-                        SET state = %(state)s, message = %(message)s
-                        WHERE id=%(question_id)s
-                        """, cur=cur, state="error", message=str(e), question_id=question.id)
+    with db.cursor() as cur:
+        db.execute("""
+            INSERT INTO mturk_batch (params, description)
+            VALUES (%(params)s, %(description)s) RETURNING id
+            """, cur=cur, params=db.Json(params), description="")
+        mturk_batch_id = cur.fetchone()[0]
+        logger.debug("Creating new mturk_batch with id: %s", mturk_batch_id)
+
+        for question in tqdm(questions, desc="Uploading HITs"):
+            # TODO: Push these into question creation time.
+            hit_params = dict(params)
+            hit_params['reward'] = compute_reward(params, question.params)
+            hit_params['units'] = compute_units(params, question.params)
+
+            try:
+                hit_type_id, hit_id = create_hit(conn, **hit_params)
+                db.execute("""
+                    INSERT INTO mturk_hit (id, batch_id, question_batch_id, question_id, type_id, price, units, state)
+                    VALUES (%(hit_id)s, %(batch_id)s, %(question_batch_id)s,
+                        %(question_id)s, %(hit_type_id)s, %(price)s, %(units)s, %(state)s)""",
+                           cur=cur,
+                           hit_id=hit_id,
+                           batch_id=mturk_batch_id,
+                           question_batch_id=question_batch_id,
+                           question_id=question.id,
+                           hit_type_id=hit_type_id,
+                           price=hit_params['reward'],
+                           units=hit_params['units'],
+                           state="pending-annotation")
+                logger.debug("Added HIT %s", hit_id)
+                db.execute("""
+                    UPDATE evaluation_question
+                    SET state = %(state)s, message = %(message)s
+                    WHERE id=%(question_id)s
+                    """, cur=cur, state="pending-annotation", message="", question_id=question.id)
+
+            except ClientError as e:
+                logger.exception(e)
+                db.execute("""
+                    UPDATE evaluation_question
+                    SET state = %(state)s, message = %(message)s
+                    WHERE id=%(question_id)s
+                    """, cur=cur, state="error", message=str(e), question_id=question.id)
 
     return mturk_batch_id
 
@@ -348,7 +347,7 @@ def test_create_revoke_batch():
     """Test batch creation on the sandbox"""
     # TODO: Hmm... this seems dubious. We need a better approach for database testing.
     from .params.db.remote_kbpo_test import _PARAMS
-    db.CONN = db.connect(_PARAMS)
+    db.connect_pool(_PARAMS)
 
     conn = connect('sandbox')
     question_batch_id = 12
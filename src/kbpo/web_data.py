@@ -19,6 +19,7 @@ from .fleiss import computeKappa
 urllib.parse.unquote('Hern%C3%A1n_Barcos')
 
 from . import db
+from . import refresh
 from .schema import Provenance, MentionInstance, LinkInstance, RelationInstance, EvaluationMentionResponse, EvaluationLinkResponse, EvaluationRelationResponse
 
 from .defs import RELATION_TYPES, INVERTED_RELATIONS, ALL_RELATIONS, ENTITY_SLOT_TYPES
@@ -441,14 +442,13 @@ WHERE a.hit_id = h.id AND h.question_id = q.id AND h.question_batch_id = q.batch
  AND NOT a.ignored""", assignment_id = assignment_id)
 
     evaluation_mentions, evaluation_links, evaluation_relations = _parse_responses(rows)
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            db.execute("""DELETE FROM evaluation_mention_response WHERE assignment_id = %(assignment_id)s""", cur=cur, assignment_id = assignment_id)
-            db.execute("""DELETE FROM evaluation_link_response WHERE assignment_id = %(assignment_id)s""", cur=cur, assignment_id = assignment_id)
-            db.execute("""DELETE FROM evaluation_relation_response WHERE assignment_id = %(assignment_id)s""", cur=cur, assignment_id = assignment_id)
-            db.execute_values(cur, """INSERT INTO evaluation_mention_response(assignment_id, question_batch_id, question_id, doc_id, span, canonical_span, mention_type, gloss, weight) VALUES %s""", evaluation_mentions)
-            db.execute_values(cur, """INSERT INTO evaluation_link_response(assignment_id, question_batch_id, question_id, doc_id, span, link_name, correct, weight) VALUES %s""", evaluation_links)
-            db.execute_values(cur, """INSERT INTO evaluation_relation_response(assignment_id, question_batch_id, question_id, doc_id, subject, object, relation, weight) VALUES %s""", evaluation_relations)
+    with db.cursor() as cur:
+        db.execute("""DELETE FROM evaluation_mention_response WHERE assignment_id = %(assignment_id)s""", cur=cur, assignment_id = assignment_id)
+        db.execute("""DELETE FROM evaluation_link_response WHERE assignment_id = %(assignment_id)s""", cur=cur, assignment_id = assignment_id)
+        db.execute("""DELETE FROM evaluation_relation_response WHERE assignment_id = %(assignment_id)s""", cur=cur, assignment_id = assignment_id)
+        db.execute_values(cur, """INSERT INTO evaluation_mention_response(assignment_id, question_batch_id, question_id, doc_id, span, canonical_span, mention_type, gloss, weight) VALUES %s""", evaluation_mentions)
+        db.execute_values(cur, """INSERT INTO evaluation_link_response(assignment_id, question_batch_id, question_id, doc_id, span, link_name, correct, weight) VALUES %s""", evaluation_links)
+        db.execute_values(cur, """INSERT INTO evaluation_relation_response(assignment_id, question_batch_id, question_id, doc_id, subject, object, relation, weight) VALUES %s""", evaluation_relations)
 
 def parse_responses():
     """Parse all mturk_assignments in the database and repopulate the *_response tables"""
@@ -463,14 +463,13 @@ WHERE a.hit_id = h.id AND h.question_id = q.id AND h.question_batch_id = q.batch
  AND NOT a.ignored""")
     evaluation_mentions, evaluation_links, evaluation_relations = _parse_responses(rows)
 
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            cur.execute("""TRUNCATE evaluation_mention_response;""")
-            cur.execute("""TRUNCATE evaluation_link_response;""")
-            cur.execute("""TRUNCATE evaluation_relation_response;""")
-            db.execute_values(cur, """INSERT INTO evaluation_mention_response(assignment_id, question_batch_id, question_id, doc_id, span, canonical_span, mention_type, gloss, weight) VALUES %s""", evaluation_mentions)
-            db.execute_values(cur, """INSERT INTO evaluation_link_response(assignment_id, question_batch_id, question_id, doc_id, span, link_name, correct, weight) VALUES %s""", evaluation_links)
-            db.execute_values(cur, """INSERT INTO evaluation_relation_response(assignment_id, question_batch_id, question_id, doc_id, subject, object, relation, weight) VALUES %s""", evaluation_relations)
+    with db.cursor() as cur:
+        cur.execute("""TRUNCATE evaluation_mention_response;""")
+        cur.execute("""TRUNCATE evaluation_link_response;""")
+        cur.execute("""TRUNCATE evaluation_relation_response;""")
+        db.execute_values(cur, """INSERT INTO evaluation_mention_response(assignment_id, question_batch_id, question_id, doc_id, span, canonical_span, mention_type, gloss, weight) VALUES %s""", evaluation_mentions)
+        db.execute_values(cur, """INSERT INTO evaluation_link_response(assignment_id, question_batch_id, question_id, doc_id, span, link_name, correct, weight) VALUES %s""", evaluation_links)
+        db.execute_values(cur, """INSERT INTO evaluation_relation_response(assignment_id, question_batch_id, question_id, doc_id, subject, object, relation, weight) VALUES %s""", evaluation_relations)
 
 def majority_element(lst):
     return Counter(lst).most_common(1)[0][0]
@@ -692,51 +691,50 @@ def merge_evaluation_table(table, mode = 'update', hit_id = None, doc_list = Non
     merging_funcs = {'mention': _merge_evaluation_mentions, 'link': _merge_evaluation_links, 'relation': _merge_evaluation_relations}
     pkey_fields = {'mention': ('doc_id', 'span'), 'link': ('doc_id', 'span', 'link_name'), 'relation': ('doc_id', 'subject', 'object')}
 
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            if mode == 'mturk_batch':
-                assert mturk_batch_id is not None, 'mturk_batch_id needs to be supplied'
-                mode = 'doc_list'
-                doc_list = list(set([(get_doc_id(x.id),) for x in db.select("SELECT DISTINCT id FROM mturk_hit where batch_id = %(mturk_batch_id)s", mturk_batch_id = mturk_batch_id)]))
-            if mode == 'hit':
-                assert hit_id is not None, "hit_id need to be supplied"
-                mode = 'doc_list'
-                doc_list = [(get_doc_id(hit_id),)]
-                print('created doc_list')
-
-
-            cur.execute("""DROP TABLE IF EXISTS _docids_for_merging;""")
-            if mode == 'doc_list':
-                assert doc_list is not None, "doc_list need to be supplied"
-                print('creating temp table')
-                cur.execute("""CREATE TEMPORARY TABLE _docids_for_merging(doc_id TEXT);""")
-                db.execute_values(cur, """INSERT INTO _docids_for_merging VALUES %s""", doc_list)
-                cur.execute("CREATE INDEX docid_idx ON _docids_for_merging(doc_id);")
-
-            elif mode == 'all':
-                cur.execute("CREATE TEMPORARY TABLE _docids_for_merging AS (SELECT DISTINCT doc_id FROM {});".format(merging_tables[table]))
-                cur.execute("CREATE INDEX docid_idx ON _docids_for_merging(doc_id);")
-
-            elif mode == 'update':
-            #TODO: add update modes
-                raise NotImplementedError
-
-            db.execute("""
-            DROP TABLE IF EXISTS _denominator;
-            CREATE TEMP TABLE _denominator AS (
-                SELECT """+','.join(pkey_fields[table])+""", array_agg(question_id) as question_id, array_cat_agg(question_batch_id) as question_batch_id, sum(n_assignments) AS denominator
-                FROM (SELECT """+','.join(map(lambda x: 'm.'+x, pkey_fields[table]))+""", a.question_id, array_agg(DISTINCT a.question_batch_id) AS question_batch_id, a.batch_id, mode() WITHIN GROUP (ORDER BY a.mturk_batch_params#>>'{max_assignments}')::int as n_assignments
-                    FROM """+merging_tables[table]+""" AS m 
-                    JOIN _docids_for_merging AS docs 
-                        ON m.doc_id = docs.doc_id 
-                    LEFT JOIN mturk_assignment_flat AS a
-                        ON a.id = m.assignment_id
-                    GROUP BY """+','.join(map(lambda x: 'm.'+x, pkey_fields[table]))+""", a.batch_id, a.question_id) 
-                    as temp GROUP BY """+','.join(pkey_fields[table])+"""
-                );
-            """, cur)
-            merging_funcs[table](cur, '_docids_for_merging')
-            cur.execute("""DROP TABLE _docids_for_merging;""")
+    with db.cursor() as cur:
+        if mode == 'mturk_batch':
+            assert mturk_batch_id is not None, 'mturk_batch_id needs to be supplied'
+            mode = 'doc_list'
+            doc_list = list(set([(get_doc_id(x.id),) for x in db.select("SELECT DISTINCT id FROM mturk_hit where batch_id = %(mturk_batch_id)s", mturk_batch_id = mturk_batch_id)]))
+        if mode == 'hit':
+            assert hit_id is not None, "hit_id need to be supplied"
+            mode = 'doc_list'
+            doc_list = [(get_doc_id(hit_id),)]
+            print('created doc_list')
+
+
+        cur.execute("""DROP TABLE IF EXISTS _docids_for_merging;""")
+        if mode == 'doc_list':
+            assert doc_list is not None, "doc_list need to be supplied"
+            print('creating temp table')
+            cur.execute("""CREATE TEMPORARY TABLE _docids_for_merging(doc_id TEXT);""")
+            db.execute_values(cur, """INSERT INTO _docids_for_merging VALUES %s""", doc_list)
+            cur.execute("CREATE INDEX docid_idx ON _docids_for_merging(doc_id);")
+
+        elif mode == 'all':
+            cur.execute("CREATE TEMPORARY TABLE _docids_for_merging AS (SELECT DISTINCT doc_id FROM {});".format(merging_tables[table]))
+            cur.execute("CREATE INDEX docid_idx ON _docids_for_merging(doc_id);")
+
+        elif mode == 'update':
+        #TODO: add update modes
+            raise NotImplementedError
+
+        db.execute("""
+        DROP TABLE IF EXISTS _denominator;
+        CREATE TEMP TABLE _denominator AS (
+            SELECT """+','.join(pkey_fields[table])+""", array_agg(question_id) as question_id, array_cat_agg(question_batch_id) as question_batch_id, sum(n_assignments) AS denominator
+            FROM (SELECT """+','.join(map(lambda x: 'm.'+x, pkey_fields[table]))+""", a.question_id, array_agg(DISTINCT a.question_batch_id) AS question_batch_id, a.batch_id, mode() WITHIN GROUP (ORDER BY a.mturk_batch_params#>>'{max_assignments}')::int as n_assignments
+                FROM """+merging_tables[table]+""" AS m 
+                JOIN _docids_for_merging AS docs 
+                    ON m.doc_id = docs.doc_id 
+                LEFT JOIN mturk_assignment_flat AS a
+                    ON a.id = m.assignment_id
+                GROUP BY """+','.join(map(lambda x: 'm.'+x, pkey_fields[table]))+""", a.batch_id, a.question_id) 
+                as temp GROUP BY """+','.join(pkey_fields[table])+"""
+            );
+        """, cur)
+        merging_funcs[table](cur, '_docids_for_merging')
+        cur.execute("""DROP TABLE _docids_for_merging;""")
 
 
 #Deprecated
@@ -956,7 +954,7 @@ def sanitize_mention_response_table():
         LEFT JOIN sentence AS s ON m.doc_id = s.doc_id AND m.span <@ s.span);
     """);
     def clean_whitespaces():
-        print(db.CONN.cursor().mogrify(r"""UPDATE evaluation_mention_response SET gloss = replace(gloss, E'\302\240', ' ')"""))
+        db.mogrify(r"""UPDATE evaluation_mention_response SET gloss = replace(gloss, E'\302\240', ' ')""")
         db.execute(r"""UPDATE evaluation_mention_response SET gloss = replace(gloss, E'\302\240', ' ')""")
 
     clean_whitespaces()
@@ -973,20 +971,19 @@ def sanitize_mention_response_table():
         if action == 'Correct':
             continue
         elif action == 'Delete':
-            with db.CONN: 
-                with db.CONN.cursor() as cur:
-                    db.execute("""DELETE FROM evaluation_mention_response
-                    WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND span = %(span)s""", 
-                    cur = cur, 
-                    assignment_id = response.assignment_id, 
-                    doc_id = response.doc_id, 
-                    span = response.span)
-                    db.execute("""DELETE FROM evaluation_mention_response
-                    WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND canonical_span = %(span)s""", 
-                    cur = cur, 
-                    assignment_id = response.assignment_id, 
-                    doc_id = response.doc_id, 
-                    span = response.span)
+            with db.cursor() as cur:
+                db.execute("""DELETE FROM evaluation_mention_response
+                WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND span = %(span)s""", 
+                cur = cur, 
+                assignment_id = response.assignment_id, 
+                doc_id = response.doc_id, 
+                span = response.span)
+                db.execute("""DELETE FROM evaluation_mention_response
+                WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND canonical_span = %(span)s""", 
+                cur = cur, 
+                assignment_id = response.assignment_id, 
+                doc_id = response.doc_id, 
+                span = response.span)
 
 
         elif action == 'Replace gloss':
@@ -1000,28 +997,27 @@ def sanitize_mention_response_table():
             )
 
         elif action == 'Replace with suggested':
-            with db.CONN: 
-                with db.CONN.cursor() as cur:
-                    db.execute("""UPDATE evaluation_mention_response
-                    SET span = %(new_span)s, gloss = %(new_gloss)s, canonical_span = %(new_canonical_span)s
-                    WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND span = %(span)s""", 
-                    cur = cur, 
-                    assignment_id = response.assignment_id, 
-                    doc_id = response.doc_id, 
-                    span = response.span, 
-                    new_span = response.sm_span, 
-                    new_gloss = response.sm_gloss,
-                    new_canonical_span = response.sm_canonical_span
-                    )
-                    db.execute("""UPDATE evaluation_mention_response
-                    SET canonical_span = %(new_span)s
-                    WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND canonical_span = %(span)s""", 
-                    cur = cur, 
-                    assignment_id = response.assignment_id, 
-                    doc_id = response.doc_id, 
-                    span = response.span,
-                    new_span = response.sm_span
-                    )
+            with db.cursor() as cur:
+                db.execute("""UPDATE evaluation_mention_response
+                SET span = %(new_span)s, gloss = %(new_gloss)s, canonical_span = %(new_canonical_span)s
+                WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND span = %(span)s""", 
+                cur = cur, 
+                assignment_id = response.assignment_id, 
+                doc_id = response.doc_id, 
+                span = response.span, 
+                new_span = response.sm_span, 
+                new_gloss = response.sm_gloss,
+                new_canonical_span = response.sm_canonical_span
+                )
+                db.execute("""UPDATE evaluation_mention_response
+                SET canonical_span = %(new_span)s
+                WHERE assignment_id = %(assignment_id)s AND doc_id = %(doc_id)s AND canonical_span = %(span)s""", 
+                cur = cur, 
+                assignment_id = response.assignment_id, 
+                doc_id = response.doc_id, 
+                span = response.span,
+                new_span = response.sm_span
+                )
         else:
             assert False, "Undefined action:"+ action
         
@@ -1064,16 +1060,15 @@ def verify_evaluation_relation_response():
 
 
     values = [{'assignment_id':k, 'flag': v, 'message': 'Incorrect relation' if flag == False else None} for k, v in assignment2flag.items()]
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            db.execute_values(cur, b"""
-            UPDATE mturk_assignment AS m 
-            SET verified = c.flag, 
-                state='pending-payment' ,
-                message = c.message
-            FROM (values %s ) AS c(assignment_id, flag, message) 
-            WHERE c.assignment_id = id AND state='pending-verification';
-            """, values, template = "(%(assignment_id)s, %(flag)s, %(message)s)")
+    with db.cursor() as cur:
+        db.execute_values(cur, b"""
+        UPDATE mturk_assignment AS m 
+        SET verified = c.flag, 
+            state='pending-payment' ,
+            message = c.message
+        FROM (values %s ) AS c(assignment_id, flag, message) 
+        WHERE c.assignment_id = id AND state='pending-verification';
+        """, values, template = "(%(assignment_id)s, %(flag)s, %(message)s)")
 
 def verify_evaluation_mention_response(question_id = None):
     """Looks at extracted mention responses and applies basic filtering to approve or reject HITs"""
@@ -1102,79 +1097,76 @@ def verify_evaluation_mention_response(question_id = None):
     for assignment_id, z in tqdm(assignment2z.items()):
         flag = z > 0.50
         values.append({'flag' : flag, 'assignment_id' : assignment_id, 'message':'Too few mentions extracted for this document.' if flag == False else None})
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            db.execute_values(cur, b"""
-            UPDATE mturk_assignment AS m
-            SET verified = c.flag, 
-                state='pending-payment',
-                message=c.message
-            FROM (values %s ) 
-            AS c(assignment_id, flag, message) 
-            WHERE c.assignment_id = id AND state='pending-verification';""", 
-            values, template = "(%(assignment_id)s, %(flag)s, %(message)s)")
+    with db.cursor() as cur:
+        db.execute_values(cur, b"""
+        UPDATE mturk_assignment AS m
+        SET verified = c.flag, 
+            state='pending-payment',
+            message=c.message
+        FROM (values %s ) 
+        AS c(assignment_id, flag, message) 
+        WHERE c.assignment_id = id AND state='pending-verification';""", 
+        values, template = "(%(assignment_id)s, %(flag)s, %(message)s)")
 
 def check_batch_complete(mturk_batch_id):
     """Check if all assignments for an mturk_batch have been collected"""
 
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            rows = db.select("""
-            SELECT a.hit_id,
-                SUM(CASE WHEN a.state <> 'error' and NOT a.ignored THEN 1 ELSE 0 END) assignments_for_aggregation,
-                (b.params->>'max_assignments')::int AS max_assignments, 
-                SUM(CASE WHEN a.state <> 'error' AND NOT a.ignored  THEN 1 ELSE 0 END) = (b.params->>'max_assignments')::int AS hit_complete,
-                SUM(CASE WHEN a.state = 'error' AND NOT a.ignored THEN 1 ELSE 0 END) AS hit_errors
-
-            FROM mturk_assignment AS a 
-            LEFT JOIN mturk_hit AS h 
-                ON a.hit_id = h.id 
-            LEFT JOIN mturk_batch as b 
-                ON a.batch_id = b.id 
-            WHERE a.batch_id = %(mturk_batch_id)s 
-            GROUP BY a.hit_id, b.params->>'max_assignments';
-            """, 
-            mturk_batch_id = mturk_batch_id, cur = cur)
-            #TODO: Throw useful error message if the assigment doesn't exist or has incorrect hit/batch_id
-            #for row in rows:
-            #    if row.hit_errors >= 1:
-            #        db.execute("UPDATE mturk_assignment SET ignored=true WHERE hit_id = %(hit_id)s", hit_id = row.hit_id)
-            #hit_completed = [x.hit_complete for x in rows if x.hit_errors == 0]
-            ignored = False
-            for row in rows:
-                if row.assignments_for_aggregation > row.max_assignments:
-                    ignored = True
-                    ignore_extra_assignments(row.hit_id)
-
-            #Recursive call to make sure the assignments to be ignored are indeed ignored
-            if ignored:
-                return check_batch_complete(mturk_batch_id)
-
-            hit_completed = [x.hit_complete for x in rows]
-            logger.debug("Batch id %s: Incomplete hits %s", mturk_batch_id, [x.hit_id for x in rows if not x.hit_complete])
+    with db.cursor() as cur:
+        rows = db.select("""
+        SELECT a.hit_id,
+            SUM(CASE WHEN a.state <> 'error' and NOT a.ignored THEN 1 ELSE 0 END) assignments_for_aggregation,
+            (b.params->>'max_assignments')::int AS max_assignments, 
+            SUM(CASE WHEN a.state <> 'error' AND NOT a.ignored  THEN 1 ELSE 0 END) = (b.params->>'max_assignments')::int AS hit_complete,
+            SUM(CASE WHEN a.state = 'error' AND NOT a.ignored THEN 1 ELSE 0 END) AS hit_errors
+
+        FROM mturk_assignment AS a 
+        LEFT JOIN mturk_hit AS h 
+            ON a.hit_id = h.id 
+        LEFT JOIN mturk_batch as b 
+            ON a.batch_id = b.id 
+        WHERE a.batch_id = %(mturk_batch_id)s 
+        GROUP BY a.hit_id, b.params->>'max_assignments';
+        """, 
+        mturk_batch_id = mturk_batch_id, cur = cur)
+        #TODO: Throw useful error message if the assigment doesn't exist or has incorrect hit/batch_id
+        #for row in rows:
+        #    if row.hit_errors >= 1:
+        #        db.execute("UPDATE mturk_assignment SET ignored=true WHERE hit_id = %(hit_id)s", hit_id = row.hit_id)
+        #hit_completed = [x.hit_complete for x in rows if x.hit_errors == 0]
+        ignored = False
+        for row in rows:
+            if row.assignments_for_aggregation > row.max_assignments:
+                ignored = True
+                ignore_extra_assignments(row.hit_id)
+
+        #Recursive call to make sure the assignments to be ignored are indeed ignored
+        if ignored:
+            return check_batch_complete(mturk_batch_id)
+
+        hit_completed = [x.hit_complete for x in rows]
+        logger.debug("Batch id %s: Incomplete hits %s", mturk_batch_id, [x.hit_id for x in rows if not x.hit_complete])
     return len(hit_completed) > 0 and all(hit_completed)
 
 def ignore_extra_assignments(hit_id):
     """Set flag to ignore if extra hits come up"""
-    with db.CONN:
-        with db.CONN.cursor() as cur:
-            rows = db.select("""
-            SELECT a.id, (b.params->>'max_assignments')::int as max_assignments
-            FROM mturk_assignment AS a 
-            LEFT JOIN mturk_hit AS h 
-                ON a.hit_id = h.id 
-            LEFT JOIN mturk_batch as b 
-                ON a.batch_id = b.id 
-            WHERE a.hit_id = %(hit_id)s 
-              AND a.state <> 'error' 
-              AND NOT a.ignored
-            ORDER BY a.created desc;
-            """, hit_id = hit_id, cur = cur)
-            for row in rows[rows[0].max_assignments:]:
-                db.execute("""UPDATE mturk_assignment 
-                                SET ignored=true, message='Extraneous assignments are ignored'
-                              WHERE id = %(assignment_id)s
-                        """, assignment_id = row.id, cur = cur)
+    with db.cursor() as cur:
+        rows = db.select("""
+        SELECT a.id, (b.params->>'max_assignments')::int as max_assignments
+        FROM mturk_assignment AS a 
+        LEFT JOIN mturk_hit AS h 
+            ON a.hit_id = h.id 
+        LEFT JOIN mturk_batch as b 
+            ON a.batch_id = b.id 
+        WHERE a.hit_id = %(hit_id)s 
+          AND a.state <> 'error' 
+          AND NOT a.ignored
+        ORDER BY a.created desc;
+        """, hit_id = hit_id, cur = cur)
+        for row in rows[rows[0].max_assignments:]:
+            db.execute("""UPDATE mturk_assignment 
+                            SET ignored=true, message='Extraneous assignments are ignored'
+                          WHERE id = %(assignment_id)s
+                    """, assignment_id = row.id, cur = cur)
 
 
 def check_hit_complete(hit_id):
@@ -1245,10 +1237,10 @@ def merge_evaluation_tables(mode="mturk_batch", mturk_batch_id=None):
         merge_evaluation_table('relation', mode, mturk_batch_id = mturk_batch_id)
 
         logger.info("Refreshing submission_entries tables with new data")
-        db.execute("""REFRESH MATERIALIZED VIEW evaluation_mention_link""")
-        db.execute("""REFRESH MATERIALIZED VIEW evaluation_entity_relation""")
-        db.execute("""REFRESH MATERIALIZED VIEW submission_entries_list""")
-        db.execute("""REFRESH MATERIALIZED VIEW submission_entries""")
+        # Scoring reads these views right after, so wait for any
+        # concurrent refresh rather than skipping it.
+        refresh.request_refresh("evaluation_mention_link")
+        refresh.refresh_views(wait=True)
     else:
         raise ValueError("Unsupported mode {}".format(mode))
 
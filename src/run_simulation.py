@@ -323,7 +323,7 @@ def do_simulate_n(args):
             if args.mode == "simple":
                 n_samples_ = n_samples
             elif args.mode == "joint":
-                n_samples_ = estimate_n_samples(Phs, Xhs, Ws=W_, Zs=Z_, Qs=Q_, target=n_samples)
+                n_samples_ = estimate_n_samples(Phs, Xhs, target=n_samples)
 
             Xh = sample_with_replacement(P, n_samples_, X)
             N += len(Xh)
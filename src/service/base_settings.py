@@ -127,6 +127,11 @@ LOGOUT_REDIRECT_URL = '/'
 CELERY_RESULT_BROKER = 'ampq'
 CELERY_RESULT_BACKEND = 'rpc'
 CELERY_WORKER_CONCURRENCY = 1
+# Processes used to validate a single submission.
+VALIDATION_WORKERS = 1
+# Seconds to wait before refreshing materialized views, so that
+# refresh requests made in the meantime are served by one refresh.
+REFRESH_DEBOUNCE = 30
 
 # NPM setup
 NPM_ROOT_PATH = os.path.join(BASE_DIR, "static")
@@ -161,6 +161,13 @@ class Submission(models.Model):
         """
         return os.path.join(settings.MEDIA_ROOT, 'submissions', '{}.m.gz'.format(self.id))
 
+    @property
+    def columns_filename(self):
+        """
+        The directory of the validated submission in the columnar format (see kbpo.columns).
+        """
+        return os.path.join(settings.MEDIA_ROOT, 'submissions', '{}.m.columns'.format(self.id))
+
     @property
     def original_file(self):
         if os.path.exists(self.original_filename):
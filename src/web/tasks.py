@@ -1,6 +1,7 @@
 """
 Celery tasks
 """
+import os
 import sys
 import gzip
 import logging
@@ -10,13 +11,15 @@ from celery import shared_task
 
 from django.core.exceptions import ObjectDoesNotExist
 
-from service.settings import MTURK_TARGET
+from service.settings import MTURK_TARGET, MEDIA_ROOT, VALIDATION_WORKERS, REFRESH_DEBOUNCE
 
 from kbpo import db
 from kbpo import api
+from kbpo import refresh
 from kbpo.parser import MFileReader, TacKbReader
-from kbpo.evaluation_api import get_updated_scores, update_score
-from kbpo.sampling import sample_submission as _sample_submission
+from kbpo.columns import ColumnWriter, load_columns
+from kbpo.evaluation_api import get_incremental_scores, update_score
+from kbpo.sampling import sample_submission as _sample_submission, sample_submission_stratified, sample_submission_reuse, estimate_submission_n_samples
 from kbpo.questions import create_evaluation_batch_for_submission_sample
 from kbpo.turk import connect, create_batch, mturk_batch_payments, retrieve_assignments_for_mturk_batch
 from kbpo.web_data import parse_response,\
@@ -61,16 +64,31 @@ def validate_submission(submission_id, file_format, chain=True):
             _logger.setLevel(logging.INFO)
             _logger.addHandler(logging.StreamHandler(log_file))
 
-            with gzip.open(submission.original_filename, 'rt', encoding="utf-8") as f:
-                # Check that it has the right format, aka validate it.
-                mfile = reader.parse(f, doc_ids=doc_ids, logger=_logger)
+            # The parsed file is saved both as an m-file (for users)
+            # and in a columnar format that process_submission loads
+            # without parsing it again.
+            columns = ColumnWriter()
+            with gzip.open(submission.original_filename, 'rt', encoding="utf-8") as f,\
+                    gzip.open(submission.uploaded_filename, 'wt', encoding="utf-8") as g:
+                # Check that it has the right format, aka validate it, and save the parsed file.
+                if file_format == "mfile" and VALIDATION_WORKERS == 1:
+                    # m-files are document-local: validate and write one document at a time.
+                    n_types, n_relations = 0, 0
+                    for _, mfile in reader.iter_documents(f, doc_ids=doc_ids, logger=_logger):
+                        mfile.write(g)
+                        columns.add(mfile)
+                        n_types += len(mfile.types)
+                        n_relations += len(mfile.relations)
+                else:
+                    mfile = reader.parse(f, doc_ids=doc_ids, logger=_logger, workers=VALIDATION_WORKERS)
+                    mfile.write(g)
+                    columns.add(mfile)
+                    n_types, n_relations = len(mfile.types), len(mfile.relations)
         # TODO: We never stop the submission even if there are errors (maybe this should be reconsidered?)
-        assert len(mfile.types) > 0, "Uploaded submission file does not define any mentions"
-        assert len(mfile.relations) > 0, "Uploaded submission file does not define any relations"
+        assert n_types > 0, "Uploaded submission file does not define any mentions"
+        assert n_relations > 0, "Uploaded submission file does not define any relations"
 
-        # Save parsed file.
-        with gzip.open(submission.uploaded_filename, 'wt', encoding="utf-8") as f:
-            mfile.write(f)
+        columns.save(submission.columns_filename)
 
         # Update state of submission.
         state.status = 'pending-upload'
@@ -102,17 +120,25 @@ def process_submission(submission_id, chain=True):
         return
 
     try:
-        reader = MFileReader()
-        doc_ids = set(r.doc_id for r in db.select("SELECT doc_id FROM document_tag WHERE tag = %(tag)s", tag=submission.corpus_tag))
-        with gzip.open(submission.uploaded_filename, 'rt', encoding="utf-8") as f:
-            mfile = reader.parse(f, doc_ids=doc_ids, logger=logger)
+        if os.path.exists(submission.columns_filename):
+            # Already validated by validate_submission; uploaded one document at a time.
+            mfile = load_columns(submission.columns_filename)
+        else:
+            reader = MFileReader()
+            doc_ids = set(r.doc_id for r in db.select("SELECT doc_id FROM document_tag WHERE tag = %(tag)s", tag=submission.corpus_tag))
+            with gzip.open(submission.uploaded_filename, 'rt', encoding="utf-8") as f:
+                mfile = reader.parse(f, doc_ids=doc_ids, logger=logger)
         api.upload_submission(submission_id, mfile)
+        # Refreshed after a delay so that uploads in quick succession
+        # share one refresh of submission_entries.
+        refresh.request_refresh("submission_entries_list")
+        refresh_views.apply_async(countdown=REFRESH_DEBOUNCE)
 
         # Update state of submission.
         state.status = 'pending-sampling'
         state.save()
         if chain:
-            sample_submission.delay(submission_id, n_samples=500)
+            sample_submission.delay(submission_id)
     except Exception as e:
         logger.exception(e)
         state.status = 'error'
@@ -120,10 +146,23 @@ def process_submission(submission_id, chain=True):
         state.save()
 
 @shared_task
-def sample_submission(submission_id, type_='entity_relation', n_samples=500, chain=True):
-    #TODO: Get the correct number of samples inside this function
+def refresh_views():
+    """
+    Refreshes the materialized views with pending refresh requests;
+    views that are being refreshed by another task are left to it.
+    """
+    refresh.refresh_views(wait=False)
+
+@shared_task
+def sample_submission(submission_id, type_='entity_relation', n_samples=None, chain=True, stratify_by=None, adaptive=False, reuse=False):
     """
     Takes care of sampling from a submission to create evaluation_question and evaluation_batch.
+    If @n_samples is None, it is planned from the samples of the other submissions.
+    With @stratify_by ("relation" or "entity"), draws a stratified batch
+    instead (see kbpo.sampling.sample_submission_stratified). With
+    @reuse, the instances that have already been annotated are added to
+    the batch and fresh samples are only drawn for the rest (see
+    kbpo.sampling.sample_submission_reuse).
     """
     assert Submission.objects.filter(id=submission_id).count() > 0,\
             "Submission {} does not exist!".format(submission_id)
@@ -138,7 +177,16 @@ def sample_submission(submission_id, type_='entity_relation', n_samples=500, cha
         return
 
     try:
-        sample_batch_id = _sample_submission(submission.corpus_tag, submission_id, type_, n_samples)
+        if n_samples is None:
+            n_samples = estimate_submission_n_samples(submission.corpus_tag, submission_id, type_)
+        if reuse:
+            # The annotations of this submission are read from submission_entries.
+            refresh.refresh_views(["submission_entries_list"], wait=True)
+            sample_batch_id = sample_submission_reuse(submission.corpus_tag, submission_id, type_, n_samples)
+        elif stratify_by is not None:
+            sample_batch_id = sample_submission_stratified(submission.corpus_tag, submission_id, type_, n_samples, by=stratify_by, adaptive=adaptive)
+        else:
+            sample_batch_id = _sample_submission(submission.corpus_tag, submission_id, type_, n_samples, in_database=True)
         assert len(api.get_samples(sample_batch_id)) > 0, "Sample did not generate any samples!"
 
         #Update the status of submission
@@ -314,8 +362,9 @@ def score_submission(submission_id, chain=True):
         return
 
     try:
-        for (submission_id, score_type), metric in get_updated_scores(submission.corpus_tag):
-            update_score(submission_id, score_type, metric)
+        state_path = os.path.join(MEDIA_ROOT, 'scores', '{}.npz'.format(submission.corpus_tag))
+        for (submission_id_, score_type), metric in get_incremental_scores(submission.corpus_tag, submission_id, state_path):
+            update_score(submission_id_, score_type, metric)
         state.status = "done"
         state.save()
 